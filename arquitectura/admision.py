@@ -0,0 +1,331 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Pattern, Tuple
+
+from starlette.routing import compile_path
+
+from conexion import POOL_MAXIMO
+from serializacion import RespuestaORJSON
+
+# Control de admisión de peticiones, para que una ráfaga de listados pesados no agote el pool de
+# MongoDB ni la latencia de las demás rutas. Los límites son por proceso: con varios workers,
+# cada uno aplica los suyos.
+ADMISION_ACTIVA = os.getenv("ARQUITECTURA_ADMISION", "1") != "0"
+# Peticiones en curso a la vez; por omisión, las conexiones del pool de MongoDB
+EN_VUELO_MAX = int(os.getenv("ARQUITECTURA_EN_VUELO_MAX", str(POOL_MAXIMO)))
+# Parte de esos cupos que pueden ocupar los listados y reportes; el resto queda para las
+# consultas por id y las escrituras
+EN_VUELO_CONSULTAS = int(os.getenv("ARQUITECTURA_EN_VUELO_CONSULTAS", str(max(1, EN_VUELO_MAX * 3 // 4))))
+# Peticiones que esperan un cupo, por carril: los listados encolados no dejan sin lugar a las
+# consultas por id
+COLA_MAX = int(os.getenv("ARQUITECTURA_COLA_ADMISION_MAX", "500"))
+ESPERA_MAX_SEGUNDOS = float(os.getenv("ARQUITECTURA_ESPERA_ADMISION_MS", "2000")) / 1000
+# Cubetas de fichas con el formato tasa/ráfaga (peticiones por segundo / acumuladas); vacío,
+# sin límite. LIMITES_RUTA lleva entradas "GET /proyectos/estado/{estado}=20/40" separadas por ";",
+# y LIMITE_RUTA_CONSULTA se aplica a cada listado o reporte sin entrada propia.
+LIMITE_CLIENTE = os.getenv("ARQUITECTURA_LIMITE_CLIENTE", "")
+LIMITES_RUTA = os.getenv("ARQUITECTURA_LIMITES_RUTA", "")
+LIMITE_RUTA_CONSULTA = os.getenv("ARQUITECTURA_LIMITE_RUTA_CONSULTA", "")
+CLIENTES_MAX = int(os.getenv("ARQUITECTURA_ADMISION_CLIENTES_MAX", "10000"))
+# Detrás de un proxy, el cliente es la primera dirección de X-Forwarded-For
+CONFIAR_PROXY = os.getenv("ARQUITECTURA_CONFIAR_PROXY", "0") == "1"
+
+# Carriles en orden de prioridad: al liberarse un cupo se despierta primero a las consultas
+# por id, luego a las escrituras y al final a los listados
+CARRILES = ("por_id", "escritura", "consulta")
+# Rutas que nunca se limitan, para poder observar el servicio mientras descarta carga
+EXENTAS = ("/admin", "/metrics", "/docs", "/redoc", "/openapi.json")
+# Flujos de larga duración: pasan por las cubetas pero no ocupan cupo
+SIN_CUPO = {"/eventos/{coleccion}"}
+METODOS_LECTURA = {"GET", "HEAD"}
+# Extensión de OpenAPI con la que una ruta declara su carril al registrarse, por ejemplo
+# openapi_extra=carril("por_id"); del camino no se puede deducir (/pedidos/proyecto/{idProyecto}
+# termina en un id y es un listado)
+EXTENSION_CARRIL = "x-carril"
+
+
+def carril(nombre: str) -> dict:
+    return {EXTENSION_CARRIL: nombre}
+
+
+class Cubeta:
+    __slots__ = ("tasa", "capacidad", "fichas", "actualizada")
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.actualizada = time.monotonic()
+
+    # Segundos hasta la siguiente ficha; 0 si se tomó una
+    def tomar(self, ahora: float) -> float:
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.actualizada) * self.tasa)
+        self.actualizada = ahora
+        if self.fichas >= 1:
+            self.fichas -= 1
+            return 0.0
+        return (1 - self.fichas) / self.tasa
+
+
+def _limite(texto: str) -> Optional[Tuple[float, float]]:
+    texto = texto.strip()
+    if not texto:
+        return None
+    tasa, _, rafaga = texto.partition("/")
+    return float(tasa), float(rafaga or tasa)
+
+
+def _limites_ruta(texto: str) -> Dict[Tuple[str, str], Tuple[float, float]]:
+    limites = {}
+    for entrada in texto.split(";"):
+        if entrada.strip():
+            ruta, _, limite = entrada.rpartition("=")
+            metodo, _, plantilla = ruta.strip().partition(" ")
+            limites[(metodo.upper(), plantilla.strip())] = _limite(limite)
+    return limites
+
+
+# Cubetas por cliente (las menos usadas se olvidan pasado CLIENTES_MAX) y por ruta
+class Limitador:
+    def __init__(self, cliente: Optional[Tuple[float, float]], rutas: Dict[Tuple[str, str], Tuple[float, float]], consulta: Optional[Tuple[float, float]]):
+        self.cliente = cliente
+        self.rutas = rutas
+        self.consulta = consulta
+        self.clientes: "OrderedDict[str, Cubeta]" = OrderedDict()
+        self.cubetas_ruta: Dict[Tuple[str, str], Cubeta] = {}
+
+    # Devuelve None si se admite o (motivo, segundos para reintentar)
+    def tomar(self, cliente: str, metodo: str, plantilla: str, carril: str, ahora: float) -> Optional[Tuple[str, float]]:
+        if self.cliente is not None:
+            cubeta = self.clientes.get(cliente)
+            if cubeta is None:
+                cubeta = self.clientes[cliente] = Cubeta(*self.cliente)
+                if len(self.clientes) > CLIENTES_MAX:
+                    self.clientes.popitem(last=False)
+            else:
+                self.clientes.move_to_end(cliente)
+            espera = cubeta.tomar(ahora)
+            if espera:
+                return "limite_cliente", espera
+        llave = (metodo, plantilla)
+        limite = self.rutas.get(llave, self.consulta if carril == "consulta" else None)
+        if limite is not None:
+            cubeta = self.cubetas_ruta.get(llave)
+            if cubeta is None:
+                cubeta = self.cubetas_ruta[llave] = Cubeta(*limite)
+            espera = cubeta.tomar(ahora)
+            if espera:
+                return "limite_ruta", espera
+        return None
+
+
+# Semáforo con cola acotada y carriles de prioridad. Cada carril tiene su tope dentro del total,
+# así que los listados nunca ocupan todos los cupos; dentro de un carril se atiende por llegada.
+class Cupos:
+    def __init__(self, total: int, topes: Dict[str, int], cola_max: int):
+        self.total = total
+        self.topes = topes
+        self.cola_max = cola_max
+        self.en_vuelo = 0
+        self.en_cola = 0
+        self.por_carril: Counter = Counter()
+        self.encoladas: Counter = Counter()
+        self.esperando: Dict[str, Deque[asyncio.Future]] = {carril: deque() for carril in CARRILES}
+
+    def _cabe(self, carril: str) -> bool:
+        return self.en_vuelo < self.total and self.por_carril[carril] < self.topes.get(carril, self.total)
+
+    def _ocupar(self, carril: str):
+        self.en_vuelo += 1
+        self.por_carril[carril] += 1
+
+    # Devuelve None con el cupo tomado, o el motivo del rechazo
+    async def adquirir(self, carril: str, espera: float) -> Optional[str]:
+        cola = self.esperando[carril]
+        if self._cabe(carril) and not cola:
+            self._ocupar(carril)
+            return None
+        if len(cola) >= self.cola_max:
+            return "cola_llena"
+        self.encoladas[carril] += 1
+        bucle = asyncio.get_running_loop()
+        futuro = bucle.create_future()
+        cola.append(futuro)
+        self.en_cola += 1
+        temporizador = bucle.call_later(espera, lambda: futuro.done() or futuro.set_result(False))
+        try:
+            concedido = await futuro
+        except asyncio.CancelledError:
+            # Si el cupo llegó justo antes de cancelarse la petición, se devuelve
+            if futuro.done() and not futuro.cancelled() and futuro.result():
+                self.liberar(carril)
+            raise
+        finally:
+            temporizador.cancel()
+            self.en_cola -= 1
+            if futuro in cola:
+                cola.remove(futuro)
+        return None if concedido else "espera_agotada"
+
+    def liberar(self, carril: str):
+        self.en_vuelo -= 1
+        self.por_carril[carril] -= 1
+        for siguiente in CARRILES:
+            cola = self.esperando[siguiente]
+            while cola and self._cabe(siguiente):
+                futuro = cola.popleft()
+                if not futuro.done():
+                    self._ocupar(siguiente)
+                    futuro.set_result(True)
+
+
+limitador = Limitador(_limite(LIMITE_CLIENTE), _limites_ruta(LIMITES_RUTA), _limite(LIMITE_RUTA_CONSULTA))
+cupos = Cupos(EN_VUELO_MAX, {"consulta": EN_VUELO_CONSULTAS}, COLA_MAX)
+admitidas: Counter = Counter()
+rechazos: Counter = Counter()
+rechazos_por_ruta: Counter = Counter()
+
+
+# Sin carril declarado, las lecturas van con los listados; /batch-get es un POST que solo lee
+def carril_de(metodo: str, plantilla: str, declarado: Optional[str] = None) -> str:
+    if declarado in CARRILES:
+        return declarado
+    if metodo in METODOS_LECTURA:
+        return "consulta"
+    if plantilla.endswith("/batch-get"):
+        return "consulta"
+    return "escritura"
+
+
+def _cliente(scope) -> str:
+    if CONFIAR_PROXY:
+        for nombre, valor in scope["headers"]:
+            if nombre == b"x-forwarded-for":
+                return valor.decode("latin-1").split(",")[0].strip()
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "desconocido"
+
+
+# Middleware ASGI. La plantilla de la ruta aún no se conoce antes del enrutado, así que se
+# busca en las rutas del esquema OpenAPI (agrupadas por su primer segmento); las rutas con
+# segmentos fijos se prueban antes que las que tienen parámetros en la misma posición.
+class ControlAdmision:
+    def __init__(self, app):
+        self.app = app
+        self._plantillas: Optional[Dict[str, List[Tuple[Pattern, str, Dict[str, str]]]]] = None
+
+    # Por cada plantilla, el carril de cada método
+    def _indexar(self, aplicacion) -> Dict[str, List[Tuple[Pattern, str, Dict[str, str]]]]:
+        indice: Dict[str, List[Tuple[Pattern, str, Dict[str, str]]]] = {}
+        rutas = sorted(aplicacion.openapi().get("paths", {}).items(), key=lambda par: [segmento.startswith("{") for segmento in par[0].split("/")])
+        for plantilla, operaciones in rutas:
+            expresion = compile_path(plantilla)[0]
+            carriles = {
+                metodo.upper(): carril_de(metodo.upper(), plantilla, operacion.get(EXTENSION_CARRIL))
+                for metodo, operacion in operaciones.items()
+            }
+            if "GET" in carriles:
+                carriles["HEAD"] = carriles["GET"]
+            indice.setdefault(plantilla.split("/")[1], []).append((expresion, plantilla, carriles))
+        return indice
+
+    # (plantilla, carril) de la petición, o None si no corresponde a ninguna ruta
+    def _ruta(self, scope) -> Optional[Tuple[str, str]]:
+        if self._plantillas is None:
+            self._plantillas = self._indexar(scope["app"])
+        ruta = scope["path"]
+        for expresion, plantilla, carriles in self._plantillas.get(ruta.split("/")[1], ()):
+            if scope["method"] in carriles and expresion.match(ruta):
+                return plantilla, carriles[scope["method"]]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISION_ACTIVA or scope["path"].startswith(EXENTAS):
+            await self.app(scope, receive, send)
+            return
+        metodo = scope["method"]
+        encontrada = self._ruta(scope)
+        if encontrada is None:
+            # Rutas inexistentes: el 404 o 405 no toca MongoDB
+            await self.app(scope, receive, send)
+            return
+        plantilla, carril = encontrada
+        limite = limitador.tomar(_cliente(scope), metodo, plantilla, carril, time.monotonic())
+        if limite is not None:
+            motivo, espera = limite
+            estado = 429 if motivo == "limite_cliente" else 503
+            await self._rechazar(scope, receive, send, metodo, plantilla, carril, motivo, estado, espera)
+            return
+        if plantilla in SIN_CUPO:
+            admitidas[carril] += 1
+            await self.app(scope, receive, send)
+            return
+        motivo = await cupos.adquirir(carril, ESPERA_MAX_SEGUNDOS)
+        if motivo is not None:
+            await self._rechazar(scope, receive, send, metodo, plantilla, carril, motivo, 503, ESPERA_MAX_SEGUNDOS)
+            return
+        admitidas[carril] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cupos.liberar(carril)
+
+    @staticmethod
+    async def _rechazar(scope, receive, send, metodo, plantilla, carril, motivo, estado, espera):
+        rechazos[(motivo, carril)] += 1
+        rechazos_por_ruta[(metodo, plantilla, motivo)] += 1
+        detalle = "Demasiadas peticiones" if estado == 429 else "Servicio saturado; reintente más tarde"
+        respuesta = RespuestaORJSON({"detail": detalle}, status_code=estado, headers={"Retry-After": str(max(1, math.ceil(espera)))})
+        await respuesta(scope, receive, send)
+
+
+def estadisticas() -> dict:
+    return {
+        "activa": ADMISION_ACTIVA,
+        "en_vuelo": cupos.en_vuelo,
+        "en_vuelo_max": cupos.total,
+        "en_vuelo_por_carril": {carril: cupos.por_carril[carril] for carril in CARRILES},
+        "topes": {carril: cupos.topes.get(carril, cupos.total) for carril in CARRILES},
+        "en_cola": cupos.en_cola,
+        "cola_max": cupos.cola_max,
+        "admitidas": {carril: admitidas[carril] for carril in CARRILES},
+        "encoladas": {carril: cupos.encoladas[carril] for carril in CARRILES},
+        "rechazos": [
+            {"motivo": motivo, "carril": carril, "peticiones": veces} for (motivo, carril), veces in sorted(rechazos.items())
+        ],
+        "rechazos_por_ruta": [
+            {"metodo": metodo, "ruta": plantilla, "motivo": motivo, "peticiones": veces}
+            for (metodo, plantilla, motivo), veces in rechazos_por_ruta.most_common()
+        ],
+    }
+
+
+# Series para /metrics: carga descartada por motivo y carril, y ocupación actual
+def exponer_metricas() -> str:
+    lineas = [
+        "# HELP arquitectura_admision_rechazos_total Peticiones descartadas por el control de admisión",
+        "# TYPE arquitectura_admision_rechazos_total counter",
+    ]
+    for (motivo, carril), veces in sorted(rechazos.items()):
+        lineas.append(f'arquitectura_admision_rechazos_total{{motivo="{motivo}",carril="{carril}"}} {veces}')
+    lineas += [
+        "# HELP arquitectura_admision_admitidas_total Peticiones admitidas por carril",
+        "# TYPE arquitectura_admision_admitidas_total counter",
+    ]
+    for carril in CARRILES:
+        lineas.append(f'arquitectura_admision_admitidas_total{{carril="{carril}"}} {admitidas[carril]}')
+    lineas += [
+        "# HELP arquitectura_admision_en_vuelo Peticiones ocupando un cupo",
+        "# TYPE arquitectura_admision_en_vuelo gauge",
+    ]
+    for carril in CARRILES:
+        lineas.append(f'arquitectura_admision_en_vuelo{{carril="{carril}"}} {cupos.por_carril[carril]}')
+    lineas += [
+        "# HELP arquitectura_admision_en_cola Peticiones esperando un cupo",
+        "# TYPE arquitectura_admision_en_cola gauge",
+        f"arquitectura_admision_en_cola {cupos.en_cola}",
+    ]
+    return "\n".join(lineas) + "\n"
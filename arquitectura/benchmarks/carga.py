@@ -0,0 +1,304 @@
+"""Prueba de carga de la API completa a través de un cliente ASGI, sin servidor HTTP.
+
+Siembra una base de benchmark con benchmarks.datos, recorre todas las rutas del
+esquema OpenAPI y, para cada una, lanza --peticiones peticiones con --concurrencia
+peticiones simultáneas. Reporta rendimiento y latencias p50/p95/p99 por ruta y
+guarda el resultado en JSON para compararlo con corridas anteriores.
+
+Uso, desde arquitectura/:
+    python -m benchmarks.carga --mongomock                       # sustituto en memoria
+    python -m benchmarks.carga --escala 1000 --concurrencia 64   # mongod en ARQUITECTURA_MONGO_URL
+    python -m benchmarks.carga --rutas "^GET /proyectos" --comparar benchmarks/resultados/base.json
+
+Con --comparar, termina con código 1 si el p95 de alguna ruta empeora más que --umbral por ciento.
+Con --mongomock algunas etapas de agregación ($text, $indexStats, $replaceAll) no
+existen y las rutas que las usan aparecen con errores; los números comparables son los de mongod.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+import conexion
+from benchmarks.datos import BD_BENCHMARK, COLECCIONES, INICIO, Generador, sembrar, usar_base
+
+DIRECTORIO_RESULTADOS = Path(__file__).resolve().parent / "resultados"
+
+# Parámetro de ruta -> colección de la que sale el id
+IDS = {
+    "idProyecto": "proyectos",
+    "idMaterial": "materiales",
+    "idProveedor": "proveedores",
+    "idPedido": "pedidos",
+    "idCliente": "clientes",
+    "idTrabajador": "trabajadores",
+}
+# Parámetro de ruta -> (colección, campo) de donde se toman valores existentes
+VALORES = {
+    "estado": ("proyectos", "estado"),
+    "responsable": ("proyectos", "responsable"),
+    "categoria": ("materiales", "categoria"),
+    "nombreProducto": ("proveedores", "productos.nombre"),
+    "llave": ("pedidos", "proyecto_id"),
+}
+TAMANO_BULK = 50
+# Ids por petición en GET /{coleccion}?ids= y POST /{coleccion}/batch-get
+TAMANO_IDS = 20
+# Trabajo en segundo plano que crea POST /jobs/{tipo} con el cuerpo de un /bulk
+TIPO_CON_ENTRADA = "importar-materiales"
+# Flujos que no terminan (server-sent events); no se miden por petición
+OMITIDAS = {"/eventos/{coleccion}"}
+
+# Una petición lista para enviarse: (método, url, cuerpo JSON)
+Peticion = Tuple[str, str, Optional[object]]
+
+
+class Contexto:
+    def __init__(self, generador: Generador, azar: random.Random):
+        self.generador = generador
+        self.azar = azar
+        self.valores: Dict[str, list] = {}
+        self.desechables: Dict[str, List[str]] = {}
+        self.trabajos: List[str] = []
+
+    # Valores reales para los parámetros de ruta y un conjunto de documentos que solo usa DELETE
+    async def preparar(self, db, por_coleccion: int):
+        for parametro, (coleccion, campo) in VALORES.items():
+            self.valores[parametro] = [str(valor) for valor in await db[coleccion].distinct(campo)] or ["sin-valores"]
+        for coleccion in COLECCIONES:
+            documentos = [self.generador.documento(coleccion, numero, desechable=True) for numero in range(por_coleccion)]
+            await db[coleccion].insert_many(documentos)
+            self.desechables[coleccion] = [str(documento["_id"]) for documento in documentos]
+
+    # Un trabajo terminado para GET /jobs/{idTrabajo} y su resultado
+    async def preparar_trabajos(self, cliente: httpx.AsyncClient):
+        respuesta = await cliente.post("/jobs", json={"tipo": "costo-proyectos"})
+        idTrabajo = respuesta.json()["id"]
+        while (await cliente.get(f"/jobs/{idTrabajo}")).json()["trabajo"]["estado"] in ("pendiente", "en_curso"):
+            await asyncio.sleep(0.1)
+        self.trabajos.append(idTrabajo)
+
+    def parametro(self, nombre: str, metodo: str) -> str:
+        if nombre in IDS:
+            coleccion = IDS[nombre]
+            if metodo == "DELETE" and self.desechables[coleccion]:
+                return self.desechables[coleccion].pop()
+            return str(self.azar.choice(self.generador.ids[coleccion]))
+        if nombre == "dimension":
+            return "proyectos"
+        if nombre == "idTrabajo":
+            return self.azar.choice(self.trabajos)
+        if nombre == "tipo":
+            return TIPO_CON_ENTRADA
+        return self.azar.choice(self.valores.get(nombre, ["x"]))
+
+    def ids(self, coleccion: str) -> List[str]:
+        disponibles = self.generador.ids[coleccion]
+        return [str(documento_id) for documento_id in self.azar.sample(disponibles, min(TAMANO_IDS, len(disponibles)))]
+
+    def fecha(self) -> str:
+        return (INICIO + timedelta(days=self.azar.randint(0, 6 * 365))).date().isoformat()
+
+    def prefijo(self) -> str:
+        nombre = self.azar.choice(self.generador.nombres)
+        return nombre[: self.azar.randint(1, min(6, len(nombre)))]
+
+
+def _coleccion(ruta: str) -> Optional[str]:
+    primera = ruta.strip("/").split("/")[0]
+    return primera if primera in COLECCIONES else None
+
+
+# Rutas que se miden por separado según un parámetro que cambia por completo su costo
+VARIANTES = {"/buscar": [{"modo": "prefijo"}, {"modo": "texto"}]}
+
+
+# Parámetros de consulta para las rutas que los necesitan o que cambian de costo con ellos
+def _consulta(metodo: str, ruta: str, contexto: Contexto) -> Dict[str, str]:
+    if metodo != "GET":
+        return {}
+    if ruta == "/buscar":
+        return {"q": contexto.prefijo()}
+    if ruta == "/proyectos/activos":
+        return {"en": contexto.fecha()}
+    if ruta in ("/pedidos", "/reportes/gasto-proveedores"):
+        desde = contexto.fecha()
+        return {"desde": desde, "hasta": (datetime.fromisoformat(desde) + timedelta(days=90)).date().isoformat()}
+    coleccion = _coleccion(ruta)
+    if coleccion is not None and ruta == f"/{coleccion}":
+        return {"ids": ",".join(contexto.ids(coleccion))}
+    return {}
+
+
+def _cuerpo(metodo: str, ruta: str, contexto: Contexto):
+    if ruta == "/jobs":
+        return {"tipo": "costo-proyectos", "parametros": {"estado": contexto.parametro("estado", metodo)}}
+    if ruta == "/jobs/{tipo}":
+        return [contexto.generador.cuerpo("materiales") for _ in range(TAMANO_BULK)]
+    coleccion = _coleccion(ruta)
+    if metodo not in ("POST", "PUT", "PATCH") or coleccion is None:
+        return None
+    if ruta.endswith("/batch-get"):
+        return {"ids": contexto.ids(coleccion)}
+    if ruta.endswith("/bulk"):
+        return [contexto.generador.cuerpo(coleccion) for _ in range(TAMANO_BULK)]
+    cuerpo = contexto.generador.cuerpo(coleccion)
+    if metodo == "PATCH":
+        campo = next(campo for campo, valor in cuerpo.items() if isinstance(valor, str))
+        return {campo: cuerpo[campo]}
+    return cuerpo
+
+
+# Un escenario por operación del esquema OpenAPI; cada llamada arma una petición nueva
+def escenarios(esquema: dict, contexto: Contexto) -> Dict[str, Callable[[], Peticion]]:
+    resultado = {}
+    for ruta, operaciones in esquema["paths"].items():
+        if ruta in OMITIDAS:
+            continue
+        for metodo in operaciones:
+            metodo = metodo.upper()
+            for variante in VARIANTES.get(ruta, [{}]):
+
+                def armar(ruta=ruta, metodo=metodo, variante=variante) -> Peticion:
+                    url = re.sub(r"\{(\w+)\}", lambda parametro: contexto.parametro(parametro.group(1), metodo), ruta)
+                    consulta = {**_consulta(metodo, ruta, contexto), **variante}
+                    if consulta:
+                        url += "?" + urlencode(consulta)
+                    return metodo, url, _cuerpo(metodo, ruta, contexto)
+
+                nombre = f"{metodo} {ruta}" + "".join(f" [{llave}={valor}]" for llave, valor in variante.items())
+                resultado[nombre] = armar
+    return resultado
+
+
+def percentil(latencias: List[float], porcentaje: int) -> float:
+    if len(latencias) < 2:
+        return latencias[0] if latencias else 0.0
+    return statistics.quantiles(latencias, n=100, method="inclusive")[porcentaje - 1]
+
+
+async def medir(cliente: httpx.AsyncClient, armar: Callable[[], Peticion], peticiones: int, concurrencia: int) -> dict:
+    latencias: List[float] = []
+    estados: Dict[str, int] = {}
+    pendientes = iter(range(peticiones))
+
+    async def trabajador():
+        for _ in pendientes:
+            metodo, url, cuerpo = armar()
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.request(metodo, url, json=cuerpo)
+                estado = str(respuesta.status_code)
+            except Exception as e:
+                estado = type(e).__name__
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            estados[estado] = estados.get(estado, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "peticiones": peticiones,
+        "errores": sum(veces for estado, veces in estados.items() if not estado.startswith(("2", "3"))),
+        "estados": estados,
+        "por_segundo": round(peticiones / duracion, 1),
+        "p50_ms": round(percentil(latencias, 50), 3),
+        "p95_ms": round(percentil(latencias, 95), 3),
+        "p99_ms": round(percentil(latencias, 99), 3),
+        "max_ms": round(max(latencias), 3),
+    }
+
+
+def comparar(actual: dict, anterior: dict, umbral: float) -> List[str]:
+    previos = {resultado["ruta"]: resultado for resultado in anterior["resultados"]}
+    regresiones = []
+    print(f"\n{'ruta':<52} {'p95 antes':>10} {'p95 ahora':>10} {'cambio':>8}")
+    for resultado in actual["resultados"]:
+        previo = previos.get(resultado["ruta"])
+        if not previo or not previo["p95_ms"]:
+            continue
+        cambio = (resultado["p95_ms"] - previo["p95_ms"]) / previo["p95_ms"] * 100
+        marca = "  <- regresión" if cambio > umbral else ""
+        print(f"{resultado['ruta']:<52} {previo['p95_ms']:>10.2f} {resultado['p95_ms']:>10.2f} {cambio:>+7.1f}%{marca}")
+        if marca:
+            regresiones.append(resultado["ruta"])
+    return regresiones
+
+
+async def principal(argumentos) -> dict:
+    usar_base(argumentos.bd, argumentos.mongomock)
+    import main
+
+    generador = await sembrar(conexion.db, argumentos.escala, argumentos.semilla)
+    contexto = Contexto(generador, random.Random(argumentos.semilla))
+    await contexto.preparar(conexion.db, argumentos.peticiones)
+    for manejador in main.app.router.on_startup:
+        await manejador()
+
+    seleccion = re.compile(argumentos.rutas) if argumentos.rutas else None
+    casos = {
+        nombre: armar
+        for nombre, armar in escenarios(main.app.openapi(), contexto).items()
+        if seleccion is None or seleccion.search(nombre)
+    }
+    transporte = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    resultados = []
+    print(f"{'ruta':<52} {'pet/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>8}")
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        if any("/jobs/{idTrabajo}" in nombre for nombre in casos):
+            await contexto.preparar_trabajos(cliente)
+        for nombre, armar in casos.items():
+            resultado = {"ruta": nombre, **await medir(cliente, armar, argumentos.peticiones, argumentos.concurrencia)}
+            resultados.append(resultado)
+            print(
+                f"{nombre:<52} {resultado['por_segundo']:>9.1f} {resultado['p50_ms']:>9.2f} "
+                f"{resultado['p95_ms']:>9.2f} {resultado['p99_ms']:>9.2f} {resultado['errores']:>8}"
+            )
+    for manejador in main.app.router.on_shutdown:
+        await manejador()
+    return {
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "backend": "mongomock" if argumentos.mongomock else conexion.MONGO_URL,
+        "escala": argumentos.escala,
+        "peticiones": argumentos.peticiones,
+        "concurrencia": argumentos.concurrencia,
+        "semilla": argumentos.semilla,
+        "python": platform.python_version(),
+        "resultados": resultados,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", type=int, default=100, help="proyectos sembrados; el resto de colecciones es proporcional")
+    parser.add_argument("--peticiones", type=int, default=200, help="peticiones por ruta")
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--rutas", help="expresión regular sobre 'MÉTODO /ruta' para elegir rutas")
+    parser.add_argument("--bd", default=BD_BENCHMARK)
+    parser.add_argument("--mongomock", action="store_true")
+    parser.add_argument("--salida", type=Path, help="archivo JSON de resultados (por omisión, en benchmarks/resultados/)")
+    parser.add_argument("--comparar", type=Path, help="resultados anteriores contra los que comparar")
+    parser.add_argument("--umbral", type=float, default=20.0, help="aumento de p95, en por ciento, que cuenta como regresión")
+    argumentos = parser.parse_args()
+
+    reporte = asyncio.run(principal(argumentos))
+    salida = argumentos.salida or DIRECTORIO_RESULTADOS / f"carga-{datetime.now():%Y%m%d-%H%M%S}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(reporte, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultados en {salida}")
+    if argumentos.comparar:
+        regresiones = comparar(reporte, json.loads(argumentos.comparar.read_text(encoding="utf-8")), argumentos.umbral)
+        if regresiones:
+            sys.exit(1)
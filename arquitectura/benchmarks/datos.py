@@ -0,0 +1,231 @@
+"""Datos sintéticos para los benchmarks, generados a partir de las formas de
+bd Arquitectura/*.JSON y validados con los modelos de cada entidad, de modo que
+quedan guardados igual que si hubieran entrado por la API.
+
+Uso, desde arquitectura/:
+    python -m benchmarks.datos --escala 1000 --mongomock   # solo siembra y muestra conteos
+
+Con MongoDB se siembra la base --bd (arquitectura_benchmark por omisión), nunca la de
+la aplicación: cada colección se borra antes de sembrarla.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from bson import ObjectId
+
+import cliente
+import conexion
+import materiales
+import pedidos
+import proveedores
+import proyectos
+import trabajadores
+from resumenes import actualizar_resumenes
+
+DIRECTORIO_FORMAS = Path(__file__).resolve().parents[2] / "bd Arquitectura"
+BD_BENCHMARK = "arquitectura_benchmark"
+
+# Colección -> (archivo con la forma, modelo, documentos por unidad de escala), en orden de siembra:
+# primero las colecciones a las que apuntan las referencias
+COLECCIONES = {
+    "proyectos": ("proyectos.JSON", proyectos.Proyecto, 1),
+    "materiales": ("materiales.JSON", materiales.Material, 2),
+    "proveedores": ("proveedores.JSON", proveedores.Proveedor, 0.2),
+    "pedidos": ("pedidos.JSON", pedidos.Pedido, 10),
+    "clientes": ("cliente.JSON", cliente.Cliente, 0.5),
+    "trabajadores": ("trabajadores.JSON", trabajadores.Trabajador, 1),
+}
+
+# (colección, campo) -> colección referida
+REFERENCIAS = {
+    ("pedidos", "proyecto_id"): "proyectos",
+    ("pedidos", "proveedor_id"): "proveedores",
+    ("pedidos", "material_id"): "materiales",
+    ("clientes", "proyectos"): "proyectos",
+    ("trabajadores", "proyectos_asignados"): "proyectos",
+}
+
+PALABRAS = (
+    "cemento", "varilla", "block", "arena", "grava", "tabique", "mortero", "yeso", "acero", "madera",
+    "vidrio", "concreto", "losa", "muro", "columna", "viga", "fachada", "azotea", "plafón", "cimbra",
+)
+NOMBRES = ("Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Pedro", "Elena", "Raúl")
+APELLIDOS = ("Pérez", "García", "López", "Hernández", "Martínez", "Ramírez", "Torres", "Flores")
+OPCIONES = {
+    "estado": ("planeado", "en curso", "terminado", "suspendido"),
+    "estatus": ("pendiente", "enviado", "entregado", "cancelado"),
+    "unidad_medida": ("kg", "m", "m2", "m3", "pieza", "litro"),
+    "categoria": ("obra negra", "acabados", "estructura", "instalaciones", "herramienta"),
+    "puesto": ("arquitecto", "ingeniero", "albañil", "electricista", "supervisor"),
+}
+INICIO = datetime(2020, 1, 1)
+# Campos opcionales de los modelos que los archivos de forma no traen
+CAMPOS_EXTRA = {
+    "materiales": {"categoria": ""},
+    "proveedores": {"productos": [{"nombre": "", "descripcion": "", "precio_unitario": 0.0, "cantidad_disponible": 0}]},
+}
+
+
+# Las plantillas usan float como marcador de tipo, que no es JSON válido; si el archivo trae
+# ejemplos en lugar de una plantilla, el primero da la forma y todos aportan valores
+def leer_forma(coleccion: str):
+    texto = (DIRECTORIO_FORMAS / COLECCIONES[coleccion][0]).read_text(encoding="utf-8")
+    contenido = json.loads(re.sub(r":\s*float\b", ": 0.0", texto))
+    ejemplos = contenido if isinstance(contenido, list) else []
+    forma = contenido[0] if isinstance(contenido, list) else contenido
+    return {**CAMPOS_EXTRA.get(coleccion, {}), **forma}, ejemplos
+
+
+class Generador:
+    def __init__(self, escala: int, semilla: int = 0):
+        self.escala = escala
+        self.azar = random.Random(semilla)
+        self.ids: Dict[str, List[ObjectId]] = {coleccion: [] for coleccion in COLECCIONES}
+        self.nombres: List[str] = []
+        self.formas = {coleccion: leer_forma(coleccion) for coleccion in COLECCIONES}
+
+    def total(self, coleccion: str) -> int:
+        return max(1, int(self.escala * COLECCIONES[coleccion][2]))
+
+    def _texto(self, campo: str, documento: dict, ejemplos: List[dict], numero: int) -> str:
+        azar = self.azar
+        valores = [ejemplo[campo] for ejemplo in ejemplos if isinstance(ejemplo.get(campo), str)]
+        if campo in OPCIONES:
+            return azar.choice(OPCIONES[campo])
+        if campo == "email":
+            return f"{documento.get('nombre', 'contacto').split()[0].lower()}{numero}@example.com"
+        if campo == "telefono":
+            return "".join(azar.choice("0123456789") for _ in range(10))
+        if campo == "url":
+            return f"https://example.com/planos/{numero}-{azar.randrange(10**6)}.pdf"
+        if campo == "apellido":
+            return azar.choice(APELLIDOS)
+        if campo == "responsable":
+            return f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}"
+        if valores:
+            return f"{azar.choice(valores)} {numero}" if campo == "nombre" else azar.choice(valores)
+        if campo == "nombre":
+            return f"{azar.choice(PALABRAS).capitalize()} {azar.choice(PALABRAS)} {numero}"
+        return " ".join(azar.choice(PALABRAS) for _ in range(azar.randint(4, 12))).capitalize()
+
+    def _fecha(self, campo: str, documento: dict):
+        if campo == "fecha_terminacion" and self.azar.random() < 0.7:
+            return None
+        if campo in ("fecha_fin", "fecha_terminacion"):
+            base = documento.get("fecha_inicio") or documento.get("fecha_contratacion") or INICIO
+            return base + timedelta(days=self.azar.randint(30, 900))
+        return INICIO + timedelta(days=self.azar.randint(0, 6 * 365))
+
+    def _numero(self, campo: str):
+        if campo.startswith("cantidad"):
+            return self.azar.randint(1, 500)
+        if campo == "salario":
+            return round(self.azar.uniform(8000, 60000), 2)
+        return round(self.azar.uniform(1, 5000), 2)
+
+    def _referencia(self, referida: str, lista: bool):
+        ids = self.ids[referida]
+        if lista:
+            return self.azar.sample(ids, min(len(ids), self.azar.randint(1, 4)))
+        return self.azar.choice(ids)
+
+    def _llenar(self, coleccion: str, plantilla: dict, ejemplos: List[dict], numero: int) -> dict:
+        documento = {}
+        for campo, tipo in plantilla.items():
+            referida = REFERENCIAS.get((coleccion, campo))
+            if referida:
+                documento[campo] = self._referencia(referida, isinstance(tipo, list))
+            elif isinstance(tipo, list):
+                documento[campo] = [self._llenar(coleccion, tipo[0], [], numero) for _ in range(self.azar.randint(1, 6))] if tipo else []
+            elif campo.startswith("fecha"):
+                documento[campo] = self._fecha(campo, documento)
+            elif isinstance(tipo, str):
+                documento[campo] = self._texto(campo, documento, ejemplos, numero)
+            else:
+                documento[campo] = self._numero(campo)
+        return documento
+
+    # Documento listo para la API: sin _id y con los tipos de entrada (ids en texto)
+    def cuerpo(self, coleccion: str, numero: int = 0) -> dict:
+        plantilla, ejemplos = self.formas[coleccion]
+        documento = self._llenar(coleccion, plantilla, ejemplos, numero)
+        return json.loads(COLECCIONES[coleccion][1](**documento).model_dump_json())
+
+    # Los desechables no se registran como destino de referencias ni de lecturas
+    def documento(self, coleccion: str, numero: int, desechable: bool = False) -> dict:
+        plantilla, ejemplos = self.formas[coleccion]
+        datos = COLECCIONES[coleccion][1](**self._llenar(coleccion, plantilla, ejemplos, numero)).model_dump()
+        documento_id = ObjectId()
+        if not desechable:
+            self.ids[coleccion].append(documento_id)
+            if isinstance(datos.get("nombre"), str):
+                self.nombres.append(datos["nombre"])
+        return {"_id": documento_id, **datos}
+
+
+async def sembrar(db, escala: int, semilla: int = 0, tamano_lote: int = 1000) -> Generador:
+    generador = Generador(escala, semilla)
+    for coleccion in COLECCIONES:
+        await db[coleccion].drop()
+        lote = []
+        for numero in range(generador.total(coleccion)):
+            lote.append(generador.documento(coleccion, numero))
+            if len(lote) >= tamano_lote or numero == generador.total(coleccion) - 1:
+                await db[coleccion].insert_many(lote, ordered=False)
+                # Los resúmenes se alimentan igual que desde la API, con el observador de pedidos
+                if coleccion == "pedidos":
+                    await actualizar_resumenes([(None, documento) for documento in lote])
+                lote = []
+    return generador
+
+
+# pymongo 4.9+ pasa sort a UpdateOne dentro de bulk_write y mongomock aún no lo acepta;
+# sin esto las escrituras de pedidos (resúmenes) fallan solo en el sustituto en memoria
+def _compatibilizar_mongomock():
+    import inspect
+
+    from mongomock.collection import BulkOperationBuilder
+
+    original = BulkOperationBuilder.add_update
+    if "sort" in inspect.signature(original).parameters:
+        return
+
+    def add_update(self, *argumentos, sort=None, **opciones):
+        return original(self, *argumentos, **opciones)
+
+    BulkOperationBuilder.add_update = add_update
+
+
+# Apunta conexion.db a la base de benchmark, en MongoDB o en el sustituto en memoria
+def usar_base(bd: str, mongomock: bool):
+    if bd == conexion.MONGO_BD:
+        raise SystemExit(f"La base {bd} es la de la aplicación; use otra con --bd")
+    if mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+        _compatibilizar_mongomock()
+        conexion.db = AsyncMongoMockClient()[bd]
+    else:
+        conexion.db = conexion.client[bd]
+
+
+async def principal(escala: int, semilla: int, bd: str, mongomock: bool):
+    usar_base(bd, mongomock)
+    await sembrar(conexion.db, escala, semilla)
+    for coleccion in COLECCIONES:
+        print(f"{coleccion:<14} {await conexion.db[coleccion].count_documents({}):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", type=int, default=100)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--bd", default=BD_BENCHMARK)
+    parser.add_argument("--mongomock", action="store_true")
+    argumentos = parser.parse_args()
+    asyncio.run(principal(argumentos.escala, argumentos.semilla, argumentos.bd, argumentos.mongomock))
@@ -0,0 +1,98 @@
+"""Compara escrituras con lectura posterior (insert_one/update_one + find_one) contra
+el camino actual del repositorio (inserted_id y find_one_and_update).
+
+Uso, desde arquitectura/:
+    python -m benchmarks.escrituras                 # MongoDB en ARQUITECTURA_MONGO_URL
+    python -m benchmarks.escrituras --mongomock     # sin servidor, requiere mongomock-motor
+
+--total es de 5000 escrituras por caso con MongoDB y de 200 con --mongomock, que
+escribe cientos de veces más lento y no terminaría en un tiempo razonable.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+import conexion
+from crud import Repositorio
+
+# Escrituras por caso si no se pasa --total
+TOTAL = 5000
+TOTAL_MONGOMOCK = 200
+
+PEDIDO = {
+    "proyecto_id": ObjectId(),
+    "proveedor_id": ObjectId(),
+    "material_id": ObjectId(),
+    "cantidad": 10,
+    "fecha_pedido": datetime(2024, 1, 1),
+    "estatus": "pendiente",
+}
+
+
+async def _medir(operacion, total: int, concurrencia: int) -> float:
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una(indice: int):
+        async with semaforo:
+            await operacion(indice)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(indice) for indice in range(total)))
+    return total / (time.perf_counter() - inicio)
+
+
+async def principal(total: int, concurrencia: int, mongomock: bool):
+    if mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+        conexion.db = AsyncMongoMockClient()[conexion.MONGO_BD]
+    repositorio = Repositorio("benchmark_pedidos", "idPedido", cacheable=False)
+    coleccion = repositorio.coleccion
+    await coleccion.drop()
+    ids = [(await coleccion.insert_one(dict(PEDIDO))).inserted_id for _ in range(concurrencia)]
+    objetivos = itertools.cycle(ids)
+
+    async def crear_antes(indice):
+        resultado = await coleccion.insert_one(dict(PEDIDO))
+        await coleccion.find_one({"_id": resultado.inserted_id})
+
+    async def crear_despues(indice):
+        datos = dict(PEDIDO)
+        await repositorio.insertar(datos)
+        repositorio.a_respuesta(datos)
+
+    async def actualizar_antes(indice):
+        documento_id = next(objetivos)
+        await coleccion.update_one({"_id": documento_id}, {"$set": {**PEDIDO, "cantidad": indice}})
+        await coleccion.find_one({"_id": documento_id})
+
+    async def actualizar_despues(indice):
+        await repositorio.actualizar(next(objetivos), {**PEDIDO, "cantidad": indice})
+
+    async def actualizar_minimo(indice):
+        await repositorio.actualizar_sin_respuesta(next(objetivos), {**PEDIDO, "cantidad": indice})
+
+    casos = [
+        ("crear: insert_one + find_one", crear_antes),
+        ("crear: insert_one", crear_despues),
+        ("actualizar: update_one + find_one", actualizar_antes),
+        ("actualizar: find_one_and_update", actualizar_despues),
+        ("actualizar: update_one (return=minimal)", actualizar_minimo),
+    ]
+    print(f"{total} escrituras por caso, concurrencia {concurrencia}")
+    for nombre, operacion in casos:
+        print(f"{nombre:<42} {await _medir(operacion, total, concurrencia):>10.0f} escrituras/s")
+    await coleccion.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--total", type=int, help="escrituras por caso (5000, o 200 con --mongomock)")
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--mongomock", action="store_true")
+    argumentos = parser.parse_args()
+    total = argumentos.total or (TOTAL_MONGOMOCK if argumentos.mongomock else TOTAL)
+    asyncio.run(principal(total, argumentos.concurrencia, argumentos.mongomock))
@@ -0,0 +1,128 @@
+"""Prueba de concurrencia de las reservas de inventario sobre un material muy pedido.
+
+Crea un material con --existencias unidades y lanza --peticiones altas de pedidos en
+paralelo contra él (más de las que caben), luego cancela, reactiva y cambia la cantidad
+de una parte de ellos, también en paralelo. Al final comprueba que no se perdió ni se
+duplicó ningún ajuste:
+
+    existencias finales == existencias iniciales - suma de lo que retienen los pedidos guardados
+
+y que las existencias no quedaron en negativo. Termina con código 1 si algo no cuadra.
+
+Uso, desde arquitectura/:
+    python -m benchmarks.inventario --mongomock
+    python -m benchmarks.inventario --peticiones 1000 --concurrencia 300   # mongod en ARQUITECTURA_MONGO_URL
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from typing import List
+
+import httpx
+from bson import ObjectId
+
+import conexion
+from benchmarks.carga import percentil
+from benchmarks.datos import BD_BENCHMARK, usar_base
+from inventario import ESTATUS_SIN_RESERVA, reserva
+
+MATERIAL = {
+    "nombre": "Cemento gris",
+    "descripcion": "Saco de 50 kg",
+    "unidad_medida": "saco",
+    "precio_unitario": 250.0,
+}
+
+
+async def lanzar(cliente: httpx.AsyncClient, peticiones: List[tuple], concurrencia: int) -> dict:
+    estados, latencias = {}, []
+    pendientes = iter(peticiones)
+
+    async def trabajador():
+        for metodo, url, cuerpo in pendientes:
+            inicio = time.perf_counter()
+            respuesta = await cliente.request(metodo, url, json=cuerpo)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "estados": estados,
+        "por_segundo": round(len(peticiones) / duracion, 1),
+        "p50_ms": round(percentil(latencias, 50), 2),
+        "p99_ms": round(percentil(latencias, 99), 2),
+    }
+
+
+async def principal(argumentos) -> bool:
+    usar_base(argumentos.bd, argumentos.mongomock)
+    import main
+
+    azar = random.Random(argumentos.semilla)
+    await conexion.db.materiales.drop()
+    await conexion.db.pedidos.drop()
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        respuesta = await cliente.post("/materiales", json={**MATERIAL, "cantidad_disponible": argumentos.existencias})
+        material_id = respuesta.json()["id"]
+        proyecto_id, proveedor_id = str(ObjectId()), str(ObjectId())
+
+        def pedido(cantidad: int, estatus: str = "pendiente") -> dict:
+            return {
+                "proyecto_id": proyecto_id,
+                "proveedor_id": proveedor_id,
+                "material_id": material_id,
+                "cantidad": cantidad,
+                "fecha_pedido": "2024-01-01",
+                "estatus": estatus,
+            }
+
+        altas = [("POST", "/pedidos", pedido(azar.randint(1, argumentos.cantidad_max))) for _ in range(argumentos.peticiones)]
+        print(f"altas:    {await lanzar(cliente, altas, argumentos.concurrencia)}")
+
+        ids = [documento["_id"] async for documento in conexion.db.pedidos.find({}, {"_id": 1})]
+        cancelado = sorted(ESTATUS_SIN_RESERVA)[0]
+        cambios = []
+        for pedido_id in azar.sample(ids, len(ids) // 2):
+            opcion = azar.random()
+            if opcion < 0.4:
+                cambios.append(("PATCH", f"/pedidos/{pedido_id}", {"estatus": cancelado}))
+            elif opcion < 0.7:
+                cambios.append(("PATCH", f"/pedidos/{pedido_id}", {"cantidad": azar.randint(1, argumentos.cantidad_max * 2)}))
+            elif opcion < 0.9:
+                cambios.append(("DELETE", f"/pedidos/{pedido_id}", None))
+            else:
+                cambios.append(("PUT", f"/pedidos/{pedido_id}", pedido(azar.randint(1, argumentos.cantidad_max), "entregado")))
+        # Nuevas altas mezcladas con los cambios, para que las devoluciones compitan con los retiros
+        cambios += [("POST", "/pedidos", pedido(azar.randint(1, argumentos.cantidad_max))) for _ in range(len(cambios) // 2)]
+        azar.shuffle(cambios)
+        print(f"cambios:  {await lanzar(cliente, cambios, argumentos.concurrencia)}")
+
+    material = await conexion.db.materiales.find_one({"_id": ObjectId(material_id)})
+    retenido = 0
+    async for guardado in conexion.db.pedidos.find({"material_id": ObjectId(material_id)}):
+        retenido += (reserva(guardado) or (None, 0))[1]
+    final = material["cantidad_disponible"]
+    esperado = argumentos.existencias - retenido
+    print(f"existencias iniciales {argumentos.existencias}, retenidas por pedidos {retenido}, finales {final}, esperadas {esperado}")
+    correcto = final == esperado and final >= 0
+    print("sin ajustes perdidos" if correcto else "DESCUADRE: se perdieron o duplicaron ajustes")
+    return correcto
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=500, help="altas de pedidos en paralelo")
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--existencias", type=int, default=2000)
+    parser.add_argument("--cantidad-max", type=int, default=10, help="cantidad máxima de cada pedido")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--bd", default=BD_BENCHMARK)
+    parser.add_argument("--mongomock", action="store_true")
+    argumentos = parser.parse_args()
+    if not asyncio.run(principal(argumentos)):
+        sys.exit(1)
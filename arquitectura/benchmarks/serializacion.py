@@ -0,0 +1,81 @@
+"""Micro-benchmark de serialización de un listado de proyectos.
+
+Compara el camino anterior (jsonable_encoder + JSONResponse), la validación y
+volcado con un TypeAdapter de Pydantic v2 y RespuestaORJSON.
+
+Uso, desde arquitectura/:
+    python -m benchmarks.serializacion --documentos 1000
+"""
+import argparse
+import timeit
+from datetime import datetime
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, create_model
+
+from proyectos import Proyecto
+from serializacion import RespuestaORJSON
+
+
+def proyectos_sinteticos(total: int) -> List[dict]:
+    return [
+        {
+            "idProyecto": str(ObjectId()),
+            "nombre": f"Proyecto {indice}",
+            "descripcion": "Edificio de oficinas de cinco niveles con estacionamiento subterráneo",
+            "fecha_inicio": datetime(2024, 1, 15),
+            "fecha_fin": datetime(2025, 6, 30),
+            "estado": "en curso",
+            "responsable": "Arq. Pérez",
+            "materiales": [
+                {
+                    "nombre": f"Material {parte}",
+                    "descripcion": "Suministro para obra negra",
+                    "categoria": "estructura",
+                    "cantidad": 10 + parte,
+                    "unidad_medida": "pieza",
+                    "precio_unitario": 125.5,
+                }
+                for parte in range(8)
+            ],
+            "herramientas": [
+                {"nombre": "Revolvedora", "descripcion": "Mezcladora de concreto", "cantidad": 2, "estado": "buena"}
+                for _ in range(3)
+            ],
+            "planos": [
+                {"nombre": "Planta baja", "descripcion": "Distribución", "url": "https://example.com/planos/pb.pdf"}
+                for _ in range(2)
+            ],
+        }
+        for indice in range(total)
+    ]
+
+
+def principal(total: int, repeticiones: int):
+    proyectos = proyectos_sinteticos(total)
+    respuesta = {"estatus": "success", "mensaje": "Proyectos encontrados", "proyectos": proyectos, "next_cursor": None}
+    salida = create_model("ProyectoSalida", __base__=Proyecto, idProyecto=(str, ...))
+    adaptador = TypeAdapter(List[salida])
+
+    casos = {
+        "jsonable_encoder + JSONResponse": lambda: JSONResponse(jsonable_encoder(respuesta)).body,
+        "TypeAdapter validate + dump_json": lambda: adaptador.dump_json(adaptador.validate_python(proyectos)),
+        "RespuestaORJSON": lambda: RespuestaORJSON(respuesta).body,
+    }
+    print(f"{total} proyectos, mejor de {repeticiones} repeticiones")
+    base = None
+    for nombre, caso in casos.items():
+        mejor = min(timeit.repeat(caso, number=1, repeat=repeticiones))
+        base = base or mejor
+        print(f"{nombre:<34} {mejor * 1000:>9.2f} ms  {base / mejor:>6.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documentos", type=int, default=1000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    argumentos = parser.parse_args()
+    principal(argumentos.documentos, argumentos.repeticiones)
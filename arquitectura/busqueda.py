@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import heapq
+import os
+import re
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+
+import conexion
+from paginacion import TAMANO_PAGINA_MAX
+
+# Colecciones en las que se busca y cada cuánto se recarga su autocompletado desde MongoDB,
+# para recoger lo que escribieron otros procesos
+COLECCIONES = ("proyectos", "materiales", "proveedores")
+RECARGA_SEGUNDOS = float(os.getenv("ARQUITECTURA_AUTOCOMPLETADO_RECARGA", "300"))
+RESULTADOS_MAX = int(os.getenv("ARQUITECTURA_BUSQUEDA_RESULTADOS_MAX", "1000"))
+MEMO_CONSULTAS = int(os.getenv("ARQUITECTURA_AUTOCOMPLETADO_MEMO", "256"))
+
+# Mayor que cualquier carácter: (prefijo + FIN_PREFIJO,) cierra el tramo de palabras con ese prefijo
+FIN_PREFIJO = chr(0x10FFFF)
+
+router = APIRouter(prefix="/buscar", tags=["buscar"])
+
+
+# Minúsculas y sin acentos, para que "cemento" encuentre "Cemento Gris" y "constr" a "Construcción"
+def palabras(texto: Optional[str]) -> List[str]:
+    if not texto:
+        return []
+    plano = "".join(caracter for caracter in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(caracter))
+    return re.findall(r"\w+", plano.lower())
+
+
+# Lista ordenada de (palabra, id) de los nombres; un prefijo es un tramo contiguo que se
+# ubica con bisect, y las altas y bajas mantienen el orden con insort
+class IndicePrefijos:
+    def __init__(self, documentos: Iterable[Tuple[str, Optional[str]]] = ()):
+        self.entradas: List[Tuple[str, str]] = []
+        self.nombres: Dict[str, Tuple[str, List[str], str]] = {}
+        # Las consultas de una o dos letras tocan gran parte del índice y se repiten en cada
+        # tecleo; se memorizan hasta la siguiente escritura
+        self._memo: OrderedDict = OrderedDict()
+        # La carga inicial ordena una sola vez en lugar de insertar uno por uno
+        for documento_id, nombre in documentos:
+            if nombre:
+                self.entradas.extend((palabra, documento_id) for palabra in self._registrar(documento_id, nombre))
+        self.entradas.sort()
+
+    def agregar(self, documento_id: str, nombre: Optional[str]):
+        self.quitar(documento_id)
+        if not nombre:
+            return
+        self._memo.clear()
+        for palabra in self._registrar(documento_id, nombre):
+            insort(self.entradas, (palabra, documento_id))
+
+    # Guarda el nombre con sus palabras ya normalizadas y devuelve las palabras distintas
+    def _registrar(self, documento_id: str, nombre: str) -> set:
+        propias = palabras(nombre)
+        self.nombres[documento_id] = (nombre, propias, " ".join(propias))
+        return set(propias)
+
+    def quitar(self, documento_id: str):
+        _, propias, _ = self.nombres.pop(documento_id, (None, [], None))
+        if propias:
+            self._memo.clear()
+        for palabra in set(propias):
+            posicion = bisect_left(self.entradas, (palabra, documento_id))
+            if posicion < len(self.entradas) and self.entradas[posicion] == (palabra, documento_id):
+                del self.entradas[posicion]
+
+    # Cada palabra de la consulta debe ser prefijo de alguna palabra del nombre. Primero los
+    # nombres que empiezan con la consulta completa, luego los que empiezan con su primera
+    # palabra, y a igualdad los más cortos. Solo se ordenan los `hasta` primeros.
+    def buscar(self, consulta: str, hasta: int) -> List[Tuple[tuple, str, str]]:
+        buscadas = palabras(consulta)
+        if not buscadas:
+            return []
+        frase = " ".join(buscadas)
+        if (frase, hasta) in self._memo:
+            self._memo.move_to_end((frase, hasta))
+            return self._memo[(frase, hasta)]
+        guia = max(buscadas, key=len)
+        inicio = bisect_left(self.entradas, (guia,))
+        fin = bisect_left(self.entradas, (guia + FIN_PREFIJO,), inicio)
+        candidatos = {documento_id for _, documento_id in self.entradas[inicio:fin]}
+        resultados = []
+        for documento_id in candidatos:
+            nombre, propias, normal = self.nombres[documento_id]
+            if len(buscadas) > 1 and not all(any(propia.startswith(buscada) for propia in propias) for buscada in buscadas):
+                continue
+            if normal.startswith(frase):
+                nivel = 0
+            elif propias[0].startswith(buscadas[0]):
+                nivel = 1
+            else:
+                nivel = 2
+            resultados.append(((nivel, len(nombre), nombre), documento_id, nombre))
+        resultados = heapq.nsmallest(hasta, resultados)
+        self._memo[(frase, hasta)] = resultados
+        if len(self._memo) > MEMO_CONSULTAS:
+            self._memo.popitem(last=False)
+        return resultados
+
+
+# Autocompletado de una colección: se carga completo una vez, se mantiene con las escrituras
+# del repositorio y se recarga en segundo plano cuando envejece
+class Autocompletado:
+    def __init__(self, coleccion: str):
+        self.coleccion = coleccion
+        self.indice = IndicePrefijos()
+        self.cargado_en: Optional[float] = None
+        self._carga = asyncio.Lock()
+        self._pendientes: Optional[list] = None
+        self._recarga: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _aplicar(indice: IndicePrefijos, antes: Optional[dict], despues: Optional[dict]):
+        if despues is not None:
+            indice.agregar(str(despues["_id"]), despues.get("nombre"))
+        elif antes is not None:
+            indice.quitar(str(antes["_id"]))
+
+    # Las escrituras que llegan durante una carga se vuelven a aplicar sobre el índice nuevo
+    async def cargar(self):
+        async with self._carga:
+            self._pendientes = []
+            try:
+                documentos = conexion.db[self.coleccion].find({}, {"nombre": 1})
+                nuevo = IndicePrefijos([(str(documento["_id"]), documento.get("nombre")) async for documento in documentos])
+                for antes, despues in self._pendientes:
+                    self._aplicar(nuevo, antes, despues)
+                self.indice, self.cargado_en = nuevo, time.monotonic()
+            finally:
+                self._pendientes = None
+
+    async def preparar(self):
+        if self.cargado_en is None:
+            await self.cargar()
+        elif time.monotonic() - self.cargado_en > RECARGA_SEGUNDOS and (self._recarga is None or self._recarga.done()):
+            self._recarga = asyncio.create_task(self.cargar())
+
+    # Observador del repositorio
+    async def observar(self, cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+        for antes, despues in cambios:
+            self._aplicar(self.indice, antes, despues)
+            if self._pendientes is not None:
+                self._pendientes.append((antes, despues))
+
+
+autocompletados = {coleccion: Autocompletado(coleccion) for coleccion in COLECCIONES}
+
+
+def sincronizar(coleccion: str):
+    return autocompletados[coleccion].observar
+
+
+async def preparar_autocompletado():
+    await asyncio.gather(*(autocompletado.preparar() for autocompletado in autocompletados.values()))
+
+
+# El cursor de búsqueda es un desplazamiento: el orden por relevancia no admite paginar por llave
+def _codificar_desplazamiento(desplazamiento: int) -> str:
+    return base64.urlsafe_b64encode(str(desplazamiento).encode()).decode().rstrip("=")
+
+
+def _decodificar_desplazamiento(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        desplazamiento = int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if desplazamiento < 0:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return desplazamiento
+
+
+def _colecciones(en: Optional[str]) -> List[str]:
+    if not en:
+        return list(COLECCIONES)
+    elegidas = [coleccion.strip() for coleccion in en.split(",") if coleccion.strip()]
+    desconocidas = [coleccion for coleccion in elegidas if coleccion not in COLECCIONES]
+    if desconocidas:
+        raise HTTPException(status_code=400, detail=f"No se puede buscar en: {', '.join(desconocidas)}")
+    return elegidas
+
+
+async def _buscar_prefijo(colecciones: List[str], q: str, hasta: int) -> List[dict]:
+    await asyncio.gather(*(autocompletados[coleccion].preparar() for coleccion in colecciones))
+    encontrados = []
+    for coleccion in colecciones:
+        for orden, documento_id, nombre in autocompletados[coleccion].indice.buscar(q, hasta):
+            encontrados.append((orden, {"coleccion": coleccion, "id": documento_id, "nombre": nombre}))
+    encontrados.sort(key=lambda encontrado: encontrado[0])
+    return [resultado for _, resultado in encontrados[:hasta]]
+
+
+# $text usa el índice de texto de cada colección; se piden los primeros `hasta` de cada una
+# y se mezclan por puntaje
+async def _buscar_texto(colecciones: List[str], q: str, hasta: int) -> List[dict]:
+    async def en_coleccion(coleccion: str) -> List[dict]:
+        documentos = await (
+            conexion.db[coleccion]
+            .find({"$text": {"$search": q}}, {"nombre": 1, "descripcion": 1, "puntaje": {"$meta": "textScore"}})
+            .sort([("puntaje", {"$meta": "textScore"})])
+            .limit(hasta)
+            .to_list(length=hasta)
+        )
+        return [
+            {"coleccion": coleccion, "id": str(documento.pop("_id")), **documento}
+            for documento in documentos
+        ]
+
+    por_coleccion = await asyncio.gather(*(en_coleccion(coleccion) for coleccion in colecciones))
+    resultados = [resultado for resultados in por_coleccion for resultado in resultados]
+    resultados.sort(key=lambda resultado: -resultado["puntaje"])
+    return resultados[:hasta]
+
+
+# Rutas de búsqueda
+@router.get("")
+async def buscar(
+    q: str = Query(..., min_length=1),
+    en: Optional[str] = Query(None, description="Colecciones separadas por comas"),
+    modo: str = Query("texto", pattern="^(texto|prefijo)$"),
+    limite: int = Query(10, ge=1, le=TAMANO_PAGINA_MAX),
+    cursor: Optional[str] = None,
+):
+    colecciones = _colecciones(en)
+    desplazamiento = _decodificar_desplazamiento(cursor)
+    hasta = min(desplazamiento + limite + 1, RESULTADOS_MAX)
+    if modo == "prefijo":
+        resultados = await _buscar_prefijo(colecciones, q, hasta)
+    else:
+        resultados = await _buscar_texto(colecciones, q, hasta)
+    pagina = resultados[desplazamiento:desplazamiento + limite]
+    siguiente = None
+    if len(resultados) > desplazamiento + limite:
+        siguiente = _codificar_desplazamiento(desplazamiento + limite)
+    return {"estatus": "success", "mensaje": "Resultados de la búsqueda", "resultados": pagina, "next_cursor": siguiente}
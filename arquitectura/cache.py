@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Configuración del caché de documentos
+CACHE_MAXIMO = int(os.getenv("ARQUITECTURA_CACHE_MAXIMO", "1000"))
+CACHE_TTL = float(os.getenv("ARQUITECTURA_CACHE_TTL", "30"))
+
+
+# Interfaz del almacenamiento; permite cambiar la memoria local por un caché compartido entre workers
+# Cada backend cuenta en `desalojos` las entradas que saca por capacidad o expiración
+class BackendCache(ABC):
+    desalojos: int
+
+    @abstractmethod
+    async def obtener(self, llave: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def guardar(self, llave: str, documento: dict): ...
+
+    @abstractmethod
+    async def eliminar(self, llave: str): ...
+
+    @abstractmethod
+    async def limpiar(self): ...
+
+
+# Caché en memoria del proceso con desalojo LRU y expiración por TTL
+class MemoriaLRU(BackendCache):
+    def __init__(self, maximo: int = CACHE_MAXIMO, ttl: float = CACHE_TTL):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.desalojos = 0
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def obtener(self, llave: str) -> Optional[dict]:
+        entrada = self._entradas.get(llave)
+        if entrada is None:
+            return None
+        expira, documento = entrada
+        if expira < time.monotonic():
+            del self._entradas[llave]
+            self.desalojos += 1
+            return None
+        self._entradas.move_to_end(llave)
+        return documento
+
+    async def guardar(self, llave: str, documento: dict):
+        self._entradas[llave] = (time.monotonic() + self.ttl, documento)
+        self._entradas.move_to_end(llave)
+        while len(self._entradas) > self.maximo:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+
+    async def eliminar(self, llave: str):
+        self._entradas.pop(llave, None)
+
+    async def limpiar(self):
+        self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+# Caché de lectura para consultas por id. Los fallos concurrentes de una misma llave
+# comparten una sola carga a MongoDB.
+class CacheDocumentos:
+    def __init__(self, backend: BackendCache):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self._en_vuelo: Dict[str, asyncio.Future] = {}
+        # Sube con cada invalidación; una carga de varios documentos solo los guarda si no cambió
+        self._invalidaciones = 0
+
+    @staticmethod
+    def _llave(coleccion: str, documento_id) -> str:
+        return f"{coleccion}:{documento_id}"
+
+    async def obtener(self, coleccion: str, documento_id, cargar: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        llave = self._llave(coleccion, documento_id)
+        documento = await self.backend.obtener(llave)
+        if documento is not None:
+            self.aciertos += 1
+            return dict(documento)
+        self.fallos += 1
+        carga = self._en_vuelo.get(llave)
+        if carga is None:
+            carga = asyncio.ensure_future(self._cargar(llave, cargar))
+            self._en_vuelo[llave] = carga
+        documento = await asyncio.shield(carga)
+        return dict(documento) if documento is not None else None
+
+    async def _cargar(self, llave: str, cargar: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        carga = asyncio.current_task()
+        try:
+            documento = await cargar()
+            # Si hubo una invalidación mientras se cargaba, el resultado ya no se guarda
+            if documento is not None and self._en_vuelo.get(llave) is carga:
+                await self.backend.guardar(llave, documento)
+            return documento
+        finally:
+            if self._en_vuelo.get(llave) is carga:
+                del self._en_vuelo[llave]
+
+    # Los que no están en caché se piden todos juntos a cargar(faltantes), que devuelve
+    # {id: documento} y omite los que no existen
+    async def obtener_varios(
+        self, coleccion: str, documento_ids: List, cargar: Callable[[List], Awaitable[Dict[object, dict]]]
+    ) -> Dict[object, dict]:
+        encontrados: Dict[object, dict] = {}
+        faltantes = []
+        for documento_id in documento_ids:
+            documento = await self.backend.obtener(self._llave(coleccion, documento_id))
+            if documento is not None:
+                self.aciertos += 1
+                encontrados[documento_id] = dict(documento)
+            else:
+                self.fallos += 1
+                faltantes.append(documento_id)
+        if faltantes:
+            invalidaciones = self._invalidaciones
+            cargados = await cargar(faltantes)
+            for documento_id, documento in cargados.items():
+                if self._invalidaciones == invalidaciones:
+                    await self.backend.guardar(self._llave(coleccion, documento_id), documento)
+                encontrados[documento_id] = dict(documento)
+        return encontrados
+
+    async def invalidar(self, coleccion: str, documento_id):
+        self._invalidaciones += 1
+        llave = self._llave(coleccion, documento_id)
+        self._en_vuelo.pop(llave, None)
+        await self.backend.eliminar(llave)
+
+    def estadisticas(self) -> dict:
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.backend.desalojos,
+            "en_vuelo": len(self._en_vuelo),
+        }
+
+
+cache = CacheDocumentos(MemoriaLRU())
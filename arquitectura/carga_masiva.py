@@ -0,0 +1,162 @@
+import json
+import os
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Type
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import cache
+from observadores import CambioRechazado
+from versiones import CAMPO_VERSION, INCREMENTO
+
+# Número de documentos que se validan y envían en cada bulk_write
+TAMANO_LOTE = int(os.getenv("ARQUITECTURA_TAMANO_LOTE", "1000"))
+
+
+# Acepta un arreglo JSON o un flujo NDJSON (un documento por línea)
+async def leer_elementos(request: Request) -> AsyncIterator[Any]:
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        pendiente = b""
+        async for trozo in request.stream():
+            pendiente += trozo
+            *lineas, pendiente = pendiente.split(b"\n")
+            for linea in lineas:
+                if linea.strip():
+                    yield linea
+        if pendiente.strip():
+            yield pendiente
+        return
+    try:
+        cuerpo = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="El cuerpo no es JSON válido")
+    if not isinstance(cuerpo, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON o NDJSON")
+    for elemento in cuerpo:
+        yield elemento
+
+
+def _error(posicion: int, detalle: Any) -> dict:
+    return {"posicion": posicion, "estatus": "error", "error": detalle}
+
+
+# Convierte un elemento crudo en una operación de escritura; si trae su id se hace upsert
+def _operacion(crudo: Any, modelo: Type[BaseModel], campo_id: str):
+    if isinstance(crudo, bytes):
+        crudo = json.loads(crudo)
+    if not isinstance(crudo, dict):
+        raise ValueError("Cada elemento debe ser un objeto JSON")
+    identificador = crudo.pop(campo_id, None)
+    documento = modelo(**crudo).dict()
+    if identificador is None:
+        documento_id = ObjectId()
+        return InsertOne({"_id": documento_id, **documento, CAMPO_VERSION: 1}), documento_id, documento
+    documento_id = ObjectId(identificador)
+    return UpdateOne({"_id": documento_id}, {"$set": documento, **INCREMENTO}, upsert=True), documento_id, documento
+
+
+async def _escribir_lote(coleccion, lote: List[tuple], resultados: List[dict], al_escribir: Optional[Callable] = None):
+    operaciones = [operacion for _, operacion, _, _ in lote]
+    anteriores = {}
+    if al_escribir:
+        # Versión previa de los documentos que se van a reemplazar, en una sola consulta
+        reemplazos = [documento_id for _, operacion, documento_id, _ in lote if isinstance(operacion, UpdateOne)]
+        if reemplazos:
+            anteriores = {documento["_id"]: documento async for documento in coleccion.find({"_id": {"$in": reemplazos}})}
+    fallidas = {}
+    upserts = {}
+    try:
+        resultado = await coleccion.bulk_write(operaciones, ordered=False)
+        upserts = resultado.upserted_ids
+    except BulkWriteError as e:
+        fallidas = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+        upserts = {upsert["index"]: upsert["_id"] for upsert in e.details.get("upserted", [])}
+    # Un observador puede rechazar documentos ya escritos (y deshacerlos); cuentan como error
+    rechazados = {}
+    if al_escribir:
+        cambios = [
+            (anteriores.get(documento_id), {"_id": documento_id, **documento})
+            for indice, (_, _, documento_id, documento) in enumerate(lote)
+            if indice not in fallidas
+        ]
+        try:
+            if cambios:
+                await al_escribir(cambios)
+        except CambioRechazado as e:
+            rechazados = e.motivos
+    for indice, (posicion, operacion, documento_id, documento) in enumerate(lote):
+        if indice in fallidas:
+            resultados.append(_error(posicion, fallidas[indice]))
+            continue
+        if documento_id in rechazados:
+            resultados.append(_error(posicion, rechazados[documento_id]))
+            continue
+        if isinstance(operacion, InsertOne) or indice in upserts:
+            resultados.append({"posicion": posicion, "estatus": "insertado", "id": str(documento_id)})
+        else:
+            resultados.append({"posicion": posicion, "estatus": "actualizado", "id": str(documento_id)})
+        if isinstance(operacion, UpdateOne):
+            await cache.invalidar(coleccion.name, documento_id)
+
+
+# Valida y escribe los elementos por lotes; devuelve un resultado por elemento, en orden. Las
+# posiciones empiezan en `inicio`, para quien procese una entrada larga por partes.
+async def cargar_elementos(
+    elementos: AsyncIterator[Any],
+    coleccion,
+    modelo: Type[BaseModel],
+    campo_id: str,
+    tamano_lote: Optional[int] = None,
+    al_escribir: Optional[Callable] = None,
+    inicio: int = 0,
+) -> List[dict]:
+    tamano_lote = tamano_lote or TAMANO_LOTE
+    resultados: List[dict] = []
+    lote: List[tuple] = []
+    posicion = inicio
+    async for crudo in elementos:
+        try:
+            lote.append((posicion, *_operacion(crudo, modelo, campo_id)))
+        except ValidationError as e:
+            resultados.append(_error(posicion, [{"campo": ".".join(str(parte) for parte in error["loc"]), "mensaje": error["msg"]} for error in e.errors()]))
+        except (ValueError, InvalidId, TypeError) as e:
+            resultados.append(_error(posicion, str(e)))
+        posicion += 1
+        if len(lote) >= tamano_lote:
+            await _escribir_lote(coleccion, lote, resultados, al_escribir)
+            lote = []
+    if lote:
+        await _escribir_lote(coleccion, lote, resultados, al_escribir)
+    resultados.sort(key=lambda resultado: resultado["posicion"])
+    return resultados
+
+
+def contar(resultados: List[dict]) -> Dict[str, int]:
+    conteo = {"insertado": 0, "actualizado": 0, "error": 0}
+    for resultado in resultados:
+        conteo[resultado["estatus"]] += 1
+    return conteo
+
+
+async def carga_masiva(
+    request: Request,
+    coleccion,
+    modelo: Type[BaseModel],
+    campo_id: str,
+    tamano_lote: Optional[int] = None,
+    al_escribir: Optional[Callable] = None,
+) -> dict:
+    resultados = await cargar_elementos(leer_elementos(request), coleccion, modelo, campo_id, tamano_lote, al_escribir)
+    conteo = contar(resultados)
+    return {
+        "estatus": "success",
+        "mensaje": "Carga masiva procesada",
+        "insertados": conteo["insertado"],
+        "actualizados": conteo["actualizado"],
+        "errores": conteo["error"],
+        "resultados": resultados,
+    }
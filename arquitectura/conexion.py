@@ -0,0 +1,114 @@
+import os
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metricas import EscuchaComandos
+
+# Configuración de la conexión a MongoDB
+MONGO_URL = os.getenv("ARQUITECTURA_MONGO_URL", "mongodb://localhost:27017")
+MONGO_BD = os.getenv("ARQUITECTURA_MONGO_BD", "arquitectura")
+POOL_MAXIMO = int(os.getenv("ARQUITECTURA_MONGO_POOL_MAXIMO", "100"))
+POOL_MINIMO = int(os.getenv("ARQUITECTURA_MONGO_POOL_MINIMO", "10"))
+TIMEOUT_SELECCION_MS = int(os.getenv("ARQUITECTURA_MONGO_TIMEOUT_SELECCION_MS", "5000"))
+TIMEOUT_CONEXION_MS = int(os.getenv("ARQUITECTURA_MONGO_TIMEOUT_CONEXION_MS", "5000"))
+TIMEOUT_SOCKET_MS = int(os.getenv("ARQUITECTURA_MONGO_TIMEOUT_SOCKET_MS", "30000"))
+# auto: se usan transacciones si el servidor es un replica set o un mongos; 0 las desactiva
+TRANSACCIONES = os.getenv("ARQUITECTURA_TRANSACCIONES", "auto")
+ESPERA_POOL_MS = int(os.getenv("ARQUITECTURA_MONGO_ESPERA_POOL_MS", "5000"))
+INACTIVIDAD_MS = int(os.getenv("ARQUITECTURA_MONGO_INACTIVIDAD_MS", "60000"))
+
+# Un solo cliente, y por lo tanto un solo pool de conexiones, para toda la aplicación
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=POOL_MAXIMO,
+    minPoolSize=POOL_MINIMO,
+    serverSelectionTimeoutMS=TIMEOUT_SELECCION_MS,
+    connectTimeoutMS=TIMEOUT_CONEXION_MS,
+    socketTimeoutMS=TIMEOUT_SOCKET_MS,
+    waitQueueTimeoutMS=ESPERA_POOL_MS,
+    maxIdleTimeMS=INACTIVIDAD_MS,
+    # Tiempo, viajes y documentos de MongoDB por petición, para /metrics
+    event_listeners=[EscuchaComandos()],
+)
+db = client[MONGO_BD]
+
+
+# Sesión de la transacción en curso; las escrituras la pasan como session= (None fuera de una)
+sesion_actual: ContextVar = ContextVar("sesion_actual", default=None)
+_al_confirmar: ContextVar[Optional[List[Callable[[], Awaitable[None]]]]] = ContextVar("al_confirmar", default=None)
+_al_abortar: ContextVar[Optional[List[Callable[[], Awaitable[None]]]]] = ContextVar("al_abortar", default=None)
+_replica_set: Optional[bool] = None
+
+
+# Replica set o mongos: admiten transacciones y change streams. Un servidor independiente (o el
+# sustituto en memoria) no admite ninguno de los dos.
+async def replica_set() -> bool:
+    global _replica_set
+    if _replica_set is None:
+        try:
+            hola = await db.client.admin.command("hello")
+            _replica_set = "setName" in hola or hola.get("msg") == "isdbgrid"
+        except Exception:
+            _replica_set = False
+    return _replica_set
+
+
+async def transacciones_disponibles() -> bool:
+    if TRANSACCIONES != "auto":
+        return TRANSACCIONES == "1"
+    return await replica_set()
+
+
+async def _ejecutar(funciones: List[Callable[[], Awaitable[None]]]):
+    while funciones:
+        await funciones.pop(0)()
+
+
+# Corre escribir() en una transacción si hay soporte; with_transaction la reintenta ante
+# errores transitorios (conflictos de escritura), así que escribir() debe poder repetirse.
+# Sin soporte escribir() corre sin sesión y quien observa la escritura compensa por su cuenta.
+async def en_transaccion(escribir: Callable[[], Awaitable]):
+    if not await transacciones_disponibles():
+        return await escribir()
+    confirmar: List[Callable[[], Awaitable[None]]] = []
+    abortar: List[Callable[[], Awaitable[None]]] = []
+
+    async def intento(sesion):
+        # Un reintento implica que el intento anterior se abortó
+        await _ejecutar(abortar)
+        confirmar.clear()
+        tokens = sesion_actual.set(sesion), _al_confirmar.set(confirmar), _al_abortar.set(abortar)
+        try:
+            return await escribir()
+        finally:
+            sesion_actual.reset(tokens[0])
+            _al_confirmar.reset(tokens[1])
+            _al_abortar.reset(tokens[2])
+
+    try:
+        async with await db.client.start_session() as sesion:
+            resultado = await sesion.with_transaction(intento)
+    except BaseException:
+        await _ejecutar(abortar)
+        raise
+    await _ejecutar(confirmar)
+    return resultado
+
+
+# Efectos fuera de la transacción (invalidar el caché, liberar existencias) que deben esperar a
+# que se confirme; sin transacción se ejecutan de inmediato
+async def al_confirmar(funcion: Callable[[], Awaitable[None]]):
+    pendientes = _al_confirmar.get()
+    if pendientes is None:
+        await funcion()
+    else:
+        pendientes.append(funcion)
+
+
+# Compensación de un efecto ya aplicado fuera de la transacción, por si esta se aborta
+async def al_abortar(funcion: Callable[[], Awaitable[None]]):
+    pendientes = _al_abortar.get()
+    if pendientes is not None:
+        pendientes.append(funcion)
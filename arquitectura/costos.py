@@ -0,0 +1,52 @@
+from typing import Dict, List, Optional, Tuple
+
+# Acumulados de costo de los materiales de los proyectos, con la misma regla que los reportes
+# (cantidad por precio unitario, lo que falte cuenta como 0). Son funciones puras que corren en
+# el pool de procesos de los trabajos; este módulo no importa nada de la aplicación, así que un
+# proceso hijo lo carga sin abrir conexiones.
+Categorias = Dict[Optional[str], List[float]]
+
+
+def _importe(partida: dict) -> float:
+    return (partida.get("cantidad") or 0) * (partida.get("precio_unitario") or 0)
+
+
+# Una fila por proyecto y los acumulados por categoría (partidas, cantidad, costo) del lote
+def acumular_costos(proyectos: List[dict]) -> Tuple[List[dict], Categorias]:
+    filas = []
+    categorias: Categorias = {}
+    for proyecto in proyectos:
+        partidas = proyecto.get("materiales") or []
+        costo = 0.0
+        for partida in partidas:
+            importe = _importe(partida)
+            costo += importe
+            acumulado = categorias.setdefault(partida.get("categoria"), [0, 0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += partida.get("cantidad") or 0
+            acumulado[2] += importe
+        filas.append({
+            "idProyecto": proyecto["_id"],
+            "nombre": proyecto.get("nombre"),
+            "estado": proyecto.get("estado"),
+            "responsable": proyecto.get("responsable"),
+            "partidas": len(partidas),
+            "costo_materiales": costo,
+        })
+    return filas, categorias
+
+
+def sumar_categorias(total: Categorias, parcial: Categorias):
+    for categoria, (partidas, cantidad, costo) in parcial.items():
+        acumulado = total.setdefault(categoria, [0, 0, 0.0])
+        acumulado[0] += partidas
+        acumulado[1] += cantidad
+        acumulado[2] += costo
+
+
+# Mismo formato que /reportes/consumo-categorias
+def resumen_categorias(categorias: Categorias) -> List[dict]:
+    return [
+        {"categoria": categoria, "partidas": partidas, "cantidad": cantidad, "costo": costo}
+        for categoria, (partidas, cantidad, costo) in sorted(categorias.items(), key=lambda par: -par[1][2])
+    ]
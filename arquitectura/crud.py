@@ -0,0 +1,473 @@
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Request, Response
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+import conexion
+from admision import carril
+from cache import cache
+from carga_masiva import carga_masiva
+from paginacion import TAMANO_PAGINA_MAX, Paginacion, paginar, respuesta_ndjson
+from parches import construir_parche
+from proyeccion import Proyeccion, proyeccion_de
+from observadores import CambioRechazado, Observador
+from referencias import Referencia, expansion_de
+from serializacion import RespuestaORJSON
+from versiones import CAMPO_VERSION, INCREMENTO, coincide, condicion_version, etiqueta, version_de, versiones_de
+
+# Un listado filtrado: (segmento de la ruta, parámetro de la ruta, campo en MongoDB) y,
+# opcionalmente, la conversión del valor de la ruta (object_id para campos de referencia)
+Listado = Union[Tuple[str, str, str], Tuple[str, str, str, Callable[[str], Any]]]
+# Una consulta propia de la entidad: (ruta, función); se registra antes de /{id} para que
+# una ruta fija como /activos no se tome por un identificador
+Consulta = Tuple[str, Callable]
+
+
+def object_id(valor: str) -> ObjectId:
+    try:
+        return ObjectId(valor)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Identificador inválido")
+
+
+# Cuerpo de POST /{coleccion}/batch-get, para listas de ids que no caben en la URL
+class ConsultaPorIds(BaseModel):
+    ids: List[str]
+
+
+def _id_cambio(cambio: Tuple[Optional[dict], Optional[dict]]):
+    antes, despues = cambio
+    return (despues if despues is not None else antes)["_id"]
+
+
+# Con un repositorio transaccional, la escritura y sus observadores corren en una sola
+# transacción cuando el servidor la admite
+def _atomica(metodo):
+    @wraps(metodo)
+    async def envoltura(self, *argumentos, **opciones):
+        if not self.transaccional or conexion.sesion_actual.get() is not None:
+            return await metodo(self, *argumentos, **opciones)
+        return await conexion.en_transaccion(lambda: metodo(self, *argumentos, **opciones))
+
+    return envoltura
+
+
+def _tras_set(antes: dict, actualizacion: dict) -> Optional[dict]:
+    asignaciones = actualizacion.get("$set", {})
+    if set(actualizacion) != {"$set"} or any("." in campo for campo in asignaciones):
+        return None
+    return {**antes, **asignaciones, CAMPO_VERSION: version_de(antes) + 1}
+
+
+# Acceso a una colección con la conversión de _id que expone la API. Toda escritura sube la
+# versión del documento; con `versiones` (de If-Match) solo se aplica si la versión guardada
+# es una de ellas, en el mismo filtro de la operación.
+class Repositorio:
+    def __init__(
+        self,
+        coleccion: str,
+        campo_id: str,
+        cacheable: bool = True,
+        observadores: Sequence[Observador] = (),
+        transaccional: bool = False,
+    ):
+        self.nombre_coleccion = coleccion
+        self.campo_id = campo_id
+        self.cacheable = cacheable
+        self.observadores = list(observadores)
+        self.transaccional = transaccional
+
+    # Se resuelve en cada llamada para que todas las rutas usen el cliente compartido vigente
+    @property
+    def coleccion(self):
+        return conexion.db[self.nombre_coleccion]
+
+    def a_respuesta(self, documento: dict) -> dict:
+        documento[self.campo_id] = str(documento.pop("_id"))
+        return documento
+
+    @property
+    def sesion(self):
+        return conexion.sesion_actual.get()
+
+    # Los observadores siguientes ven solo los cambios aceptados. Dentro de una transacción un
+    # rechazo la aborta completa; fuera de ella la escritura rechazada se deshace aquí.
+    async def notificar(self, cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+        rechazo = None
+        for observador in self.observadores:
+            try:
+                await observador(cambios)
+            except CambioRechazado as e:
+                if self.sesion is not None:
+                    raise
+                await self._revertir([cambio for cambio in cambios if _id_cambio(cambio) in e.motivos])
+                cambios = [cambio for cambio in cambios if _id_cambio(cambio) not in e.motivos]
+                rechazo = e if rechazo is None else CambioRechazado({**rechazo.motivos, **e.motivos}, rechazo.detail)
+        if rechazo is not None:
+            raise rechazo
+
+    # Deshace escrituras ya hechas; la condición de versión evita pisar una escritura posterior.
+    # La versión no retrocede, para que un ETag ya entregado no vuelva a ser válido.
+    async def _revertir(self, cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+        for antes, despues in cambios:
+            documento_id = _id_cambio((antes, despues))
+            filtro = {"_id": documento_id}
+            if despues is not None and CAMPO_VERSION in despues:
+                filtro.update(condicion_version([version_de(despues)]))
+            if antes is None:
+                await self.coleccion.delete_one(filtro)
+            elif despues is None:
+                await self.coleccion.insert_one(antes)
+            else:
+                await self.coleccion.replace_one(filtro, {**antes, CAMPO_VERSION: version_de(despues) + 1})
+            await self.invalidar(documento_id)
+
+    def _filtro(self, documento_id: ObjectId, versiones: Optional[List[int]] = None) -> dict:
+        if versiones is None:
+            return {"_id": documento_id}
+        return {"_id": documento_id, **condicion_version(versiones)}
+
+    async def existe(self, documento_id: ObjectId) -> bool:
+        return await self.coleccion.count_documents({"_id": documento_id}, limit=1) > 0
+
+    @_atomica
+    async def insertar(self, datos: dict) -> ObjectId:
+        datos[CAMPO_VERSION] = 1
+        resultado = await self.coleccion.insert_one(datos, session=self.sesion)
+        if self.observadores:
+            await self.notificar([(None, datos)])
+        return resultado.inserted_id
+
+    # Una sola operación atómica que ya devuelve el documento actualizado. Con observadores
+    # se pide la versión anterior y la nueva se deduce del $set, sin otra lectura.
+    @_atomica
+    async def actualizar(self, documento_id: ObjectId, datos: dict, versiones: Optional[List[int]] = None) -> Optional[dict]:
+        filtro = self._filtro(documento_id, versiones)
+        if not self.observadores:
+            documento = await self.coleccion.find_one_and_update(
+                filtro, {"$set": datos, **INCREMENTO}, return_document=ReturnDocument.AFTER, session=self.sesion
+            )
+        else:
+            antes = await self.coleccion.find_one_and_update(
+                filtro, {"$set": datos, **INCREMENTO}, return_document=ReturnDocument.BEFORE, session=self.sesion
+            )
+            documento = _tras_set(antes, {"$set": datos}) if antes else None
+            if antes:
+                await self.notificar([(antes, dict(documento))])
+        await self.invalidar(documento_id)
+        return documento
+
+    async def actualizar_sin_respuesta(self, documento_id: ObjectId, datos: dict, versiones: Optional[List[int]] = None) -> bool:
+        if self.observadores:
+            return await self.actualizar(documento_id, datos, versiones) is not None
+        resultado = await self.coleccion.update_one(
+            self._filtro(documento_id, versiones), {"$set": datos, **INCREMENTO}, session=self.sesion
+        )
+        await self.invalidar(documento_id)
+        return resultado.matched_count > 0
+
+    # Actualización parcial: solo viajan y se reescriben los campos tocados
+    @_atomica
+    async def parchar(
+        self, documento_id: ObjectId, actualizacion: dict, filtros: list, devolver: bool = True, versiones: Optional[List[int]] = None
+    ) -> Optional[dict]:
+        opciones = {"array_filters": filtros} if filtros else {}
+        opciones["session"] = self.sesion
+        filtro = self._filtro(documento_id, versiones)
+        cambios = {**actualizacion, **INCREMENTO}
+        try:
+            if self.observadores:
+                antes = await self.coleccion.find_one_and_update(
+                    filtro, cambios, return_document=ReturnDocument.BEFORE, **opciones
+                )
+                documento = None
+                if antes:
+                    documento = _tras_set(antes, actualizacion) or await self.coleccion.find_one({"_id": documento_id}, session=self.sesion)
+                    await self.notificar([(antes, dict(documento))])
+            elif devolver:
+                documento = await self.coleccion.find_one_and_update(
+                    filtro, cambios, return_document=ReturnDocument.AFTER, **opciones
+                )
+            else:
+                resultado = await self.coleccion.update_one(filtro, cambios, **opciones)
+                documento = {"_id": documento_id} if resultado.matched_count else None
+        except OperationFailure as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await self.invalidar(documento_id)
+        return documento
+
+    @_atomica
+    async def eliminar(self, documento_id: ObjectId, versiones: Optional[List[int]] = None) -> bool:
+        filtro = self._filtro(documento_id, versiones)
+        if self.observadores:
+            antes = await self.coleccion.find_one_and_delete(filtro, session=self.sesion)
+            if antes:
+                await self.notificar([(antes, None)])
+            eliminado = antes is not None
+        else:
+            resultado = await self.coleccion.delete_one(filtro, session=self.sesion)
+            eliminado = resultado.deleted_count > 0
+        await self.invalidar(documento_id)
+        return eliminado
+
+    async def obtener(self, documento_id: ObjectId) -> Optional[dict]:
+        if not self.cacheable:
+            return await self.coleccion.find_one({"_id": documento_id})
+        return await cache.obtener(self.nombre_coleccion, documento_id, lambda: self.coleccion.find_one({"_id": documento_id}))
+
+    # Varios documentos con una sola consulta $in para los que no estén en caché
+    async def obtener_varios(self, documento_ids: List[ObjectId]) -> Dict[ObjectId, dict]:
+        async def cargar(faltantes: List[ObjectId]) -> Dict[ObjectId, dict]:
+            cursor = self.coleccion.find({"_id": {"$in": faltantes}})
+            return {documento["_id"]: documento async for documento in cursor}
+
+        if not self.cacheable:
+            return await cargar(documento_ids)
+        return await cache.obtener_varios(self.nombre_coleccion, documento_ids, cargar)
+
+    async def invalidar(self, documento_id: ObjectId):
+        if self.cacheable:
+            await conexion.al_confirmar(lambda: cache.invalidar(self.nombre_coleccion, documento_id))
+
+
+# Prefer: return=minimal (RFC 7240) pide omitir el cuerpo de la respuesta
+def prefiere_minimo(request: Request) -> bool:
+    preferencias = request.headers.get("prefer", "").replace(";", ",").split(",")
+    return any(preferencia.strip() == "return=minimal" for preferencia in preferencias)
+
+
+def respuesta_minima(ubicacion: Optional[str] = None) -> Response:
+    encabezados = {"Preference-Applied": "return=minimal"}
+    if ubicacion:
+        encabezados["Location"] = ubicacion
+    return Response(status_code=204, headers=encabezados)
+
+
+# Genera las rutas CRUD de una entidad; clave es el nombre del documento en la respuesta
+def crear_router(
+    modelo: Type[BaseModel],
+    repositorio: Repositorio,
+    nombre: str,
+    clave: str,
+    listados: Sequence[Listado] = (),
+    masivo: bool = False,
+    consultas: Sequence[Consulta] = (),
+    referencias: Sequence[Referencia] = (),
+) -> APIRouter:
+    coleccion = repositorio.nombre_coleccion
+    campo_id = repositorio.campo_id
+    singular = nombre.lower()
+    router = APIRouter(prefix=f"/{coleccion}", tags=[coleccion])
+    ruta_id = "/{" + campo_id + "}"
+
+    # Una escritura condicionada que no se aplicó: el documento cambió (412) o no existe (404)
+    async def no_escrito(documento_id: ObjectId, versiones: Optional[List[int]]):
+        if versiones is not None and await repositorio.existe(documento_id):
+            raise HTTPException(status_code=412, detail=f"{nombre} modificado por otra petición; vuelva a leerlo")
+        raise HTTPException(status_code=404, detail=f"{nombre} no encontrado")
+
+    # La respuesta se arma con los datos validados y el _id generado, sin volver a leer
+    async def agregar(documento: modelo, request: Request):
+        datos = documento.dict()
+        documento_id = await repositorio.insertar(datos)
+        if prefiere_minimo(request):
+            return respuesta_minima(f"/{coleccion}/{documento_id}")
+        return RespuestaORJSON(
+            {"estatus": "success", "mensaje": f"{nombre} agregado", "id": str(documento_id), clave: repositorio.a_respuesta(datos)},
+            headers={"ETag": etiqueta({CAMPO_VERSION: 1})},
+        )
+
+    async def agregar_masivo(request: Request):
+        al_escribir = repositorio.notificar if repositorio.observadores else None
+        return await carga_masiva(request, repositorio.coleccion, modelo, campo_id, al_escribir=al_escribir)
+
+    # Respuesta de una escritura con el ETag de la versión nueva
+    def escrito(documento: dict) -> Response:
+        version = etiqueta(documento)
+        return RespuestaORJSON(
+            {"estatus": "success", "mensaje": f"{nombre} actualizado", clave: repositorio.a_respuesta(documento)},
+            headers={"ETag": version},
+        )
+
+    # Sin cuerpo no se conoce la versión nueva, salvo que If-Match haya fijado una sola
+    def escrito_minimo(versiones: Optional[List[int]]) -> Response:
+        respuesta = respuesta_minima()
+        if versiones is not None and len(versiones) == 1:
+            respuesta.headers["ETag"] = etiqueta({CAMPO_VERSION: versiones[0] + 1})
+        return respuesta
+
+    async def actualizar(documento: modelo, request: Request, identificador: str = Path(alias=campo_id)):
+        documento_id = object_id(identificador)
+        versiones = versiones_de(request.headers.get("if-match"))
+        if prefiere_minimo(request):
+            if not await repositorio.actualizar_sin_respuesta(documento_id, documento.dict(), versiones):
+                await no_escrito(documento_id, versiones)
+            return escrito_minimo(versiones)
+        actualizado = await repositorio.actualizar(documento_id, documento.dict(), versiones)
+        if not actualizado:
+            await no_escrito(documento_id, versiones)
+        return escrito(actualizado)
+
+    async def parchar(request: Request, cuerpo: dict = Body(...), identificador: str = Path(alias=campo_id)):
+        documento_id = object_id(identificador)
+        versiones = versiones_de(request.headers.get("if-match"))
+        actualizacion, filtros = construir_parche(modelo, cuerpo)
+        minimo = prefiere_minimo(request)
+        actualizado = await repositorio.parchar(documento_id, actualizacion, filtros, devolver=not minimo, versiones=versiones)
+        if not actualizado:
+            await no_escrito(documento_id, versiones)
+        if minimo:
+            return escrito_minimo(versiones)
+        return escrito(actualizado)
+
+    async def eliminar(request: Request, identificador: str = Path(alias=campo_id)):
+        documento_id = object_id(identificador)
+        versiones = versiones_de(request.headers.get("if-match"))
+        if not await repositorio.eliminar(documento_id, versiones):
+            await no_escrito(documento_id, versiones)
+        return RespuestaORJSON({"estatus": "success", "mensaje": f"{nombre} eliminado"})
+
+    # El documento completo puede venir del caché, así que el recorte se hace en Python. Con
+    # If-None-Match vigente se responde 304 sin recortar ni serializar. Las expansiones no llevan
+    # ETag: dependen de documentos de otras colecciones con sus propias versiones.
+    async def consultar(
+        request: Request,
+        identificador: str = Path(alias=campo_id),
+        proyeccion: Optional[Proyeccion] = Depends(proyeccion_de(modelo)),
+        expansiones: List[Referencia] = Depends(expansion_de(referencias)),
+    ):
+        documento = await repositorio.obtener(object_id(identificador))
+        if not documento:
+            raise HTTPException(status_code=404, detail=f"{nombre} no encontrado")
+        encabezados = {}
+        if not expansiones:
+            encabezados["ETag"] = etiqueta(documento, repr(proyeccion.mongo()) if proyeccion else None)
+            if coincide(request.headers.get("if-none-match"), encabezados["ETag"]):
+                return Response(status_code=304, headers=encabezados)
+        if proyeccion:
+            documento = proyeccion.aplicar(documento)
+        for referencia in expansiones:
+            await referencia.expandir([documento])
+        return RespuestaORJSON(
+            {"estatus": "success", "mensaje": f"{nombre} encontrado", clave: repositorio.a_respuesta(documento)},
+            headers=encabezados,
+        )
+
+    async def consultar_por_ids(
+        ids: str = Query(..., description="Ids separados por comas"),
+        proyeccion: Optional[Proyeccion] = Depends(proyeccion_de(modelo)),
+        expansiones: List[Referencia] = Depends(expansion_de(referencias)),
+    ):
+        return await responder_por_ids(repositorio, ids.split(","), proyeccion, expansiones)
+
+    async def consultar_por_ids_post(
+        consulta: ConsultaPorIds,
+        proyeccion: Optional[Proyeccion] = Depends(proyeccion_de(modelo)),
+        expansiones: List[Referencia] = Depends(expansion_de(referencias)),
+    ):
+        return await responder_por_ids(repositorio, consulta.ids, proyeccion, expansiones)
+
+    router.add_api_route("", agregar, methods=["POST"], name=f"agregar_{singular}")
+    if masivo:
+        router.add_api_route("/bulk", agregar_masivo, methods=["POST"], name=f"agregar_{coleccion}_masivo")
+    router.add_api_route("/batch-get", consultar_por_ids_post, methods=["POST"], name=f"consultar_{coleccion}_por_ids_post")
+    for ruta, consulta in consultas:
+        router.add_api_route(ruta, consulta, methods=["GET"], name=consulta.__name__)
+    # Si la entidad ya tiene su propio GET /{coleccion}, ese debe atender ?ids= con responder_por_ids
+    if not any(ruta == "" for ruta, _ in consultas):
+        router.add_api_route("", consultar_por_ids, methods=["GET"], name=f"consultar_{coleccion}_por_ids")
+    router.add_api_route(ruta_id, actualizar, methods=["PUT"], name=f"actualizar_{singular}")
+    router.add_api_route(ruta_id, parchar, methods=["PATCH"], name=f"parchar_{singular}")
+    router.add_api_route(ruta_id, eliminar, methods=["DELETE"], name=f"eliminar_{singular}")
+    router.add_api_route(ruta_id, consultar, methods=["GET"], name=f"consultar_{singular}", openapi_extra=carril("por_id"))
+    for segmento, parametro, campo, *conversion in listados:
+        router.add_api_route(
+            f"/{segmento}/{{{parametro}}}",
+            _crear_listado(repositorio, modelo, parametro, campo, conversion[0] if conversion else None, referencias),
+            methods=["GET"],
+            name=f"consultar_{coleccion}_por_{segmento}",
+        )
+    return router
+
+
+# Respuesta de un listado: página con sobre y next_cursor, o flujo NDJSON. La proyección se
+# resuelve en MongoDB, así que los campos omitidos no salen del servidor.
+async def responder_listado(
+    repositorio: Repositorio,
+    filtro: dict,
+    paginacion: Paginacion,
+    proyeccion: Optional[Proyeccion] = None,
+    orden: Optional[str] = None,
+    expansiones: Sequence[Referencia] = (),
+):
+    coleccion = repositorio.nombre_coleccion
+    campos = proyeccion.mongo() if proyeccion else None
+    if paginacion.ndjson:
+        etapas = [etapa for referencia in expansiones for etapa in referencia.etapas()]
+
+        def preparar(documento: dict):
+            for referencia in expansiones:
+                referencia.ordenar(documento)
+
+        return respuesta_ndjson(repositorio.coleccion, filtro, paginacion, repositorio.campo_id, campos, orden, etapas, preparar)
+    documentos, siguiente = await paginar(repositorio.coleccion, filtro, paginacion, campos, orden)
+    for referencia in expansiones:
+        await referencia.expandir(documentos)
+    return RespuestaORJSON({
+        "estatus": "success",
+        "mensaje": f"{coleccion.capitalize()} encontrados",
+        coleccion: [repositorio.a_respuesta(documento) for documento in documentos],
+        "next_cursor": siguiente,
+    })
+
+
+# Documentos por id en el orden pedido, con una sola consulta $in en lugar de una petición por
+# id. Los ids repetidos se devuelven una vez; los inválidos o inexistentes van en `faltantes`.
+async def responder_por_ids(
+    repositorio: Repositorio,
+    ids: Sequence[str],
+    proyeccion: Optional[Proyeccion] = None,
+    expansiones: Sequence[Referencia] = (),
+):
+    coleccion = repositorio.nombre_coleccion
+    solicitados = list(dict.fromkeys(valor.strip() for valor in ids if valor.strip()))
+    if len(solicitados) > TAMANO_PAGINA_MAX:
+        raise HTTPException(status_code=400, detail=f"Se admiten hasta {TAMANO_PAGINA_MAX} ids por consulta")
+    validos = {valor: ObjectId(valor) for valor in solicitados if len(valor) == 24 and ObjectId.is_valid(valor)}
+    encontrados = await repositorio.obtener_varios(list(validos.values())) if validos else {}
+    documentos = [encontrados[validos[valor]] for valor in solicitados if validos.get(valor) in encontrados]
+    if proyeccion:
+        documentos = [proyeccion.aplicar(documento) for documento in documentos]
+    for referencia in expansiones:
+        await referencia.expandir(documentos)
+    return RespuestaORJSON({
+        "estatus": "success",
+        "mensaje": f"{coleccion.capitalize()} encontrados",
+        coleccion: [repositorio.a_respuesta(documento) for documento in documentos],
+        "faltantes": [valor for valor in solicitados if validos.get(valor) not in encontrados],
+    })
+
+
+def _crear_listado(
+    repositorio: Repositorio,
+    modelo: Type[BaseModel],
+    parametro: str,
+    campo: str,
+    conversion: Optional[Callable[[str], Any]] = None,
+    referencias: Sequence[Referencia] = (),
+):
+    async def listar(
+        valor: str = Path(alias=parametro),
+        paginacion: Paginacion = Depends(),
+        proyeccion: Optional[Proyeccion] = Depends(proyeccion_de(modelo)),
+        expansiones: List[Referencia] = Depends(expansion_de(referencias)),
+    ):
+        filtro = {campo: conversion(valor) if conversion else valor}
+        return await responder_listado(repositorio, filtro, paginacion, proyeccion, expansiones=expansiones)
+
+    return listar
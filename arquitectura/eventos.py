@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+import conexion
+from metricas import medicion_actual
+from observadores import Observador
+from serializacion import a_json
+
+# Cambios en vivo por server-sent events. Con un replica set cada colección se sigue con un solo
+# change stream por proceso, compartido por todos sus suscriptores; en un servidor independiente
+# los repositorios anotan sus escrituras en la colección `eventos` y un solo sondeo por colección
+# las reparte. "auto" elige según el servidor; "cambios" o "sondeo" lo fijan.
+EVENTOS_MODO = os.getenv("ARQUITECTURA_EVENTOS", "auto")
+SONDEO_SEGUNDOS = float(os.getenv("ARQUITECTURA_EVENTOS_SONDEO", "1"))
+# El _id de cada anotación lleva la hora del proceso que la escribió; el sondeo relee este margen
+# hacia atrás para no perder lo que otro proceso anotó con un _id apenas menor
+MARGEN_SONDEO_SEGUNDOS = float(os.getenv("ARQUITECTURA_EVENTOS_MARGEN", "2"))
+RETENCION_SEGUNDOS = int(os.getenv("ARQUITECTURA_EVENTOS_RETENCION", "3600"))
+LATIDO_SEGUNDOS = float(os.getenv("ARQUITECTURA_EVENTOS_LATIDO", "15"))
+# Eventos recientes por colección con los que se reanuda sin abrir otro flujo
+HISTORIAL = int(os.getenv("ARQUITECTURA_EVENTOS_HISTORIAL", "1000"))
+# Eventos sin leer que se guardan por suscriptor antes de cortarlo
+PENDIENTES_MAX = int(os.getenv("ARQUITECTURA_EVENTOS_PENDIENTES_MAX", "1000"))
+# Con MongoDB 6.0+ y changeStreamPreAndPostImages activado en la colección, las bajas traen el
+# documento anterior y también se filtran por llave; sin él llegan a todos los suscriptores
+PREIMAGENES = os.getenv("ARQUITECTURA_EVENTOS_PREIMAGENES", "0") == "1"
+REINTENTO_MS = 3000
+COLECCION_EVENTOS = "eventos"
+
+registro = logging.getLogger("arquitectura.eventos")
+
+# Colecciones que se pueden seguir: campo de id de la API y campos por los que se filtra
+# (?proyecto_id=...); en los campos de lista basta con que el valor sea uno de los elementos
+COLECCIONES: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "proyectos": ("idProyecto", ("estado", "responsable")),
+    "pedidos": ("idPedido", ("proyecto_id", "proveedor_id", "material_id", "estatus")),
+    "materiales": ("idMaterial", ("unidad_medida",)),
+    "proveedores": ("idProveedor", ()),
+    "clientes": ("idCliente", ("proyectos",)),
+    "trabajadores": ("idTrabajador", ("puesto", "proyectos_asignados")),
+}
+OPERACIONES = {"insert": "alta", "update": "cambio", "replace": "cambio", "delete": "baja"}
+
+
+# El evento de reanudación ya no está disponible; el cliente debe recargar y suscribirse de nuevo
+class HistorialPerdido(Exception):
+    pass
+
+
+# Valores de los campos filtrables, como texto; con antes y después, un pedido que cambia de
+# proyecto le llega a los suscriptores de los dos
+def _llaves(coleccion: str, documentos: Iterable[Optional[dict]]) -> Dict[str, List[str]]:
+    llaves: Dict[str, List[str]] = {}
+    for documento in documentos:
+        if documento is None:
+            continue
+        for campo in COLECCIONES[coleccion][1]:
+            valor = documento.get(campo)
+            for elemento in valor if isinstance(valor, list) else [valor]:
+                if elemento is not None and str(elemento) not in llaves.setdefault(campo, []):
+                    llaves[campo].append(str(elemento))
+    return llaves
+
+
+# Un cambio listo para emitir; llaves es None si no se conoce el documento (una baja sin
+# preimagen) y entonces pasa todos los filtros salvo el de id
+class Evento:
+    __slots__ = ("token", "coleccion", "operacion", "documento_id", "documento", "llaves")
+
+    def __init__(self, token: str, coleccion: str, operacion: str, documento_id, documento: Optional[dict], llaves: Optional[Dict[str, List[str]]]):
+        self.token = token
+        self.coleccion = coleccion
+        self.operacion = operacion
+        self.documento_id = documento_id
+        self.documento = documento
+        self.llaves = llaves
+
+    def cumple(self, filtro: Dict[str, str]) -> bool:
+        campo_id = COLECCIONES[self.coleccion][0]
+        for campo, valor in filtro.items():
+            if campo == campo_id:
+                if str(self.documento_id) != valor:
+                    return False
+            elif self.llaves is not None and valor not in self.llaves.get(campo, ()):
+                return False
+        return True
+
+    def sse(self) -> bytes:
+        campo_id = COLECCIONES[self.coleccion][0]
+        documento = None
+        if self.documento is not None:
+            documento = {campo: valor for campo, valor in self.documento.items() if campo != "_id"}
+            documento[campo_id] = str(self.documento_id)
+        datos = a_json({
+            "coleccion": self.coleccion,
+            "operacion": self.operacion,
+            campo_id: str(self.documento_id),
+            "documento": documento,
+        })
+        return b"id: " + self.token.encode() + b"\nevent: " + self.operacion.encode() + b"\ndata: " + datos + b"\n\n"
+
+
+async def modo() -> str:
+    if EVENTOS_MODO != "auto":
+        return EVENTOS_MODO
+    return "cambios" if await conexion.replica_set() else "sondeo"
+
+
+def _de_cambio(coleccion: str, cambio: dict) -> Evento:
+    antes, despues = cambio.get("fullDocumentBeforeChange"), cambio.get("fullDocument")
+    imagenes = [documento for documento in (antes, despues) if documento is not None]
+    return Evento(
+        cambio["_id"]["_data"],
+        coleccion,
+        OPERACIONES[cambio["operationType"]],
+        cambio["documentKey"]["_id"],
+        despues,
+        _llaves(coleccion, imagenes) if imagenes else None,
+    )
+
+
+# El token de reanudación es el _data del resume token de MongoDB
+async def _seguir_cambios(coleccion: str, desde: Optional[str]) -> AsyncIterator[Evento]:
+    opciones = {"full_document": "updateLookup"}
+    if PREIMAGENES:
+        opciones["full_document_before_change"] = "whenAvailable"
+    if desde is not None:
+        opciones["resume_after"] = {"_data": desde}
+    etapas = [{"$match": {"operationType": {"$in": list(OPERACIONES)}}}]
+    try:
+        async with conexion.db[coleccion].watch(etapas, **opciones) as flujo:
+            async for cambio in flujo:
+                if cambio["operationType"] not in OPERACIONES:
+                    break
+                yield _de_cambio(coleccion, cambio)
+    except OperationFailure as e:
+        raise HistorialPerdido(str(e)) from e
+    # Un invalidate (la colección se borró o renombró) cierra el flujo
+    raise HistorialPerdido(f"El flujo de {coleccion} se cerró")
+
+
+# El token de reanudación es el _id de la anotación
+async def _seguir_registro(coleccion: str, desde: Optional[str]) -> AsyncIterator[Evento]:
+    if desde is not None and not ObjectId.is_valid(desde):
+        raise HistorialPerdido(f"Evento desconocido: {desde}")
+    corte = ObjectId(desde) if desde is not None else ObjectId()
+    if corte.generation_time < datetime.now(timezone.utc) - timedelta(seconds=RETENCION_SEGUNDOS):
+        raise HistorialPerdido(f"El evento {desde} ya no se conserva")
+    ultimo, vistos = corte, set()
+    while True:
+        inicio = ObjectId.from_datetime(ultimo.generation_time - timedelta(seconds=MARGEN_SONDEO_SEGUNDOS))
+        vistos = {anotacion_id for anotacion_id in vistos if anotacion_id >= inicio}
+        filtro = {"coleccion": coleccion, "_id": {"$gt": max(corte, inicio)}}
+        async for anotacion in conexion.db[COLECCION_EVENTOS].find(filtro).sort("_id", ASCENDING):
+            if anotacion["_id"] in vistos:
+                continue
+            vistos.add(anotacion["_id"])
+            ultimo = max(ultimo, anotacion["_id"])
+            yield Evento(
+                str(anotacion["_id"]),
+                coleccion,
+                anotacion["operacion"],
+                anotacion["documento_id"],
+                anotacion.get("documento"),
+                anotacion["llaves"],
+            )
+        await asyncio.sleep(SONDEO_SEGUNDOS)
+
+
+async def _seguir(coleccion: str, desde: Optional[str]) -> AsyncIterator[Evento]:
+    seguir = _seguir_cambios if await modo() == "cambios" else _seguir_registro
+    async for evento in seguir(coleccion, desde):
+        yield evento
+
+
+# Observador que anota las escrituras de un repositorio para el sondeo; con change streams no
+# hace nada. Va al final de la lista para anotar solo los cambios aceptados. Las escrituras que
+# no pasan por un repositorio (existencias, referencias) solo se ven con change streams.
+def registrar_eventos(coleccion: str) -> Observador:
+    async def anotar(cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+        if not cambios or await modo() != "sondeo":
+            return
+        fecha = datetime.now(timezone.utc)
+        anotaciones = []
+        for antes, despues in cambios:
+            anotaciones.append({
+                "_id": ObjectId(),
+                "fecha": fecha,
+                "coleccion": coleccion,
+                "operacion": "alta" if antes is None else "baja" if despues is None else "cambio",
+                "documento_id": (despues if despues is not None else antes)["_id"],
+                "documento": despues,
+                "llaves": _llaves(coleccion, (antes, despues)),
+            })
+        await conexion.db[COLECCION_EVENTOS].insert_many(anotaciones, session=conexion.sesion_actual.get())
+
+    return anotar
+
+
+# Las anotaciones caducan por TTL tras RETENCION_SEGUNDOS, que es lo más atrás que se puede reanudar
+async def preparar_registro():
+    if await modo() != "sondeo":
+        return
+    await conexion.db[COLECCION_EVENTOS].create_indexes([
+        IndexModel([("coleccion", ASCENDING), ("_id", ASCENDING)], name="coleccion_1__id_1"),
+        IndexModel([("fecha", ASCENDING)], name="fecha_1", expireAfterSeconds=RETENCION_SEGUNDOS),
+    ])
+
+
+# Marca al final de la cola de un suscriptor que no alcanzó a leer
+DESBORDE = object()
+
+
+class Suscripcion:
+    def __init__(self, filtro: Dict[str, str]):
+        self.filtro = filtro
+        self.cola: asyncio.Queue = asyncio.Queue()
+        self.cerrada = False
+
+    def entregar(self, evento: Evento):
+        if self.cerrada or not evento.cumple(self.filtro):
+            return
+        if self.cola.qsize() >= PENDIENTES_MAX:
+            self.terminar(DESBORDE)
+        else:
+            self.cola.put_nowait(evento)
+
+    def terminar(self, motivo):
+        if not self.cerrada:
+            self.cerrada = True
+            self.cola.put_nowait(motivo)
+
+
+# Un flujo de MongoDB por colección repartido entre todos sus suscriptores. Se abre con el
+# primero y se cierra con el último; mientras está abierto guarda los últimos HISTORIAL eventos
+# para reanudar sin abrir otro flujo.
+class Difusor:
+    def __init__(self, coleccion: str):
+        self.coleccion = coleccion
+        self.suscripciones: Set[Suscripcion] = set()
+        self.recientes: Deque[Evento] = deque(maxlen=HISTORIAL)
+        self._tarea: Optional[asyncio.Task] = None
+
+    # Con `desde`, repite lo que sigue a ese evento; si ya no está en el historial devuelve False
+    def suscribir(self, suscripcion: Suscripcion, desde: Optional[str] = None) -> bool:
+        if desde is not None:
+            tokens = [evento.token for evento in self.recientes]
+            if self._tarea is None or desde not in tokens:
+                return False
+            for evento in list(self.recientes)[tokens.index(desde) + 1:]:
+                suscripcion.entregar(evento)
+        self.suscripciones.add(suscripcion)
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._difundir())
+        return True
+
+    def cancelar(self, suscripcion: Suscripcion):
+        self.suscripciones.discard(suscripcion)
+        if not self.suscripciones and self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+            self.recientes.clear()
+
+    async def _difundir(self):
+        # La tarea nace dentro de la primera petición; sus comandos no son de esa petición
+        medicion_actual.set(None)
+        try:
+            async for evento in _seguir(self.coleccion, None):
+                self.recientes.append(evento)
+                for suscripcion in list(self.suscripciones):
+                    suscripcion.entregar(evento)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            registro.warning("Se cortó el flujo de eventos de %s: %s", self.coleccion, e)
+            motivo = e
+        else:
+            motivo = HistorialPerdido(f"El flujo de {self.coleccion} se cerró")
+        if self._tarea is asyncio.current_task():
+            for suscripcion in self.suscripciones:
+                suscripcion.terminar(motivo)
+            self.suscripciones.clear()
+            self._tarea = None
+            self.recientes.clear()
+
+
+difusores: Dict[str, Difusor] = {coleccion: Difusor(coleccion) for coleccion in COLECCIONES}
+reanudaciones: Set[asyncio.Task] = set()
+
+
+# Un suscriptor que vuelve con un evento fuera del historial sigue con su propio flujo desde ahí
+async def _reanudar(coleccion: str, desde: str, suscripcion: Suscripcion):
+    medicion_actual.set(None)
+    try:
+        async for evento in _seguir(coleccion, desde):
+            suscripcion.entregar(evento)
+            if suscripcion.cerrada:
+                return
+    except Exception as e:
+        suscripcion.terminar(e)
+
+
+def _final(motivo) -> bytes:
+    if motivo is DESBORDE:
+        # Al reconectar con Last-Event-ID se retoma donde se quedó
+        return b"event: desbordado\ndata: " + a_json({"detalle": "Demasiados eventos sin leer; reconecte para continuar"}) + b"\n\n"
+    if isinstance(motivo, HistorialPerdido):
+        # Un id vacío borra el Last-Event-ID del cliente, para que la reconexión empiece de cero
+        return b"id\nevent: reinicio\ndata: " + a_json({"detalle": str(motivo)}) + b"\n\n"
+    return b"event: fallo\ndata: " + a_json({"detalle": "Se cortó el flujo de eventos; reconecte para continuar"}) + b"\n\n"
+
+
+async def _emitir(suscripcion: Suscripcion, cancelar: Callable[[], None]):
+    try:
+        yield f"retry: {REINTENTO_MS}\n\n".encode()
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), LATIDO_SEGUNDOS)
+            except asyncio.TimeoutError:
+                # Un comentario mantiene viva la conexión a través de proxies
+                yield b": latido\n\n"
+                continue
+            if not isinstance(evento, Evento):
+                yield _final(evento)
+                return
+            yield evento.sse()
+    finally:
+        cancelar()
+
+
+def estadisticas() -> dict:
+    return {
+        "colecciones": {
+            coleccion: {
+                "suscriptores": len(difusor.suscripciones),
+                "flujo_abierto": difusor._tarea is not None,
+                "historial": len(difusor.recientes),
+            }
+            for coleccion, difusor in difusores.items()
+        },
+        "reanudaciones": len(reanudaciones),
+    }
+
+
+router = APIRouter(prefix="/eventos", tags=["eventos"])
+
+
+# Altas, cambios y bajas de una colección como text/event-stream; ?proyecto_id=... filtra por
+# llave. EventSource reconecta solo y manda Last-Event-ID; ?desde= sirve a quien no lo envía.
+@router.get("/{coleccion}")
+async def seguir(coleccion: str, request: Request, desde: Optional[str] = None):
+    if coleccion not in COLECCIONES:
+        raise HTTPException(status_code=404, detail=f"No hay eventos de {coleccion}")
+    campo_id, campos = COLECCIONES[coleccion]
+    filtro = {campo: valor for campo, valor in request.query_params.items() if campo != "desde"}
+    desconocidos = sorted(set(filtro) - set(campos) - {campo_id})
+    if desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No se puede filtrar {coleccion} por {', '.join(desconocidos)}; use {', '.join((campo_id,) + campos)}",
+        )
+    desde = desde or request.headers.get("last-event-id") or None
+    suscripcion = Suscripcion(filtro)
+    difusor = difusores[coleccion]
+    if difusor.suscribir(suscripcion, desde):
+        cancelar = lambda: difusor.cancelar(suscripcion)
+    else:
+        tarea = asyncio.create_task(_reanudar(coleccion, desde, suscripcion))
+        reanudaciones.add(tarea)
+        tarea.add_done_callback(reanudaciones.discard)
+        cancelar = tarea.cancel
+    return StreamingResponse(
+        _emitir(suscripcion, cancelar),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,146 @@
+# Fechas guardadas como fechas BSON y migración de los documentos que aún las tienen
+# como texto. Desde arquitectura/:
+#   python -m fechas                        # todas las colecciones
+#   python -m fechas pedidos --lote 500     # solo pedidos, en lotes de 500
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Annotated, Dict, List, Optional, Tuple
+
+from pydantic import AfterValidator
+from pymongo import UpdateOne
+
+import conexion
+from versiones import INCREMENTO
+
+
+# MongoDB guarda en UTC y Motor devuelve fechas sin zona; las entradas se normalizan igual
+# para que la respuesta de una escritura coincida con la lectura posterior
+def _a_utc(valor: datetime) -> datetime:
+    if valor.tzinfo is not None:
+        valor = valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return valor
+
+
+Fecha = Annotated[datetime, AfterValidator(_a_utc)]
+
+# Campos de fecha por colección; "lista.campo" es un campo dentro de cada elemento de la lista.
+# Clientes y trabajadores ya guardan los proyectos como ids; las fechas de las copias embebidas
+# que aún queden las convierte la migración de referencias al reemplazarlas.
+CAMPOS_FECHA: Dict[str, List[str]] = {
+    "proyectos": ["fecha_inicio", "fecha_fin"],
+    "pedidos": ["fecha_pedido"],
+    "trabajadores": ["fecha_contratacion", "fecha_terminacion"],
+}
+
+TAMANO_LOTE = int(os.getenv("ARQUITECTURA_TAMANO_LOTE", "1000"))
+FORMATOS = ("%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d")
+
+
+# Filtro de intervalo semiabierto [desde, hasta) sobre un campo de fecha
+def rango_fechas(campo: str, desde: Optional[datetime] = None, hasta: Optional[datetime] = None) -> dict:
+    condicion = {}
+    if desde is not None:
+        condicion["$gte"] = _a_utc(desde)
+    if hasta is not None:
+        condicion["$lt"] = _a_utc(hasta)
+    return {campo: condicion} if condicion else {}
+
+
+def a_fecha(valor):
+    if not isinstance(valor, str):
+        return valor
+    texto = valor.strip()
+    try:
+        return _a_utc(datetime.fromisoformat(texto.replace("Z", "+00:00")))
+    except ValueError:
+        pass
+    for formato in FORMATOS:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha no reconocida: {valor!r}")
+
+
+# Asignaciones $set que convierten los textos de un documento; las listas se reescriben completas.
+# Un texto que no se reconoce se deja como está y se reporta, sin frenar el resto del documento.
+def _conversiones(documento: dict, campos: List[str]) -> Tuple[dict, List[str]]:
+    asignaciones, errores = {}, []
+
+    def convertir(valor):
+        if not isinstance(valor, str):
+            return valor
+        try:
+            return a_fecha(valor)
+        except ValueError as e:
+            errores.append(str(e))
+            return valor
+
+    for ruta in campos:
+        lista, _, campo = ruta.rpartition(".")
+        if not lista:
+            valor = convertir(documento.get(campo))
+            if valor is not documento.get(campo):
+                asignaciones[campo] = valor
+            continue
+        elementos = asignaciones.get(lista, documento.get(lista))
+        if not isinstance(elementos, list):
+            continue
+        convertidos = [
+            {**elemento, campo: convertir(elemento[campo])} if isinstance(elemento, dict) and campo in elemento else elemento
+            for elemento in elementos
+        ]
+        if convertidos != elementos:
+            asignaciones[lista] = convertidos
+    return asignaciones, errores
+
+
+def _filtro_pendientes(campos: List[str]) -> dict:
+    return {"$or": [{ruta: {"$type": "string"}} for ruta in campos]}
+
+
+# Recorre por _id solo los documentos con fechas en texto y escribe un bulk_write por lote
+async def migrar_coleccion(db, coleccion: str, tamano_lote: int = TAMANO_LOTE) -> dict:
+    campos = CAMPOS_FECHA[coleccion]
+    resumen = {"coleccion": coleccion, "revisados": 0, "convertidos": 0, "errores": []}
+    ultimo = None
+    while True:
+        filtro = _filtro_pendientes(campos)
+        if ultimo is not None:
+            filtro = {"$and": [filtro, {"_id": {"$gt": ultimo}}]}
+        proyeccion = {campo.split(".")[0]: 1 for campo in campos}
+        lote = await db[coleccion].find(filtro, proyeccion).sort("_id", 1).limit(tamano_lote).to_list(length=tamano_lote)
+        if not lote:
+            return resumen
+        operaciones = []
+        for documento in lote:
+            asignaciones, errores = _conversiones(documento, campos)
+            resumen["errores"].extend({"_id": str(documento["_id"]), "error": error} for error in errores)
+            if asignaciones:
+                operaciones.append(UpdateOne({"_id": documento["_id"]}, {"$set": asignaciones, **INCREMENTO}))
+        if operaciones:
+            resultado = await db[coleccion].bulk_write(operaciones, ordered=False)
+            resumen["convertidos"] += resultado.modified_count
+        resumen["revisados"] += len(lote)
+        ultimo = lote[-1]["_id"]
+
+
+async def migrar_fechas(db=None, colecciones: Optional[List[str]] = None, tamano_lote: int = TAMANO_LOTE) -> List[dict]:
+    db = db if db is not None else conexion.db
+    return [await migrar_coleccion(db, coleccion, tamano_lote) for coleccion in colecciones or CAMPOS_FECHA]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convierte a fechas BSON los campos de fecha guardados como texto")
+    parser.add_argument("colecciones", nargs="*", metavar="coleccion", help=", ".join(CAMPOS_FECHA))
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    argumentos = parser.parse_args()
+    desconocidas = set(argumentos.colecciones) - set(CAMPOS_FECHA)
+    if desconocidas:
+        parser.error(f"colecciones sin campos de fecha: {', '.join(sorted(desconocidas))}")
+    for resumen in asyncio.run(migrar_fechas(colecciones=argumentos.colecciones, tamano_lote=argumentos.lote)):
+        print(f"{resumen['coleccion']}: {resumen['revisados']} revisados, {resumen['convertidos']} convertidos, {len(resumen['errores'])} errores")
+        for error in resumen["errores"]:
+            print(f"  {error['_id']}: {error['error']}")
@@ -0,0 +1,108 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import ASCENDING, TEXT, IndexModel
+
+# Índices que necesita cada ruta de consulta. Los listados paginan por _id,
+# así que los filtros de igualdad llevan _id como segundo campo. Las consultas por
+# intervalo de fechas paginan por (fecha, _id) y empiezan por la fecha. Cada colección
+# admite un solo índice de texto, que es el que usa /buscar.
+INDICES: Dict[str, List[List[Tuple[str, Union[int, str]]]]] = {
+    "proyectos": [
+        [("estado", ASCENDING), ("_id", ASCENDING)],
+        [("responsable", ASCENDING), ("_id", ASCENDING)],
+        [("fecha_fin", ASCENDING), ("_id", ASCENDING), ("fecha_inicio", ASCENDING)],
+        [("nombre", TEXT), ("descripcion", TEXT)],
+    ],
+    "pedidos": [
+        [("proyecto_id", ASCENDING), ("_id", ASCENDING)],
+        [("proveedor_id", ASCENDING), ("_id", ASCENDING)],
+        [("proyecto_id", ASCENDING), ("fecha_pedido", ASCENDING)],
+        [("proveedor_id", ASCENDING), ("estatus", ASCENDING)],
+        [("fecha_pedido", ASCENDING), ("_id", ASCENDING)],
+    ],
+    "clientes": [
+        [("proyectos", ASCENDING), ("_id", ASCENDING)],
+    ],
+    "trabajadores": [
+        [("proyectos_asignados", ASCENDING), ("_id", ASCENDING)],
+    ],
+    "materiales": [
+        [("categoria", ASCENDING), ("_id", ASCENDING)],
+        [("nombre", TEXT), ("descripcion", TEXT)],
+    ],
+    "proveedores": [
+        [("productos.nombre", ASCENDING), ("_id", ASCENDING)],
+        [("nombre", TEXT)],
+    ],
+}
+
+# Peso de cada campo en el puntaje de los índices de texto; el idioma fija raíces y palabras vacías
+PESOS_TEXTO = {"nombre": 10, "descripcion": 2}
+IDIOMA_TEXTO = "spanish"
+
+# Formas de consulta vistas en tiempo de ejecución: (colección, campos del filtro) -> veces
+consultas_vistas: Counter = Counter()
+
+
+def _nombre_indice(llaves: List[Tuple[str, Union[int, str]]]) -> str:
+    return "_".join(f"{campo}_{orden}" for campo, orden in llaves)
+
+
+def _modelo_indice(llaves: List[Tuple[str, Union[int, str]]]) -> IndexModel:
+    opciones = {}
+    campos_texto = [campo for campo, tipo in llaves if tipo == TEXT]
+    if campos_texto:
+        opciones = {"weights": {campo: PESOS_TEXTO.get(campo, 1) for campo in campos_texto}, "default_language": IDIOMA_TEXTO}
+    return IndexModel(llaves, name=_nombre_indice(llaves), **opciones)
+
+
+# create_indexes no hace nada si el índice ya existe con la misma definición
+async def crear_indices(db, colecciones: Optional[Iterable[str]] = None):
+    for coleccion in colecciones or INDICES:
+        modelos = [_modelo_indice(llaves) for llaves in INDICES[coleccion]]
+        await db[coleccion].create_indexes(modelos)
+
+
+def forma_consulta(filtro: dict) -> Tuple[str, ...]:
+    return tuple(sorted(campo for campo in filtro if campo != "_id"))
+
+
+def registrar_consulta(coleccion: str, filtro: dict):
+    consultas_vistas[(coleccion, forma_consulta(filtro))] += 1
+
+
+# Una forma está cubierta si sus campos son el prefijo de algún índice declarado;
+# el _id intermedio de los índices de paginación no cuenta
+def tiene_indice(coleccion: str, forma: Tuple[str, ...]) -> bool:
+    if not forma:
+        return True
+    for llaves in INDICES.get(coleccion, []):
+        campos = [campo for campo, _ in llaves if campo != "_id"]
+        if set(campos[:len(forma)]) == set(forma):
+            return True
+    return False
+
+
+def consultas_sin_indice() -> List[dict]:
+    return [
+        {"coleccion": coleccion, "campos": list(forma), "veces": veces}
+        for (coleccion, forma), veces in consultas_vistas.most_common()
+        if not tiene_indice(coleccion, forma)
+    ]
+
+
+async def estadisticas_indices(db) -> Dict[str, List[dict]]:
+    estadisticas = {}
+    for coleccion in INDICES:
+        uso = await db[coleccion].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        estadisticas[coleccion] = [
+            {
+                "nombre": indice["name"],
+                "llaves": dict(indice["key"]),
+                "accesos": indice["accesses"]["ops"],
+                "desde": indice["accesses"]["since"],
+            }
+            for indice in uso
+        ]
+    return estadisticas
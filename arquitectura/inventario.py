@@ -0,0 +1,170 @@
+# Existencias de materiales ligadas al estatus de los pedidos. Un pedido retiene `cantidad` de
+# su material mientras su estatus no sea uno de ESTATUS_SIN_RESERVA; cada alta, cambio o baja de
+# pedidos ajusta cantidad_disponible con un $inc condicionado, así que nunca queda en negativo.
+# Las existencias vigentes ya descuentan los pedidos anteriores (así las dejaba la conciliación
+# nocturna), por lo que los pedidos existentes cuentan como retenidos desde el principio.
+import asyncio
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+
+import conexion
+from cache import cache
+from observadores import CambioRechazado
+from versiones import CAMPO_VERSION
+
+ESTATUS_SIN_RESERVA = {
+    estatus.strip() for estatus in os.getenv("ARQUITECTURA_ESTATUS_SIN_RESERVA", "cancelado,rechazado").split(",") if estatus.strip()
+}
+INTENTOS_RESERVA = int(os.getenv("ARQUITECTURA_INTENTOS_RESERVA", "10"))
+CAMPO_EXISTENCIAS = "cantidad_disponible"
+
+
+def _id_material(valor) -> Optional[ObjectId]:
+    if isinstance(valor, ObjectId):
+        return valor
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor)
+    return None
+
+
+# Lo que retiene un pedido: (material, cantidad), o None
+def reserva(pedido: Optional[dict]) -> Optional[Tuple[object, int]]:
+    if pedido is None or pedido.get("estatus") in ESTATUS_SIN_RESERVA:
+        return None
+    cantidad = pedido.get("cantidad") or 0
+    if cantidad <= 0:
+        return None
+    return pedido.get("material_id"), cantidad
+
+
+# Ajuste neto por material de un cambio; positivo retira existencias, negativo las devuelve
+def ajustes(antes: Optional[dict], despues: Optional[dict]) -> Dict[object, int]:
+    netos: Dict[object, int] = defaultdict(int)
+    for pedido, signo in ((antes, -1), (despues, 1)):
+        retenido = reserva(pedido)
+        if retenido:
+            netos[retenido[0]] += signo * retenido[1]
+    return {material: cantidad for material, cantidad in netos.items() if cantidad}
+
+
+# Cola de ajustes por material. Las peticiones que tocan el mismo material mientras hay una
+# escritura en vuelo se juntan en un lote y se aplican con un solo $inc condicionado, en lugar
+# de competir documento por documento; así un material muy pedido no se vuelve un cuello de
+# botella de viajes a MongoDB. Si el lote completo no cabe, se reparte en orden de llegada
+# con lo que hay en existencia.
+class ColaReservas:
+    def __init__(self):
+        self._pendientes: Dict[object, List[Tuple[int, asyncio.Future]]] = {}
+        # El bucle solo guarda referencias débiles a las tareas; sin esta, un drenado podría recolectarse
+        self._drenados: Set[asyncio.Task] = set()
+
+    @property
+    def coleccion(self):
+        return conexion.db.materiales
+
+    # Devuelve None si se aplicó o el motivo del rechazo; las devoluciones no se rechazan
+    async def ajustar(self, material, cantidad: int) -> Optional[str]:
+        futuro = asyncio.get_running_loop().create_future()
+        if material in self._pendientes:
+            self._pendientes[material].append((cantidad, futuro))
+        else:
+            self._pendientes[material] = [(cantidad, futuro)]
+            tarea = asyncio.create_task(self._drenar(material))
+            self._drenados.add(tarea)
+            tarea.add_done_callback(self._drenados.discard)
+        return await futuro
+
+    # Si el drenado se cancela (apagado), las esperas del lote en curso y de las pendientes se
+    # cancelan también y el material queda libre para que el siguiente ajuste inicie otro
+    async def _drenar(self, material):
+        lote: List[Tuple[int, asyncio.Future]] = []
+        try:
+            while self._pendientes[material]:
+                lote, self._pendientes[material] = self._pendientes[material], []
+                try:
+                    motivos = await self._aplicar(material, [cantidad for cantidad, _ in lote])
+                except Exception as e:
+                    for _, futuro in lote:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                else:
+                    for (_, futuro), motivo in zip(lote, motivos):
+                        if not futuro.done():
+                            futuro.set_result(motivo)
+        finally:
+            for _, futuro in lote + self._pendientes.pop(material, []):
+                if not futuro.done():
+                    futuro.cancel()
+
+    async def _incrementar(self, material_id: ObjectId, neto: int) -> bool:
+        filtro = {"_id": material_id}
+        if neto > 0:
+            filtro[CAMPO_EXISTENCIAS] = {"$gte": neto}
+        resultado = await self.coleccion.update_one(filtro, {"$inc": {CAMPO_EXISTENCIAS: -neto, CAMPO_VERSION: 1}})
+        if resultado.matched_count:
+            await cache.invalidar("materiales", material_id)
+        return resultado.matched_count > 0
+
+    async def _aplicar(self, material, cantidades: List[int]) -> List[Optional[str]]:
+        material_id = _id_material(material)
+        if material_id is not None and await self._incrementar(material_id, sum(cantidades)):
+            return [None] * len(cantidades)
+        devuelto = -sum(cantidad for cantidad in cantidades if cantidad < 0)
+        for _ in range(INTENTOS_RESERVA):
+            actual = None
+            if material_id is not None:
+                actual = await self.coleccion.find_one({"_id": material_id}, {CAMPO_EXISTENCIAS: 1})
+            if actual is None:
+                return [None if cantidad < 0 else f"El material {material} no existe" for cantidad in cantidades]
+            disponible = (actual.get(CAMPO_EXISTENCIAS) or 0) + devuelto
+            motivos, neto = [], -devuelto
+            for cantidad in cantidades:
+                if cantidad <= 0 or cantidad <= disponible:
+                    disponible -= max(cantidad, 0)
+                    neto += max(cantidad, 0)
+                    motivos.append(None)
+                else:
+                    motivos.append(f"Existencias insuficientes del material {material}: se piden {cantidad}, hay {disponible}")
+            # La condición $gte neto vuelve a fallar si otro proceso retiró existencias entre la
+            # lectura y la escritura; entonces se reparte de nuevo con el valor actualizado
+            if await self._incrementar(material_id, neto):
+                return motivos
+        if devuelto:
+            await self._incrementar(material_id, -devuelto)
+        return [None if cantidad <= 0 else f"El material {material} tiene demasiada demanda; reintente" for cantidad in cantidades]
+
+
+cola = ColaReservas()
+
+
+async def _devolver(retiros: List[Tuple[object, int]]):
+    await asyncio.gather(*(cola.ajustar(material, -cantidad) for material, cantidad in retiros))
+
+
+# Observador del repositorio de pedidos. Primero se retira lo que piden los cambios; los que no
+# alcanzan se rechazan y de los demás se devuelve lo que soltaron. Dentro de una transacción
+# las devoluciones esperan a la confirmación y los retiros se deshacen si se aborta, así que las
+# existencias nunca quedan por debajo de lo que retienen los pedidos confirmados.
+async def reservar_inventario(cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+    retiros: List[Tuple[object, object, int]] = []
+    devoluciones: Dict[object, List[Tuple[object, int]]] = defaultdict(list)
+    for antes, despues in cambios:
+        pedido_id = (despues if despues is not None else antes)["_id"]
+        for material, cantidad in ajustes(antes, despues).items():
+            if cantidad > 0:
+                retiros.append((pedido_id, material, cantidad))
+            else:
+                devoluciones[pedido_id].append((material, -cantidad))
+    motivos = await asyncio.gather(*(cola.ajustar(material, cantidad) for _, material, cantidad in retiros))
+    rechazos = {pedido_id: motivo for (pedido_id, _, _), motivo in zip(retiros, motivos) if motivo}
+    aplicados = [(material, cantidad) for (pedido_id, material, cantidad) in retiros if pedido_id not in rechazos]
+    if aplicados:
+        await conexion.al_abortar(lambda: _devolver(aplicados))
+    liberados = [devuelto for pedido_id, lista in devoluciones.items() if pedido_id not in rechazos for devuelto in lista]
+    if liberados:
+        await conexion.al_confirmar(lambda: _devolver(liberados))
+    if rechazos:
+        raise CambioRechazado(rechazos, None if len(rechazos) == 1 else f"{len(rechazos)} pedidos sin existencias suficientes")
@@ -0,0 +1,208 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Configuración de las métricas; con ARQUITECTURA_PETICION_LENTA_MS > 0 se registra cada
+# petición que tarde más, con la forma de sus consultas
+METRICAS_ACTIVAS = os.getenv("ARQUITECTURA_METRICAS", "1") != "0"
+PETICION_LENTA_MS = float(os.getenv("ARQUITECTURA_PETICION_LENTA_MS", "0"))
+FORMAS_MAX = int(os.getenv("ARQUITECTURA_METRICAS_FORMAS_MAX", "20"))
+
+registro = logging.getLogger("arquitectura.metricas")
+
+# Límites de los buckets de cada histograma
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_VIAJES = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BUCKETS_DOCUMENTOS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+# Lo que se acumula durante una petición; los escuchas de Motor lo encuentran por contextvar
+# (Motor copia el contexto al hilo donde corre cada operación)
+class Medicion:
+    __slots__ = ("bd", "viajes", "documentos", "serializacion", "formas")
+
+    def __init__(self):
+        self.bd = 0.0
+        self.viajes = 0
+        self.documentos = 0
+        self.serializacion = 0.0
+        self.formas: List[str] = []
+
+
+medicion_actual: ContextVar[Optional[Medicion]] = ContextVar("medicion_actual", default=None)
+
+
+# Histograma acumulado por serie de etiquetas (método, ruta), con el formato de Prometheus
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, limites: Sequence[float]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, etiquetas: Tuple[str, ...], valor: float):
+        serie = self.series.get(etiquetas)
+        if serie is None:
+            # Un contador por bucket más el de +Inf, la suma y la cuenta
+            serie = self.series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0, 0]
+        serie[0][bisect_left(self.limites, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def exponer(self, nombres: Sequence[str]) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for etiquetas, (buckets, suma, cuenta) in sorted(self.series.items()):
+            base = ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, etiquetas))
+            acumulado = 0
+            for limite, veces in zip(self.limites + (float("inf"),), buckets):
+                acumulado += veces
+                le = "+Inf" if limite == float("inf") else repr(limite)
+                lineas.append(f'{self.nombre}_bucket{{{base},le="{le}"}} {acumulado}')
+            lineas.append(f"{self.nombre}_sum{{{base}}} {suma!r}")
+            lineas.append(f"{self.nombre}_count{{{base}}} {cuenta}")
+        return lineas
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+ETIQUETAS = ("metodo", "ruta")
+histogramas = {
+    "total": Histograma("arquitectura_peticion_segundos", "Duración total de la petición", BUCKETS_SEGUNDOS),
+    "bd": Histograma("arquitectura_bd_segundos", "Tiempo en comandos de MongoDB por petición", BUCKETS_SEGUNDOS),
+    "viajes": Histograma("arquitectura_bd_viajes", "Comandos enviados a MongoDB por petición", BUCKETS_VIAJES),
+    "documentos": Histograma("arquitectura_bd_documentos", "Documentos devueltos por MongoDB por petición", BUCKETS_DOCUMENTOS),
+    "serializacion": Histograma("arquitectura_serializacion_segundos", "Tiempo de codificación JSON por petición", BUCKETS_SEGUNDOS),
+    "bytes": Histograma("arquitectura_respuesta_bytes", "Tamaño del cuerpo de la respuesta", BUCKETS_BYTES),
+}
+estados: Dict[Tuple[str, str, str], int] = {}
+
+
+# Forma de una consulta: los campos y operadores se conservan y los valores se cambian por "?"
+def forma(valor):
+    if isinstance(valor, dict):
+        return {llave: forma(contenido) for llave, contenido in valor.items()}
+    if isinstance(valor, list):
+        return [forma(valor[0])] if valor and isinstance(valor[0], (dict, list)) else "?"
+    return "?"
+
+
+def _forma_comando(comando: str, documento) -> str:
+    coleccion = documento.get(comando)
+    if "pipeline" in documento:
+        # De una agregación basta el filtro de $match y el nombre de las demás etapas
+        etapas = [forma(etapa) if "$match" in etapa else next(iter(etapa), "?") for etapa in documento["pipeline"]]
+        return f"{comando} {coleccion} {etapas}"
+    detalle = documento.get("filter", documento.get("query"))
+    if detalle is None and ("updates" in documento or "deletes" in documento):
+        operaciones = documento.get("updates") or documento.get("deletes") or [{}]
+        detalle = operaciones[0].get("q")
+    return f"{comando} {coleccion} {forma(detalle) if detalle is not None else ''}".rstrip()
+
+
+# Documentos de la respuesta de un comando: lotes de cursor o el "n" de las escrituras
+def _documentos(respuesta) -> int:
+    cursor = respuesta.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if "values" in respuesta:
+        return len(respuesta["values"])
+    return respuesta.get("n", 0) if isinstance(respuesta.get("n"), int) else 0
+
+
+# Escucha de comandos de pymongo que suma a la medición de la petición en curso
+class EscuchaComandos(monitoring.CommandListener):
+    def started(self, evento):
+        medicion = medicion_actual.get()
+        if medicion is not None and PETICION_LENTA_MS > 0 and len(medicion.formas) < FORMAS_MAX:
+            medicion.formas.append(_forma_comando(evento.command_name, evento.command))
+
+    def succeeded(self, evento):
+        medicion = medicion_actual.get()
+        if medicion is None:
+            return
+        medicion.bd += evento.duration_micros / 1e6
+        medicion.viajes += 1
+        medicion.documentos += _documentos(evento.reply)
+
+    def failed(self, evento):
+        medicion = medicion_actual.get()
+        if medicion is None:
+            return
+        medicion.bd += evento.duration_micros / 1e6
+        medicion.viajes += 1
+
+
+def registrar_serializacion(segundos: float):
+    medicion = medicion_actual.get()
+    if medicion is not None:
+        medicion.serializacion += segundos
+
+
+# Middleware ASGI: mide cada petición HTTP sin envolver la respuesta, así que también cubre
+# los flujos NDJSON. La ruta es la plantilla (/proyectos/{idProyecto}) para acotar las series.
+class MedirPeticiones:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICAS_ACTIVAS:
+            await self.app(scope, receive, send)
+            return
+        medicion = Medicion()
+        token = medicion_actual.set(medicion)
+        estado = ["500"]
+        enviados = [0]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = str(mensaje["status"])
+            elif mensaje["type"] == "http.response.body":
+                enviados[0] += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            total = time.perf_counter() - inicio
+            medicion_actual.reset(token)
+            ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+            self._registrar((scope["method"], ruta), estado[0], total, enviados[0], medicion)
+
+    @staticmethod
+    def _registrar(etiquetas: Tuple[str, str], estado: str, total: float, enviados: int, medicion: Medicion):
+        histogramas["total"].observar(etiquetas, total)
+        histogramas["bd"].observar(etiquetas, medicion.bd)
+        histogramas["viajes"].observar(etiquetas, medicion.viajes)
+        histogramas["documentos"].observar(etiquetas, medicion.documentos)
+        histogramas["serializacion"].observar(etiquetas, medicion.serializacion)
+        histogramas["bytes"].observar(etiquetas, enviados)
+        llave = etiquetas + (estado,)
+        estados[llave] = estados.get(llave, 0) + 1
+        if PETICION_LENTA_MS > 0 and total * 1000 >= PETICION_LENTA_MS:
+            registro.warning(
+                "Petición lenta %s %s -> %s: %.1f ms total, %.1f ms en MongoDB (%d comandos, %d documentos), "
+                "%.1f ms serializando, %d bytes; consultas: %s",
+                etiquetas[0], etiquetas[1], estado, total * 1000, medicion.bd * 1000, medicion.viajes,
+                medicion.documentos, medicion.serializacion * 1000, enviados, "; ".join(medicion.formas) or "ninguna",
+            )
+
+
+def exponer_metricas() -> str:
+    lineas = [
+        "# HELP arquitectura_peticiones_total Peticiones atendidas por ruta y código de estado",
+        "# TYPE arquitectura_peticiones_total counter",
+    ]
+    for (metodo, ruta, estado), veces in sorted(estados.items()):
+        lineas.append(f'arquitectura_peticiones_total{{metodo="{metodo}",ruta="{_escapar(ruta)}",estado="{estado}"}} {veces}')
+    for histograma in histogramas.values():
+        lineas.extend(histograma.exponer(ETIQUETAS))
+    return "\n".join(lineas) + "\n"
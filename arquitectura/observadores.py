@@ -0,0 +1,17 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+# Un observador recibe, por lote, los pares (antes, después) de cada documento escrito;
+# None en antes es una alta y None en después una baja
+Observador = Callable[[List[Tuple[Optional[dict], Optional[dict]]]], Awaitable[None]]
+
+
+# Un observador rechaza cambios (por ejemplo, un pedido sin existencias del material) con esta
+# excepción, tras aplicar su efecto a los demás y a ninguno de los rechazados; motivos va de
+# _id a la explicación de cada rechazo
+class CambioRechazado(HTTPException):
+    def __init__(self, motivos: Dict[Any, str], detalle: Optional[str] = None):
+        super().__init__(status_code=409, detail=detalle or next(iter(motivos.values())))
+        self.motivos = dict(motivos)
@@ -0,0 +1,140 @@
+import base64
+import os
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import bson
+from bson import ObjectId
+from bson.errors import InvalidBSON, InvalidId
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from indices import registrar_consulta
+from serializacion import a_json
+
+# Configuración de paginación
+TAMANO_PAGINA = int(os.getenv("ARQUITECTURA_TAMANO_PAGINA", "100"))
+TAMANO_PAGINA_MAX = int(os.getenv("ARQUITECTURA_TAMANO_PAGINA_MAX", "1000"))
+
+
+# Parámetros de consulta comunes a los listados
+class Paginacion:
+    def __init__(
+        self,
+        limite: int = Query(TAMANO_PAGINA, ge=1, le=TAMANO_PAGINA_MAX),
+        cursor: Optional[str] = None,
+        formato: str = Query("json", pattern="^(json|ndjson)$"),
+    ):
+        self.limite = limite
+        self.cursor = cursor
+        self.formato = formato
+
+    @property
+    def ndjson(self) -> bool:
+        return self.formato == "ndjson"
+
+
+# El cursor es el último _id entregado, codificado para que el cliente lo trate como opaco.
+# Si el listado se ordena por otro campo, el cursor lleva además su valor: {"v": valor, "i": _id} en BSON.
+def codificar_cursor(ultimo: dict, orden: Optional[str] = None) -> str:
+    crudo = ultimo["_id"].binary if orden is None else bson.encode({"v": ultimo.get(orden), "i": ultimo["_id"]})
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: Optional[str], orden: Optional[str] = None):
+    if not cursor:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        if orden is None:
+            return ObjectId(crudo)
+        posicion = bson.decode(crudo)
+        return posicion["v"], ObjectId(posicion["i"])
+    except (ValueError, TypeError, KeyError, InvalidId, InvalidBSON):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def _filtro_desde(filtro: dict, desde, orden: Optional[str] = None) -> dict:
+    if desde is None:
+        return filtro
+    if orden is None:
+        return {**filtro, "_id": {"$gt": desde}}
+    valor, ultimo_id = desde
+    siguientes = {"$or": [{orden: {"$gt": valor}}, {orden: valor, "_id": {"$gt": ultimo_id}}]}
+    return {"$and": [filtro, siguientes]} if filtro else siguientes
+
+
+def _orden(orden: Optional[str]) -> List[Tuple[str, int]]:
+    return [("_id", 1)] if orden is None else [(orden, 1), ("_id", 1)]
+
+
+# Con una proyección de inclusión el campo de orden tiene que viajar para armar el cursor
+def _proyeccion_con(proyeccion: Optional[dict], orden: Optional[str]) -> Optional[dict]:
+    if not proyeccion or orden is None:
+        return proyeccion
+    if any(proyeccion.values()):
+        return {**proyeccion, orden: 1}
+    return {campo: valor for campo, valor in proyeccion.items() if campo != orden}
+
+
+# Paginación por llave sobre _id, o sobre (orden, _id) para que un filtro de rango en ese campo
+# recorra solo su tramo del índice. Se pide un documento extra para saber si hay página siguiente.
+async def paginar(
+    coleccion, filtro: dict, paginacion: Paginacion, proyeccion: Optional[dict] = None, orden: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    desde = decodificar_cursor(paginacion.cursor, orden)
+    registrar_consulta(coleccion.name, filtro)
+    limite = paginacion.limite
+    documentos = await (
+        coleccion.find(_filtro_desde(filtro, desde, orden), _proyeccion_con(proyeccion, orden))
+        .sort(_orden(orden))
+        .limit(limite + 1)
+        .to_list(length=limite + 1)
+    )
+    siguiente = None
+    if len(documentos) > limite:
+        documentos = documentos[:limite]
+        siguiente = codificar_cursor(documentos[-1], orden)
+    return documentos, siguiente
+
+
+# Escribe cada documento en el socket mientras se recorre el cursor de Motor
+def flujo_ndjson(documentos, convertir: Optional[Callable[[dict], dict]] = None) -> StreamingResponse:
+    async def generar():
+        async for documento in documentos:
+            if convertir:
+                documento = convertir(documento)
+            yield a_json(documento) + b"\n"
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+
+# Con etapas (por ejemplo un $lookup) el recorrido pasa a ser una agregación con el mismo filtro
+# y orden; preparar() ajusta cada documento antes de escribirlo
+def respuesta_ndjson(
+    coleccion,
+    filtro: dict,
+    paginacion: Paginacion,
+    campo_id: str,
+    proyeccion: Optional[dict] = None,
+    orden: Optional[str] = None,
+    etapas: Sequence[dict] = (),
+    preparar: Optional[Callable[[dict], None]] = None,
+) -> StreamingResponse:
+    desde = decodificar_cursor(paginacion.cursor, orden)
+    registrar_consulta(coleccion.name, filtro)
+    filtro = _filtro_desde(filtro, desde, orden)
+    if etapas:
+        pipeline = [{"$match": filtro}, {"$sort": dict(_orden(orden))}]
+        if proyeccion:
+            pipeline.append({"$project": proyeccion})
+        documentos = coleccion.aggregate([*pipeline, *etapas], batchSize=paginacion.limite)
+    else:
+        documentos = coleccion.find(filtro, proyeccion).sort(_orden(orden)).batch_size(paginacion.limite)
+
+    def convertir(documento: dict) -> dict:
+        if preparar:
+            preparar(documento)
+        documento[campo_id] = str(documento.pop("_id"))
+        return documento
+
+    return flujo_ndjson(documentos, convertir)
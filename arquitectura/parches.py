@@ -0,0 +1,136 @@
+import typing
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Tuple, Type
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+
+# Cuerpo de un PATCH:
+#   {"estado": "terminado",                                     -> $set de campos sueltos
+#    "$push": {"materiales": [{...}, ...]},                     -> $push con $each
+#    "$pull": {"planos": {"nombre": "Fachada"}},                -> $pull por criterio
+#    "$pull": {"proyectos": ["65f...", "65e..."]},               -> $pull de valores ($in) en listas de ids
+#    "$editar": {"materiales": [{"donde": {"nombre": "Cemento"},
+#                                "cambios": {"cantidad": 40}}]}} -> $set posicional con arrayFilters
+OPERACIONES = ("$push", "$pull", "$editar")
+
+
+# Modelo con los mismos tipos pero sin campos obligatorios; los valores por defecto no se
+# validan, así que un null explícito sigue siendo rechazado si el tipo no lo admite. Un campo
+# Annotated (como IdReferencia) guarda sus validadores en metadata, fuera de annotation.
+@lru_cache(maxsize=None)
+def modelo_parcial(modelo: Type[BaseModel]) -> Type[BaseModel]:
+    campos = {
+        nombre: (Annotated[(campo.annotation, *campo.metadata)] if campo.metadata else campo.annotation, None)
+        for nombre, campo in modelo.model_fields.items()
+    }
+    return create_model(f"{modelo.__name__}Parcial", **campos)
+
+
+@lru_cache(maxsize=None)
+def _adaptador(anotacion) -> TypeAdapter:
+    return TypeAdapter(anotacion)
+
+
+def _es_modelo(anotacion) -> bool:
+    return isinstance(anotacion, type) and issubclass(anotacion, BaseModel)
+
+
+# Tipo de los elementos de una lista del modelo: un submodelo o un valor simple (como un id)
+def _tipo_elemento(modelo: Type[BaseModel], campo: str, por_elemento: bool = False):
+    informacion = modelo.model_fields.get(campo)
+    argumentos = typing.get_args(informacion.annotation) if informacion else ()
+    if typing.get_origin(informacion.annotation if informacion else None) is not list or not argumentos:
+        raise HTTPException(status_code=400, detail=f"'{campo}' no es una lista de {modelo.__name__}")
+    elemento = argumentos[0]
+    if por_elemento and not _es_modelo(elemento):
+        raise HTTPException(status_code=400, detail=f"'{campo}' no admite ediciones por elemento")
+    return elemento
+
+
+def _validar_valor(anotacion, datos: Any):
+    try:
+        return _adaptador(anotacion).validate_python(datos)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+def _validar(modelo: Type[BaseModel], datos: Any, parcial: bool = False) -> dict:
+    if not _es_modelo(modelo):
+        return _validar_valor(modelo, datos)
+    if not isinstance(datos, dict):
+        raise HTTPException(status_code=400, detail=f"Se esperaba un objeto para {modelo.__name__}")
+    try:
+        if parcial:
+            return modelo_parcial(modelo)(**datos).dict(exclude_unset=True)
+        return modelo(**datos).dict()
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+# Cada operación del PATCH es un objeto {campo: valores}; otra forma es un error del cliente
+def _operacion(cuerpo: Dict[str, Any], nombre: str) -> dict:
+    valor = cuerpo.get(nombre, {})
+    if not isinstance(valor, dict):
+        raise HTTPException(status_code=400, detail=f"'{nombre}' debe ser un objeto {{campo: valores}}")
+    return valor
+
+
+# Traduce el cuerpo de un PATCH a (actualización de MongoDB, array_filters)
+def construir_parche(modelo: Type[BaseModel], cuerpo: Dict[str, Any]) -> Tuple[dict, List[dict]]:
+    if not isinstance(cuerpo, dict):
+        raise HTTPException(status_code=400, detail="El cuerpo debe ser un objeto JSON")
+    desconocidos = [campo for campo in cuerpo if campo not in modelo.model_fields and campo not in OPERACIONES]
+    if desconocidos:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(desconocidos)}")
+
+    asignaciones = _validar(modelo, {campo: valor for campo, valor in cuerpo.items() if campo not in OPERACIONES}, parcial=True)
+    agregados: Dict[str, dict] = {}
+    quitados: Dict[str, dict] = {}
+    filtros: List[dict] = []
+    tocados = {campo: "campo" for campo in asignaciones}
+
+    def tocar(campo: str, operacion: str):
+        if tocados.setdefault(campo, operacion) != operacion:
+            raise HTTPException(status_code=400, detail=f"'{campo}' aparece en más de una operación")
+
+    for campo, elementos in _operacion(cuerpo, "$push").items():
+        elemento = _tipo_elemento(modelo, campo)
+        if not isinstance(elementos, list):
+            elementos = [elementos]
+        tocar(campo, "$push")
+        agregados[campo] = {"$each": [_validar(elemento, valor) for valor in elementos]}
+
+    for campo, criterio in _operacion(cuerpo, "$pull").items():
+        elemento = _tipo_elemento(modelo, campo)
+        tocar(campo, "$pull")
+        if _es_modelo(elemento):
+            quitados[campo] = _validar(elemento, criterio, parcial=True)
+        else:
+            valores = criterio if isinstance(criterio, list) else [criterio]
+            quitados[campo] = {"$in": [_validar_valor(elemento, valor) for valor in valores]}
+
+    for campo, ediciones in _operacion(cuerpo, "$editar").items():
+        elemento = _tipo_elemento(modelo, campo, por_elemento=True)
+        tocar(campo, "$editar")
+        for edicion in ediciones if isinstance(ediciones, list) else [ediciones]:
+            if not isinstance(edicion, dict) or not edicion.get("donde") or not edicion.get("cambios"):
+                raise HTTPException(status_code=400, detail=f"Cada edición de '{campo}' necesita 'donde' y 'cambios'")
+            identificador = f"e{len(filtros)}"
+            donde = _validar(elemento, edicion["donde"], parcial=True)
+            cambios = _validar(elemento, edicion["cambios"], parcial=True)
+            filtros.append({f"{identificador}.{llave}": valor for llave, valor in donde.items()})
+            for llave, valor in cambios.items():
+                asignaciones[f"{campo}.$[{identificador}].{llave}"] = valor
+
+    actualizacion = {}
+    if asignaciones:
+        actualizacion["$set"] = asignaciones
+    if agregados:
+        actualizacion["$push"] = agregados
+    if quitados:
+        actualizacion["$pull"] = quitados
+    if not actualizacion:
+        raise HTTPException(status_code=400, detail="El parche no contiene cambios")
+    return actualizacion, filtros
@@ -1,66 +1,66 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
+from typing import List, Optional
 
-app = FastAPI()
+from fastapi import Depends, Query
+from pydantic import BaseModel
 
-# Conexión a MongoDB
-client = AsyncIOMotorClient("mongodb://localhost:27017")
-db = client.arquitectura
+from crud import Repositorio, crear_router, object_id, responder_listado, responder_por_ids
+from eventos import registrar_eventos
+from fechas import Fecha, rango_fechas
+from inventario import reservar_inventario
+from paginacion import Paginacion
+from proyeccion import Proyeccion, proyeccion_de
+from referencias import CAMPOS_MATERIAL, CAMPOS_PROVEEDOR, CAMPOS_PROYECTO, IdReferencia, Referencia, expansion_de
+from resumenes import actualizar_resumenes
 
 # Modelos de datos
 class Pedido(BaseModel):
-    proyecto_id: str
-    proveedor_id: str
-    material_id: str
+    proyecto_id: IdReferencia
+    proveedor_id: IdReferencia
+    material_id: IdReferencia
     cantidad: int
-    fecha_pedido: str
+    fecha_pedido: Fecha
     estatus: str
 
-class PedidoOut(Pedido):
-    idPedido: str
-
-# Operaciones expuestas
-@app.post("/pedidos/", response_model=PedidoOut)
-async def agregar_pedido(pedido: Pedido):
-    nuevo_pedido = await db.pedidos.insert_one(pedido.dict())
-    pedido_guardado = await db.pedidos.find_one({"_id": nuevo_pedido.inserted_id})
-    return {**pedido_guardado, "idPedido": str(pedido_guardado["_id"])}
-
-@app.put("/pedidos/{idPedido}", response_model=PedidoOut)
-async def actualizar_pedido(idPedido: str, pedido: Pedido):
-    pedido_obj_id = ObjectId(idPedido)
-    result = await db.pedidos.update_one({"_id": pedido_obj_id}, {"$set": pedido.dict()})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Pedido no encontrado")
-    pedido_actualizado = await db.pedidos.find_one({"_id": pedido_obj_id})
-    return {**pedido_actualizado, "idPedido": str(pedido_actualizado["_id"])}
-
-@app.delete("/pedidos/{idPedido}", response_model=dict)
-async def eliminar_pedido(idPedido: str):
-    pedido_obj_id = ObjectId(idPedido)
-    result = await db.pedidos.delete_one({"_id": pedido_obj_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Pedido no encontrado")
-    return {"estatus": "Éxito", "mensaje": "Pedido eliminado correctamente"}
-
-@app.get("/pedidos/{idPedido}", response_model=PedidoOut)
-async def consultar_pedido_por_id(idPedido: str):
-    pedido_obj_id = ObjectId(idPedido)
-    pedido = await db.pedidos.find_one({"_id": pedido_obj_id})
-    if not pedido:
-        raise HTTPException(status_code=404, detail="Pedido no encontrado")
-    return {**pedido, "idPedido": str(pedido["_id"])}
+# Operaciones expuestas. Las existencias se ajustan antes que los resúmenes, para que estos
+# no cuenten un pedido rechazado por falta de material.
+repositorio = Repositorio(
+    "pedidos",
+    "idPedido",
+    cacheable=False,
+    observadores=[reservar_inventario, actualizar_resumenes, registrar_eventos("pedidos")],
+    transaccional=True,
+)
 
-@app.get("/pedidos/proyecto/{idProyecto}", response_model=List[PedidoOut])
-async def consultar_pedidos_por_proyecto(idProyecto: str):
-    pedidos = await db.pedidos.find({"proyecto_id": idProyecto}).to_list(100)
-    return [{**pedido, "idPedido": str(pedido["_id"])} for pedido in pedidos]
+# expand=proyecto_id,proveedor_id,material_id: una consulta $in por colección para toda la
+# página (un $lookup por referencia en los flujos NDJSON), en lugar de una lectura por pedido
+REFERENCIAS_PEDIDO = [
+    Referencia("proyecto_id", "proyectos", "idProyecto", CAMPOS_PROYECTO),
+    Referencia("proveedor_id", "proveedores", "idProveedor", CAMPOS_PROVEEDOR),
+    Referencia("material_id", "materiales", "idMaterial", CAMPOS_MATERIAL),
+]
 
-@app.get("/pedidos/proveedor/{idProveedor}", response_model=List[PedidoOut])
-async def consultar_pedidos_por_proveedor(idProveedor: str):
-    pedidos = await db.pedidos.find({"proveedor_id": idProveedor}).to_list(100)
-    return [{**pedido, "idPedido": str(pedido["_id"])} for pedido in pedidos]
+# Pedidos con fecha_pedido en [desde, hasta), paginados sobre el índice (fecha_pedido, _id);
+# con ?ids= devuelve esos pedidos, como GET /{coleccion}?ids= en las demás entidades
+async def consultar_pedidos(
+    desde: Optional[Fecha] = None,
+    hasta: Optional[Fecha] = None,
+    ids: Optional[str] = Query(None, description="Ids separados por comas"),
+    paginacion: Paginacion = Depends(),
+    proyeccion: Optional[Proyeccion] = Depends(proyeccion_de(Pedido)),
+    expansiones: List[Referencia] = Depends(expansion_de(REFERENCIAS_PEDIDO)),
+):
+    if ids is not None:
+        return await responder_por_ids(repositorio, ids.split(","), proyeccion, expansiones)
+    filtro = rango_fechas("fecha_pedido", desde, hasta)
+    return await responder_listado(repositorio, filtro, paginacion, proyeccion, orden="fecha_pedido", expansiones=expansiones)
 
+router = crear_router(
+    Pedido,
+    repositorio,
+    "Pedido",
+    "pedido",
+    listados=[("proyecto", "idProyecto", "proyecto_id", object_id), ("proveedor", "idProveedor", "proveedor_id", object_id)],
+    masivo=True,
+    consultas=[("", consultar_pedidos)],
+    referencias=REFERENCIAS_PEDIDO,
+)
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# Perfilado de peticiones sueltas, apagado por omisión. Con ARQUITECTURA_PERFILADO=1 una petición
+# con la cabecera X-Perfilar o el parámetro ?perfilar= se muestrea; si hay ARQUITECTURA_PERFILADO_CLAVE,
+# el valor debe coincidir con ella.
+PERFILADO_ACTIVO = os.getenv("ARQUITECTURA_PERFILADO", "0") == "1"
+PERFILADO_CLAVE = os.getenv("ARQUITECTURA_PERFILADO_CLAVE", "")
+INTERVALO_MS = float(os.getenv("ARQUITECTURA_PERFILADO_INTERVALO_MS", "1"))
+PERFILES_MAX = int(os.getenv("ARQUITECTURA_PERFILADO_MAXIMO", "20"))
+# Si se define, cada perfil también se guarda ahí como .speedscope.json, para verlo desde cualquier worker
+DIRECTORIO_PERFILES = os.getenv("ARQUITECTURA_PERFILADO_DIRECTORIO", "")
+
+CABECERA = b"x-perfilar"
+PARAMETRO = "perfilar"
+FORMATOS = ("collapsed", "speedscope")
+
+# Una pila es una tupla de marcos (función, archivo, línea) de la raíz a la hoja
+Pila = Tuple[Tuple[str, str, int], ...]
+
+
+# Muestreador en un hilo aparte: cada INTERVALO_MS copia la pila del hilo del bucle de eventos.
+# No se instrumenta ninguna llamada, así que el costo no depende de cuántas funciones corran;
+# el tiempo esperando a MongoDB aparece como muestras en el selector del bucle.
+class Muestreador:
+    def __init__(self, hilo_id: int, intervalo: float):
+        self.hilo_id = hilo_id
+        self.intervalo = intervalo
+        self.muestras: List[Tuple[Pila, float]] = []
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="perfilado", daemon=True)
+
+    def _muestrear(self):
+        anterior = time.perf_counter()
+        while not self._detener.wait(self.intervalo):
+            marco = sys._current_frames().get(self.hilo_id)
+            ahora = time.perf_counter()
+            pila = []
+            while marco is not None:
+                codigo = marco.f_code
+                pila.append((codigo.co_name, codigo.co_filename, marco.f_lineno))
+                marco = marco.f_back
+            if pila:
+                self.muestras.append((tuple(reversed(pila)), (ahora - anterior) * 1000))
+            anterior = ahora
+
+    # El hilo del bucle solo cede el GIL cada sys.getswitchinterval() (5 ms por omisión); mientras
+    # dura el perfil se baja al intervalo de muestreo para que las muestras lleguen a tiempo
+    def iniciar(self):
+        self._cambio = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._cambio, self.intervalo / 2))
+        self._hilo.start()
+
+    # El hilo puede estar a mitad de una muestra; se espera fuera del bucle para no bloquearlo
+    async def detener(self):
+        self._detener.set()
+        await asyncio.to_thread(self._hilo.join)
+        sys.setswitchinterval(self._cambio)
+
+
+def _etiqueta(marco: Tuple[str, str, int]) -> str:
+    funcion, archivo, linea = marco
+    return f"{funcion} ({os.path.basename(archivo)}:{linea})"
+
+
+class Perfil:
+    def __init__(self, perfil_id: str, metodo: str, ruta: str, url: str, muestras: List[Tuple[Pila, float]], duracion_ms: float):
+        self.id = perfil_id
+        self.fecha = datetime.now(timezone.utc)
+        self.metodo = metodo
+        self.ruta = ruta
+        self.url = url
+        self.muestras = muestras
+        self.duracion_ms = duracion_ms
+        self.estado: Optional[int] = None
+
+    def resumen(self) -> dict:
+        return {
+            "id": self.id,
+            "fecha": self.fecha.isoformat(),
+            "metodo": self.metodo,
+            "ruta": self.ruta,
+            "url": self.url,
+            "estado": self.estado,
+            "duracion_ms": round(self.duracion_ms, 3),
+            "muestras": len(self.muestras),
+        }
+
+    # Formato de pilas colapsadas (flamegraph.pl, inferno, speedscope): "raíz;...;hoja milisegundos"
+    def colapsado(self) -> str:
+        pesos: Counter = Counter()
+        for pila, peso in self.muestras:
+            pesos[";".join(_etiqueta(marco) for marco in pila)] += peso
+        return "".join(f"{pila} {round(peso)}\n" for pila, peso in pesos.most_common())
+
+    # https://www.speedscope.app/file-format-schema.json, perfil muestreado en milisegundos
+    def speedscope(self) -> dict:
+        indices: Dict[Tuple[str, str, int], int] = {}
+        marcos, muestras, pesos = [], [], []
+        for pila, peso in self.muestras:
+            fila = []
+            for marco in pila:
+                if marco not in indices:
+                    indices[marco] = len(marcos)
+                    marcos.append({"name": marco[0], "file": marco[1], "line": marco[2]})
+                fila.append(indices[marco])
+            muestras.append(fila)
+            pesos.append(round(peso, 3))
+        nombre = f"{self.metodo} {self.url}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": nombre,
+            "exporter": "arquitectura",
+            "activeProfileIndex": 0,
+            "shared": {"frames": marcos},
+            "profiles": [{
+                "type": "sampled",
+                "name": nombre,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(pesos), 3),
+                "samples": muestras,
+                "weights": pesos,
+            }],
+        }
+
+
+perfiles: Deque[Perfil] = deque(maxlen=PERFILES_MAX)
+
+
+def perfiles_recientes() -> List[dict]:
+    return [perfil.resumen() for perfil in reversed(perfiles)]
+
+
+def buscar_perfil(perfil_id: str) -> Optional[Perfil]:
+    return next((perfil for perfil in perfiles if perfil.id == perfil_id), None)
+
+
+def _solicitado(scope) -> bool:
+    valor = None
+    for nombre, contenido in scope["headers"]:
+        if nombre == CABECERA:
+            valor = contenido.decode("latin-1")
+    consulta = scope.get("query_string", b"")
+    if valor is None and PARAMETRO.encode() in consulta:
+        valor = parse_qs(consulta.decode("latin-1")).get(PARAMETRO, [None])[0]
+    if valor is None:
+        return False
+    return valor == PERFILADO_CLAVE if PERFILADO_CLAVE else valor not in ("", "0")
+
+
+def _escribir(perfil: Perfil):
+    directorio = Path(DIRECTORIO_PERFILES)
+    directorio.mkdir(parents=True, exist_ok=True)
+    (directorio / f"{perfil.fecha:%Y%m%d-%H%M%S}-{perfil.id}.speedscope.json").write_text(
+        json.dumps(perfil.speedscope()), encoding="utf-8"
+    )
+
+
+# La conversión y la escritura del archivo corren en un hilo, fuera del bucle de eventos
+async def _guardar(perfil: Perfil):
+    perfiles.append(perfil)
+    if DIRECTORIO_PERFILES:
+        await asyncio.to_thread(_escribir, perfil)
+
+
+# Middleware ASGI: muestrea la petición marcada y devuelve el id del perfil en la cabecera
+# X-Perfil. Se perfila una petición a la vez; mientras tanto las demás marcadas pasan sin perfilar.
+# Con carga concurrente en el mismo worker, las muestras incluyen lo que el bucle ejecute en paralelo.
+class PerfilarPeticiones:
+    def __init__(self, app):
+        self.app = app
+        self._ocupado = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _solicitado(scope) or not self._ocupado.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._perfilar(scope, receive, send)
+        finally:
+            self._ocupado.release()
+
+    async def _perfilar(self, scope, receive, send):
+        muestreador = Muestreador(threading.get_ident(), INTERVALO_MS / 1000)
+        perfil_id = uuid.uuid4().hex[:12]
+        estado = [None]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+                mensaje = {**mensaje, "headers": list(mensaje.get("headers", [])) + [(b"x-perfil", perfil_id.encode())]}
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        muestreador.iniciar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            await muestreador.detener()
+            url = scope["path"] + ("?" + scope["query_string"].decode("latin-1") if scope.get("query_string") else "")
+            ruta = getattr(scope.get("route"), "path", None) or scope["path"]
+            perfil = Perfil(perfil_id, scope["method"], ruta, url, muestreador.muestras, (time.perf_counter() - inicio) * 1000)
+            perfil.estado = estado[0]
+            await _guardar(perfil)
@@ -0,0 +1,108 @@
+import typing
+from typing import Dict, List, Optional, Type
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+
+def _separar(valor: Optional[str]) -> List[str]:
+    return [campo.strip() for campo in (valor or "").split(",") if campo.strip()]
+
+
+def _submodelo(anotacion) -> Optional[Type[BaseModel]]:
+    if typing.get_origin(anotacion) is list and typing.get_args(anotacion):
+        anotacion = typing.get_args(anotacion)[0]
+    if isinstance(anotacion, type) and issubclass(anotacion, BaseModel):
+        return anotacion
+    return None
+
+
+# Las rutas con punto (materiales.nombre) se validan contra los modelos embebidos
+def _validar_ruta(modelo: Type[BaseModel], ruta: str):
+    actual = modelo
+    for parte in ruta.split("."):
+        if actual is None or parte not in actual.model_fields:
+            raise HTTPException(status_code=400, detail=f"Campo desconocido: {ruta}")
+        actual = _submodelo(actual.model_fields[parte].annotation)
+
+
+# Árbol de rutas; None marca un campo completo, así "materiales" absorbe a "materiales.nombre"
+def _arbol(rutas: List[str]) -> Dict[str, Optional[dict]]:
+    arbol: Dict[str, Optional[dict]] = {}
+    for ruta in rutas:
+        nodo = arbol
+        *padres, hoja = ruta.split(".")
+        for parte in padres:
+            if parte in nodo and nodo[parte] is None:
+                break
+            nodo = nodo.setdefault(parte, {})
+        else:
+            nodo[hoja] = None
+    return arbol
+
+
+def _rutas(arbol: dict, prefijo: str = "") -> List[str]:
+    rutas = []
+    for campo, hijos in arbol.items():
+        ruta = f"{prefijo}{campo}"
+        rutas.extend([ruta] if hijos is None else _rutas(hijos, f"{ruta}."))
+    return rutas
+
+
+def _incluir(valor, arbol: dict):
+    if isinstance(valor, list):
+        return [_incluir(elemento, arbol) for elemento in valor]
+    if not isinstance(valor, dict):
+        return valor
+    return {campo: valor[campo] if hijos is None else _incluir(valor[campo], hijos) for campo, hijos in arbol.items() if campo in valor}
+
+
+def _excluir(valor, arbol: dict):
+    if isinstance(valor, list):
+        return [_excluir(elemento, arbol) for elemento in valor]
+    if not isinstance(valor, dict):
+        return valor
+    resultado = dict(valor)
+    for campo, hijos in arbol.items():
+        if campo in resultado:
+            if hijos is None:
+                del resultado[campo]
+            else:
+                resultado[campo] = _excluir(resultado[campo], hijos)
+    return resultado
+
+
+# Conjunto de campos pedido por el cliente (fields= o exclude=)
+class Proyeccion:
+    def __init__(self, incluir: List[str], excluir: List[str]):
+        self.incluir = _arbol(incluir)
+        self.excluir = _arbol(excluir)
+
+    # Proyección para MongoDB; _id siempre viaja porque de él salen el id y el cursor
+    def mongo(self) -> dict:
+        if self.incluir:
+            return {"_id": 1, **{ruta: 1 for ruta in _rutas(self.incluir)}}
+        return {ruta: 0 for ruta in _rutas(self.excluir)}
+
+    # Recorte en Python para documentos que no vienen de MongoDB (por ejemplo, del caché)
+    def aplicar(self, documento: dict) -> dict:
+        if self.incluir:
+            return _incluir(documento, {"_id": None, **self.incluir})
+        return _excluir(documento, self.excluir)
+
+
+def proyeccion_de(modelo: Type[BaseModel]):
+    def dependencia(
+        fields: Optional[str] = Query(None, description="Campos a devolver, separados por comas"),
+        exclude: Optional[str] = Query(None, description="Campos a omitir, separados por comas"),
+    ) -> Optional[Proyeccion]:
+        incluir, excluir = _separar(fields), _separar(exclude)
+        if incluir and excluir:
+            raise HTTPException(status_code=400, detail="Use fields o exclude, no ambos")
+        if not incluir and not excluir:
+            return None
+        for ruta in incluir + excluir:
+            _validar_ruta(modelo, ruta)
+        return Proyeccion(incluir, excluir)
+
+    return dependencia
@@ -0,0 +1,278 @@
+# Referencias entre colecciones guardadas como ObjectId y su expansión en las lecturas.
+# Migración de las copias embebidas de proyectos en clientes y trabajadores, y de los ids en
+# texto de pedidos, desde arquitectura/:
+#   python -m referencias                 # todas las colecciones
+#   python -m referencias clientes --lote 500
+#   python -m referencias pedidos         # después reconstruye los resúmenes de pedidos
+import argparse
+import asyncio
+from typing import Annotated, Dict, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, Query
+from pydantic import PlainSerializer, PlainValidator, WithJsonSchema
+from pymongo import UpdateOne
+
+import conexion
+from cache import cache
+from fechas import TAMANO_LOTE, a_fecha
+from versiones import INCREMENTO
+
+
+def _a_object_id(valor) -> ObjectId:
+    if isinstance(valor, ObjectId):
+        return valor
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor)
+    raise ValueError("Identificador inválido")
+
+
+# En la API es el id en texto; en MongoDB un ObjectId, para que $in y $lookup usen el índice de _id
+IdReferencia = Annotated[
+    ObjectId,
+    PlainValidator(_a_object_id),
+    PlainSerializer(str, when_used="json"),
+    WithJsonSchema({"type": "string"}),
+]
+
+
+# Un campo (un id o una lista de ids) que apunta a otra colección; al expandirlo se sustituye
+# por los documentos referidos, recortados a `campos` y en el orden de las referencias
+class Referencia:
+    def __init__(self, campo: str, coleccion: str, campo_id: str, campos: Sequence[str]):
+        self.campo = campo
+        self.coleccion = coleccion
+        self.campo_id = campo_id
+        self.proyeccion = {nombre: 1 for nombre in campos}
+
+    def _a_respuesta(self, documento: dict) -> dict:
+        documento = dict(documento)
+        documento[self.campo_id] = str(documento.pop("_id"))
+        return documento
+
+    # Una referencia sin documento queda solo con su id, para no perderla en la respuesta; lo que
+    # no es ObjectId (copias aún sin migrar) se deja igual
+    def _resolver(self, valor, encontrados: Dict[ObjectId, dict]):
+        if isinstance(valor, list):
+            return [self._resolver(elemento, encontrados) for elemento in valor]
+        if isinstance(valor, ObjectId):
+            return self._a_respuesta(encontrados.get(valor, {"_id": valor}))
+        return valor
+
+    def _ids(self, documentos: List[dict]) -> List[ObjectId]:
+        ids = set()
+        for documento in documentos:
+            valor = documento.get(self.campo)
+            ids.update(elemento for elemento in (valor if isinstance(valor, list) else [valor]) if isinstance(elemento, ObjectId))
+        return list(ids)
+
+    # Una sola consulta $in para todas las referencias de la página, en lugar de una por documento
+    async def expandir(self, documentos: List[dict]):
+        ids = self._ids(documentos)
+        if not ids:
+            return
+        cursor = conexion.db[self.coleccion].find({"_id": {"$in": ids}}, self.proyeccion)
+        encontrados = {documento["_id"]: documento async for documento in cursor}
+        for documento in documentos:
+            if self.campo in documento:
+                documento[self.campo] = self._resolver(documento[self.campo], encontrados)
+
+    # Para flujos NDJSON la unión la hace el servidor con $lookup (MongoDB 5.0+ por localField
+    # junto con pipeline); ordenar() devuelve el resultado al orden de las referencias
+    def etapas(self) -> List[dict]:
+        return [{"$lookup": {
+            "from": self.coleccion,
+            "localField": self.campo,
+            "foreignField": "_id",
+            "pipeline": [{"$project": self.proyeccion}],
+            "as": f"_{self.campo}",
+        }}]
+
+    def ordenar(self, documento: dict):
+        encontrados = {referido["_id"]: referido for referido in documento.pop(f"_{self.campo}", [])}
+        if self.campo in documento:
+            documento[self.campo] = self._resolver(documento[self.campo], encontrados)
+
+
+def expansion_de(referencias: Sequence[Referencia]):
+    por_campo = {referencia.campo: referencia for referencia in referencias}
+
+    def dependencia(
+        expand: Optional[str] = Query(
+            None,
+            description=f"Referencias a expandir, separadas por comas: {', '.join(por_campo)}",
+            include_in_schema=bool(por_campo),
+        ),
+    ) -> List[Referencia]:
+        campos = [campo.strip() for campo in (expand or "").split(",") if campo.strip()]
+        desconocidos = [campo for campo in campos if campo not in por_campo]
+        if desconocidos:
+            raise HTTPException(status_code=400, detail=f"No se puede expandir: {', '.join(desconocidos)}")
+        return [por_campo[campo] for campo in dict.fromkeys(campos)]
+
+    return dependencia
+
+
+# Observador del repositorio referido: al borrar un documento se retira su id de quienes lo
+# referencian, con un update_many por colección
+def quitar_referencias(referentes: Sequence[Tuple[str, str]]):
+    async def observador(cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+        borrados = [antes["_id"] for antes, despues in cambios if antes is not None and despues is None]
+        if not borrados:
+            return
+        for coleccion, campo in referentes:
+            filtro = {campo: {"$in": borrados}}
+            afectados = await conexion.db[coleccion].distinct("_id", filtro)
+            if afectados:
+                await conexion.db[coleccion].update_many({"_id": {"$in": afectados}}, {"$pull": {campo: {"$in": borrados}}, **INCREMENTO})
+                for documento_id in afectados:
+                    await cache.invalidar(coleccion, documento_id)
+
+    return observador
+
+
+# Colecciones que referencian proyectos -> campo con los ids (antes, copias embebidas)
+REFERENCIAS_PROYECTOS = {"clientes": "proyectos", "trabajadores": "proyectos_asignados"}
+CAMPOS_PROYECTO = ("nombre", "descripcion", "fecha_inicio", "fecha_fin", "estado", "responsable")
+# Campos de proveedores y materiales que trae la expansión de un pedido
+CAMPOS_PROVEEDOR = ("nombre", "direccion", "telefono", "email")
+CAMPOS_MATERIAL = ("nombre", "descripcion", "unidad_medida", "precio_unitario", "cantidad_disponible")
+# Colecciones que guardaban ids de otras colecciones como texto -> campos que pasan a ObjectId
+REFERENCIAS_TEXTO = {"pedidos": ("proyecto_id", "proveedor_id", "material_id")}
+
+
+# Una copia se enlaza al proyecto con el mismo nombre (y, si hay varios, la misma fecha de
+# inicio); si no existe se crea a partir de la copia, sin materiales, herramientas ni planos
+async def _id_proyecto(db, copia: dict, por_nombre: Dict[str, List[dict]], creados: List[ObjectId]) -> ObjectId:
+    candidatos = por_nombre.setdefault(copia.get("nombre"), [])
+    inicio = a_fecha(copia.get("fecha_inicio"))
+    for candidato in candidatos:
+        if candidato.get("fecha_inicio") == inicio:
+            return candidato["_id"]
+    if candidatos:
+        return candidatos[0]["_id"]
+    proyecto = {campo: copia.get(campo) for campo in CAMPOS_PROYECTO}
+    proyecto.update(fecha_inicio=inicio, fecha_fin=a_fecha(proyecto["fecha_fin"]), materiales=[], herramientas=[], planos=[])
+    resultado = await db.proyectos.insert_one(proyecto)
+    candidatos.append({"_id": resultado.inserted_id, "fecha_inicio": inicio})
+    creados.append(resultado.inserted_id)
+    return resultado.inserted_id
+
+
+# Recorre por _id los documentos que aún tienen copias y las cambia por ids en lotes; los
+# proyectos de todo el lote se buscan con una sola consulta por nombre. Cada escritura lleva en
+# el filtro el arreglo leído, así que puede correr con la aplicación en línea: si el documento
+# cambió entre la lectura y la escritura se omite y se toma en la siguiente pasada.
+async def migrar_coleccion(db, coleccion: str, tamano_lote: int = TAMANO_LOTE) -> dict:
+    campo = REFERENCIAS_PROYECTOS[coleccion]
+    resumen = {"coleccion": coleccion, "revisados": 0, "convertidos": 0, "proyectos_creados": 0, "errores": []}
+    ultimo = None
+    while True:
+        filtro = {campo: {"$elemMatch": {"$type": "object"}}}
+        if ultimo is not None:
+            filtro["_id"] = {"$gt": ultimo}
+        lote = await db[coleccion].find(filtro, {campo: 1}).sort("_id", 1).limit(tamano_lote).to_list(length=tamano_lote)
+        if not lote:
+            return resumen
+        nombres = list({copia.get("nombre") for documento in lote for copia in documento[campo] if isinstance(copia, dict)})
+        por_nombre: Dict[str, List[dict]] = {}
+        async for proyecto in db.proyectos.find({"nombre": {"$in": nombres}}, {"nombre": 1, "fecha_inicio": 1}).sort("_id", 1):
+            por_nombre.setdefault(proyecto["nombre"], []).append(proyecto)
+        operaciones, escritos, creados = [], [], []
+        for documento in lote:
+            try:
+                ids = [
+                    await _id_proyecto(db, elemento, por_nombre, creados) if isinstance(elemento, dict) else elemento
+                    for elemento in documento[campo]
+                ]
+            except ValueError as e:
+                resumen["errores"].append({"_id": str(documento["_id"]), "error": str(e)})
+                continue
+            operaciones.append(UpdateOne({"_id": documento["_id"], campo: documento[campo]}, {"$set": {campo: list(dict.fromkeys(ids))}, **INCREMENTO}))
+            escritos.append(documento["_id"])
+        if operaciones:
+            resultado = await db[coleccion].bulk_write(operaciones, ordered=False)
+            resumen["convertidos"] += resultado.modified_count
+            for documento_id in escritos:
+                await cache.invalidar(coleccion, documento_id)
+        resumen["proyectos_creados"] += len(creados)
+        resumen["revisados"] += len(lote)
+        ultimo = lote[-1]["_id"]
+
+
+# Cambia por ObjectId los ids guardados como texto, en lotes por _id y con los valores leídos en
+# el filtro de cada escritura, igual que migrar_coleccion. Un texto que no es un id se deja como
+# está y se reporta.
+async def migrar_ids_texto(db, coleccion: str, tamano_lote: int = TAMANO_LOTE) -> dict:
+    campos = REFERENCIAS_TEXTO[coleccion]
+    resumen = {"coleccion": coleccion, "revisados": 0, "convertidos": 0, "errores": []}
+    ultimo = None
+    while True:
+        filtro = {"$or": [{campo: {"$type": "string"}} for campo in campos]}
+        if ultimo is not None:
+            filtro["_id"] = {"$gt": ultimo}
+        lote = await db[coleccion].find(filtro, {campo: 1 for campo in campos}).sort("_id", 1).limit(tamano_lote).to_list(length=tamano_lote)
+        if not lote:
+            return resumen
+        operaciones, escritos = [], []
+        for documento in lote:
+            convertidos, invalidos = {}, []
+            for campo in campos:
+                valor = documento.get(campo)
+                if isinstance(valor, str):
+                    try:
+                        convertidos[campo] = _a_object_id(valor)
+                    except ValueError:
+                        invalidos.append(campo)
+            if invalidos:
+                resumen["errores"].append({"_id": str(documento["_id"]), "error": f"No son ids: {', '.join(invalidos)}"})
+            if convertidos:
+                leidos = {campo: documento[campo] for campo in convertidos}
+                operaciones.append(UpdateOne({"_id": documento["_id"], **leidos}, {"$set": convertidos, **INCREMENTO}))
+                escritos.append(documento["_id"])
+        if operaciones:
+            resultado = await db[coleccion].bulk_write(operaciones, ordered=False)
+            resumen["convertidos"] += resultado.modified_count
+            for documento_id in escritos:
+                await cache.invalidar(coleccion, documento_id)
+        resumen["revisados"] += len(lote)
+        ultimo = lote[-1]["_id"]
+
+
+async def migrar_referencias(db=None, colecciones: Optional[List[str]] = None, tamano_lote: int = TAMANO_LOTE) -> List[dict]:
+    db = db if db is not None else conexion.db
+    resumenes = []
+    for coleccion in colecciones or [*REFERENCIAS_PROYECTOS, *REFERENCIAS_TEXTO]:
+        migrar = migrar_coleccion if coleccion in REFERENCIAS_PROYECTOS else migrar_ids_texto
+        resumenes.append(await migrar(db, coleccion, tamano_lote))
+    return resumenes
+
+
+if __name__ == "__main__":
+    from resumenes import reconstruir_resumenes
+
+    migrables = [*REFERENCIAS_PROYECTOS, *REFERENCIAS_TEXTO]
+    parser = argparse.ArgumentParser(description="Cambia las copias embebidas y los ids en texto por referencias")
+    parser.add_argument("colecciones", nargs="*", metavar="coleccion", help=", ".join(migrables))
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    argumentos = parser.parse_args()
+    desconocidas = set(argumentos.colecciones) - set(migrables)
+    if desconocidas:
+        parser.error(f"colecciones sin referencias que migrar: {', '.join(sorted(desconocidas))}")
+
+    async def migrar_y_reconstruir() -> List[dict]:
+        resumenes = await migrar_referencias(colecciones=argumentos.colecciones, tamano_lote=argumentos.lote)
+        # Los resúmenes de pedidos usan el id del proyecto o proveedor como _id
+        if any(resumen["coleccion"] == "pedidos" and resumen["convertidos"] for resumen in resumenes):
+            await reconstruir_resumenes()
+            print("resúmenes de pedidos reconstruidos")
+        return resumenes
+
+    for resumen in asyncio.run(migrar_y_reconstruir()):
+        creados = f", {resumen['proyectos_creados']} proyectos creados" if "proyectos_creados" in resumen else ""
+        print(
+            f"{resumen['coleccion']}: {resumen['revisados']} revisados, {resumen['convertidos']} convertidos"
+            f"{creados}, {len(resumen['errores'])} errores"
+        )
+        for error in resumen["errores"]:
+            print(f"  {error['_id']}: {error['error']}")
@@ -0,0 +1,115 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+
+import conexion
+from crud import object_id
+from fechas import Fecha, rango_fechas
+from paginacion import flujo_ndjson
+from serializacion import RespuestaORJSON
+
+router = APIRouter(prefix="/reportes", tags=["reportes"])
+
+
+# Opciones comunes: allowDiskUse para agrupaciones que no caben en memoria y salida NDJSON
+class OpcionesReporte:
+    def __init__(
+        self,
+        allow_disk_use: bool = False,
+        formato: str = Query("json", pattern="^(json|ndjson)$"),
+    ):
+        self.allow_disk_use = allow_disk_use
+        self.formato = formato
+
+
+async def _ejecutar(coleccion: str, pipeline: List[dict], opciones: OpcionesReporte):
+    documentos = conexion.db[coleccion].aggregate(pipeline, allowDiskUse=opciones.allow_disk_use)
+    if opciones.formato == "ndjson":
+        return flujo_ndjson(documentos)
+    return RespuestaORJSON({"estatus": "success", "mensaje": "Reporte generado", "reporte": await documentos.to_list(length=None)})
+
+
+def _costo(cantidad: str, precio: str) -> dict:
+    return {"$multiply": [{"$ifNull": [cantidad, 0]}, {"$ifNull": [precio, 0]}]}
+
+
+def pipeline_costo_proyectos(filtro: dict) -> List[dict]:
+    return [
+        {"$match": filtro},
+        {"$project": {
+            "_id": 0,
+            "idProyecto": {"$toString": "$_id"},
+            "nombre": 1,
+            "estado": 1,
+            "responsable": 1,
+            "partidas": {"$size": {"$ifNull": ["$materiales", []]}},
+            "costo_materiales": {"$sum": {"$map": {
+                "input": {"$ifNull": ["$materiales", []]},
+                "as": "material",
+                "in": _costo("$$material.cantidad", "$$material.precio_unitario"),
+            }}},
+        }},
+        {"$sort": {"costo_materiales": -1}},
+    ]
+
+
+# El precio sale del material referenciado; el $lookup usa el índice de _id de materiales
+def pipeline_gasto_proveedores(filtro: dict) -> List[dict]:
+    return [
+        {"$match": filtro},
+        {"$lookup": {"from": "materiales", "localField": "material_id", "foreignField": "_id", "as": "_material"}},
+        {"$group": {
+            "_id": {"proveedor_id": "$proveedor_id", "mes": {"$dateToString": {"format": "%Y-%m", "date": "$fecha_pedido"}}},
+            "pedidos": {"$sum": 1},
+            "cantidad": {"$sum": "$cantidad"},
+            "gasto": {"$sum": _costo("$cantidad", {"$arrayElemAt": ["$_material.precio_unitario", 0]})},
+        }},
+        {"$sort": {"_id.proveedor_id": 1, "_id.mes": 1}},
+        {"$project": {"_id": 0, "proveedor_id": "$_id.proveedor_id", "mes": "$_id.mes", "pedidos": 1, "cantidad": 1, "gasto": 1}},
+    ]
+
+
+def pipeline_consumo_categorias(filtro: dict) -> List[dict]:
+    return [
+        {"$match": filtro},
+        {"$unwind": "$materiales"},
+        {"$group": {
+            "_id": "$materiales.categoria",
+            "partidas": {"$sum": 1},
+            "cantidad": {"$sum": "$materiales.cantidad"},
+            "costo": {"$sum": _costo("$materiales.cantidad", "$materiales.precio_unitario")},
+        }},
+        {"$sort": {"costo": -1}},
+        {"$project": {"_id": 0, "categoria": "$_id", "partidas": 1, "cantidad": 1, "costo": 1}},
+    ]
+
+
+# Rutas de reportes
+@router.get("/costo-proyectos")
+async def reporte_costo_proyectos(estado: Optional[str] = None, opciones: OpcionesReporte = Depends()):
+    filtro = {"estado": estado} if estado else {}
+    return await _ejecutar("proyectos", pipeline_costo_proyectos(filtro), opciones)
+
+@router.get("/costo-proyectos/{idProyecto}")
+async def reporte_costo_proyecto(idProyecto: str, opciones: OpcionesReporte = Depends()):
+    return await _ejecutar("proyectos", pipeline_costo_proyectos({"_id": object_id(idProyecto)}), opciones)
+
+@router.get("/gasto-proveedores")
+async def reporte_gasto_proveedores(
+    proveedor_id: Optional[str] = None,
+    estatus: Optional[str] = None,
+    desde: Optional[Fecha] = None,
+    hasta: Optional[Fecha] = None,
+    opciones: OpcionesReporte = Depends(),
+):
+    filtro = rango_fechas("fecha_pedido", desde, hasta)
+    if proveedor_id:
+        filtro["proveedor_id"] = object_id(proveedor_id)
+    if estatus:
+        filtro["estatus"] = estatus
+    return await _ejecutar("pedidos", pipeline_gasto_proveedores(filtro), opciones)
+
+@router.get("/consumo-categorias")
+async def reporte_consumo_categorias(estado: Optional[str] = None, opciones: OpcionesReporte = Depends()):
+    filtro = {"estado": estado} if estado else {}
+    return await _ejecutar("proyectos", pipeline_consumo_categorias(filtro), opciones)
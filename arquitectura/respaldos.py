@@ -0,0 +1,261 @@
+# Respaldos de las colecciones en archivos BSON comprimidos, para sembrar otro ambiente sin
+# pasar por la API. Desde arquitectura/:
+#   python -m respaldos exportar /ruta/respaldo                          # todas las colecciones
+#   python -m respaldos exportar /ruta/respaldo pedidos --trabajadores 8
+#   python -m respaldos importar /ruta/respaldo --reemplazar
+# Una corrida interrumpida se retoma con el mismo comando (sin --reemplazar): cada parte anota
+# los lotes que ya escribió o insertó y sigue desde ahí.
+import argparse
+import asyncio
+import gzip
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import bson
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+import conexion
+from fechas import TAMANO_LOTE
+from indices import INDICES, crear_indices
+
+COLECCIONES = ("proyectos", "materiales", "proveedores", "pedidos", "clientes", "trabajadores")
+TRABAJADORES = int(os.getenv("ARQUITECTURA_TRABAJADORES_RESPALDO", "4"))
+NIVEL_COMPRESION = 6
+DUPLICADO = 11000
+
+# Cada colección se parte en rangos de _id (todos son ObjectId) y cada parte va a su propio
+# archivo <coleccion>.<parte>.bson.gz. Cada lote es un miembro gzip completo, así que
+# `cat pedidos.*.bson.gz | gunzip` da el .bson que lee mongorestore. Junto a cada archivo,
+# <coleccion>.<parte>.lotes anota en JSON por línea dónde empieza cada lote, cuántos documentos
+# lleva y su último _id; <coleccion>.json guarda los rangos.
+
+
+def _archivo(directorio: Path, coleccion: str, parte: int, extension: str) -> Path:
+    return directorio / f"{coleccion}.{parte:03d}.{extension}"
+
+
+# Una línea a medias es de una corrida interrumpida al anotarla; se descarta del archivo para
+# que las anotaciones siguientes no queden pegadas a ella
+def _leer_lineas(ruta: Path) -> List[dict]:
+    if not ruta.exists():
+        return []
+    contenido = ruta.read_text(encoding="utf-8")
+    lineas = []
+    for linea in contenido.splitlines():
+        try:
+            lineas.append(json_util.loads(linea))
+        except ValueError:
+            break
+    validas = "".join(json_util.dumps(registro) + "\n" for registro in lineas)
+    if validas != contenido:
+        ruta.write_text(validas, encoding="utf-8")
+    return lineas
+
+
+def _anotar(ruta: Path, registro: dict):
+    with ruta.open("a", encoding="utf-8") as salida:
+        salida.write(json_util.dumps(registro) + "\n")
+
+
+# Límites de `partes` rangos de _id con aproximadamente los mismos documentos; cada límite se
+# ubica con un salto sobre el índice de _id
+async def _rangos(coleccion, partes: int) -> List[Tuple[Optional[bson.ObjectId], Optional[bson.ObjectId]]]:
+    total = await coleccion.estimated_document_count()
+    limites: List[Optional[bson.ObjectId]] = [None]
+    for numero in range(1, partes if total >= partes else 1):
+        encontrados = await coleccion.find({}, {"_id": 1}).sort("_id", 1).skip(total * numero // partes).limit(1).to_list(length=1)
+        if encontrados and encontrados[0]["_id"] != limites[-1]:
+            limites.append(encontrados[0]["_id"])
+    limites.append(None)
+    return list(zip(limites, limites[1:]))
+
+
+def _filtro_rango(desde, hasta, ultimo) -> dict:
+    rango = {}
+    if ultimo is not None:
+        rango["$gt"] = ultimo
+    elif desde is not None:
+        rango["$gte"] = desde
+    if hasta is not None:
+        rango["$lt"] = hasta
+    return {"_id": rango} if rango else {}
+
+
+def _escribir_lote(archivo: Path, crudos: List[bytes]) -> int:
+    comprimido = gzip.compress(b"".join(crudos), NIVEL_COMPRESION)
+    with archivo.open("ab") as salida:
+        salida.write(comprimido)
+    return len(comprimido)
+
+
+# Lo que quedó en el archivo después del último lote anotado es de una corrida interrumpida
+def _recortar(archivo: Path, tamano: int):
+    with archivo.open("ab") as salida:
+        salida.truncate(tamano)
+
+
+async def _exportar_parte(coleccion, directorio: Path, parte: int, desde, hasta, tamano_lote: int) -> dict:
+    archivo = _archivo(directorio, coleccion.name, parte, "bson.gz")
+    bitacora = _archivo(directorio, coleccion.name, parte, "lotes")
+    lotes = _leer_lineas(bitacora)
+    if lotes and lotes[-1].get("fin"):
+        lotes.pop()
+    else:
+        ultimo = lotes[-1]["ultimo"] if lotes else None
+        posicion = lotes[-1]["desplazamiento"] + lotes[-1]["bytes"] if lotes else 0
+        await asyncio.to_thread(_recortar, archivo, posicion)
+        cursor = coleccion.find(_filtro_rango(desde, hasta, ultimo)).sort("_id", 1).batch_size(tamano_lote)
+        crudos: List[bytes] = []
+        async for documento in cursor:
+            crudos.append(bson.encode(documento))
+            if len(crudos) >= tamano_lote:
+                lotes.append(await _guardar_lote(archivo, bitacora, crudos, posicion, documento["_id"]))
+                posicion += lotes[-1]["bytes"]
+                crudos = []
+        if crudos:
+            lotes.append(await _guardar_lote(archivo, bitacora, crudos, posicion, bson.decode(crudos[-1])["_id"]))
+        _anotar(bitacora, {"fin": True})
+    return {"documentos": sum(lote["documentos"] for lote in lotes), "bytes": sum(lote["bytes"] for lote in lotes), "lotes": len(lotes)}
+
+
+# La compresión y la escritura corren en un hilo (zlib suelta el GIL) mientras las demás partes
+# siguen leyendo de MongoDB; la anotación va después, así que nunca apunta a datos incompletos
+async def _guardar_lote(archivo: Path, bitacora: Path, crudos: List[bytes], posicion: int, ultimo) -> dict:
+    escritos = await asyncio.to_thread(_escribir_lote, archivo, crudos)
+    lote = {"desplazamiento": posicion, "bytes": escritos, "documentos": len(crudos), "ultimo": ultimo}
+    _anotar(bitacora, lote)
+    return lote
+
+
+async def exportar_coleccion(db, directorio: Path, coleccion: str, trabajadores: int = TRABAJADORES, tamano_lote: int = TAMANO_LOTE) -> dict:
+    inicio = time.perf_counter()
+    manifiesto = directorio / f"{coleccion}.json"
+    if manifiesto.exists():
+        rangos = [(parte["desde"], parte["hasta"]) for parte in json_util.loads(manifiesto.read_text(encoding="utf-8"))["partes"]]
+    else:
+        rangos = await _rangos(db[coleccion], trabajadores)
+        contenido = {"coleccion": coleccion, "partes": [{"desde": desde, "hasta": hasta} for desde, hasta in rangos]}
+        manifiesto.write_text(json_util.dumps(contenido), encoding="utf-8")
+    partes = await asyncio.gather(*(
+        _exportar_parte(db[coleccion], directorio, parte, desde, hasta, tamano_lote) for parte, (desde, hasta) in enumerate(rangos)
+    ))
+    return {
+        "coleccion": coleccion,
+        "documentos": sum(parte["documentos"] for parte in partes),
+        "bytes": sum(parte["bytes"] for parte in partes),
+        "lotes": sum(parte["lotes"] for parte in partes),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+
+def _leer_lote(archivo: Path, desplazamiento: int, tamano: int) -> List[dict]:
+    with archivo.open("rb") as entrada:
+        entrada.seek(desplazamiento)
+        return bson.decode_all(gzip.decompress(entrada.read(tamano)))
+
+
+# Inserciones sin orden: un lote repetido tras una interrupción solo choca con los _id que ya
+# estaban, y esos errores se ignoran
+async def _insertar(coleccion, documentos: List[dict]):
+    try:
+        await coleccion.insert_many(documentos, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICADO for error in e.details["writeErrors"]):
+            raise
+
+
+async def importar_coleccion(
+    db, directorio: Path, coleccion: str, trabajadores: int = TRABAJADORES, reemplazar: bool = False
+) -> dict:
+    inicio = time.perf_counter()
+    manifiesto = directorio / f"{coleccion}.json"
+    if not manifiesto.exists():
+        raise ValueError(f"No hay respaldo de {coleccion} en {directorio}")
+    partes = len(json_util.loads(manifiesto.read_text(encoding="utf-8"))["partes"])
+    if reemplazar:
+        await db[coleccion].drop()
+        for parte in range(partes):
+            _archivo(directorio, coleccion, parte, "importados").unlink(missing_ok=True)
+    pendientes: List[Tuple[int, int, dict]] = []
+    for parte in range(partes):
+        lotes = _leer_lineas(_archivo(directorio, coleccion, parte, "lotes"))
+        if not lotes or not lotes[-1].get("fin"):
+            raise ValueError(f"La exportación de {coleccion} no terminó; vuelva a correr exportar")
+        importados = {registro["lote"] for registro in _leer_lineas(_archivo(directorio, coleccion, parte, "importados"))}
+        pendientes.extend((parte, numero, lote) for numero, lote in enumerate(lotes[:-1]) if numero not in importados)
+    resumen = {"coleccion": coleccion, "documentos": 0, "lotes": 0}
+    siguientes = iter(pendientes)
+
+    # Cada trabajador descomprime en un hilo y deja un insert_many en vuelo
+    async def trabajador():
+        for parte, numero, lote in siguientes:
+            archivo = _archivo(directorio, coleccion, parte, "bson.gz")
+            documentos = await asyncio.to_thread(_leer_lote, archivo, lote["desplazamiento"], lote["bytes"])
+            await _insertar(db[coleccion], documentos)
+            _anotar(_archivo(directorio, coleccion, parte, "importados"), {"lote": numero})
+            resumen["documentos"] += len(documentos)
+            resumen["lotes"] += 1
+
+    await asyncio.gather(*(trabajador() for _ in range(trabajadores)))
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+# Las colecciones corren a la vez, cada una con su grupo de trabajadores
+async def exportar(directorio: Path, colecciones: Optional[List[str]] = None, trabajadores: int = TRABAJADORES, tamano_lote: int = TAMANO_LOTE, db=None) -> List[dict]:
+    db = db if db is not None else conexion.db
+    directorio.mkdir(parents=True, exist_ok=True)
+    return list(await asyncio.gather(*(
+        exportar_coleccion(db, directorio, coleccion, trabajadores, tamano_lote) for coleccion in colecciones or COLECCIONES
+    )))
+
+
+# Los índices se crean al final, sobre los datos ya cargados, y los resúmenes de pedidos se
+# recalculan porque no forman parte del respaldo
+async def importar(directorio: Path, colecciones: Optional[List[str]] = None, trabajadores: int = TRABAJADORES, reemplazar: bool = False, db=None) -> List[dict]:
+    from resumenes import reconstruir_resumenes
+
+    db = db if db is not None else conexion.db
+    colecciones = colecciones or [coleccion for coleccion in COLECCIONES if (directorio / f"{coleccion}.json").exists()]
+    resumenes = list(await asyncio.gather(*(
+        importar_coleccion(db, directorio, coleccion, trabajadores, reemplazar) for coleccion in colecciones
+    )))
+    con_indices = [coleccion for coleccion in colecciones if coleccion in INDICES]
+    if con_indices:
+        await crear_indices(db, con_indices)
+    if "pedidos" in colecciones:
+        await reconstruir_resumenes(db)
+    return resumenes
+
+
+def _describir(resumen: Dict) -> str:
+    detalle = f"{resumen['coleccion']}: {resumen['documentos']} documentos en {resumen['lotes']} lotes"
+    if "bytes" in resumen:
+        detalle += f", {resumen['bytes'] / 1048576:.1f} MB"
+    return detalle + f", {resumen['segundos']} s"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta o importa las colecciones en archivos BSON comprimidos")
+    parser.add_argument("operacion", choices=("exportar", "importar"))
+    parser.add_argument("directorio", type=Path)
+    parser.add_argument("colecciones", nargs="*", metavar="coleccion", help=", ".join(COLECCIONES))
+    parser.add_argument("--trabajadores", type=int, default=TRABAJADORES, help="partes por colección al exportar, inserciones en vuelo al importar")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    parser.add_argument("--reemplazar", action="store_true", help="al importar, borra las colecciones y empieza de cero")
+    argumentos = parser.parse_args()
+    desconocidas = set(argumentos.colecciones) - set(COLECCIONES)
+    if desconocidas:
+        parser.error(f"colecciones desconocidas: {', '.join(sorted(desconocidas))}")
+    if argumentos.operacion == "exportar":
+        resultado = exportar(argumentos.directorio, argumentos.colecciones, argumentos.trabajadores, argumentos.lote)
+    else:
+        resultado = importar(argumentos.directorio, argumentos.colecciones, argumentos.trabajadores, argumentos.reemplazar)
+    try:
+        for resumen in asyncio.run(resultado):
+            print(_describir(resumen))
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
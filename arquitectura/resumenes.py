@@ -0,0 +1,135 @@
+# Resúmenes materializados de pedidos por proyecto y por proveedor. Se mantienen con
+# deltas $inc desde cada escritura de pedidos; para recalcularlos desde cero, desde
+# arquitectura/:
+#   python -m resumenes
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException
+from pymongo import UpdateOne
+
+import conexion
+from serializacion import RespuestaORJSON
+
+# Dimensión del resumen -> (colección del resumen, campo del pedido)
+DIMENSIONES = {
+    "proyectos": ("resumen_proyectos", "proyecto_id"),
+    "proveedores": ("resumen_proveedores", "proveedor_id"),
+}
+
+router = APIRouter(prefix="/resumenes", tags=["resumenes"])
+
+
+# Los estatus se usan como nombres de campo, así que no pueden llevar puntos ni empezar con $
+def _campo_estatus(estatus: str) -> str:
+    return "por_estatus." + (str(estatus).replace(".", "_").lstrip("$") or "_")
+
+
+def _sumar(deltas: Dict[str, float], pedido: dict, signo: int):
+    deltas["pedidos"] += signo
+    deltas["cantidad"] += signo * (pedido.get("cantidad") or 0)
+    deltas[_campo_estatus(pedido.get("estatus"))] += signo
+
+
+# Convierte los pares (antes, después) de un lote de pedidos en una escritura por resumen tocado
+def _operaciones(cambios: List[Tuple[Optional[dict], Optional[dict]]], campo: str) -> List[UpdateOne]:
+    deltas: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+    ultimos: Dict[str, str] = {}
+    for antes, despues in cambios:
+        if antes and antes.get(campo) is not None:
+            _sumar(deltas[antes[campo]], antes, -1)
+        if despues and despues.get(campo) is not None:
+            _sumar(deltas[despues[campo]], despues, 1)
+            fecha = despues.get("fecha_pedido")
+            if fecha is not None and (despues[campo] not in ultimos or fecha > ultimos[despues[campo]]):
+                ultimos[despues[campo]] = fecha
+    operaciones = []
+    for llave in set(deltas) | set(ultimos):
+        incrementos = {nombre: valor for nombre, valor in deltas[llave].items() if valor}
+        actualizacion = {}
+        if incrementos:
+            actualizacion["$inc"] = incrementos
+        if llave in ultimos:
+            actualizacion["$max"] = {"ultimo_pedido": ultimos[llave]}
+        if actualizacion:
+            operaciones.append(UpdateOne({"_id": llave}, actualizacion, upsert=True))
+    return operaciones
+
+
+# Observador del repositorio de pedidos. ultimo_pedido solo avanza; si se borra el pedido
+# más reciente queda la fecha anterior hasta la siguiente reconstrucción.
+async def actualizar_resumenes(cambios: List[Tuple[Optional[dict], Optional[dict]]]):
+    for coleccion, campo in DIMENSIONES.values():
+        operaciones = _operaciones(cambios, campo)
+        if operaciones:
+            await conexion.db[coleccion].bulk_write(operaciones, ordered=False, session=conexion.sesion_actual.get())
+
+
+# Misma regla que _campo_estatus: puntos a _, sin $ inicial y _ si queda vacío. El estatus se
+# normaliza antes de agrupar para que dos estatus que terminan en la misma llave se sumen.
+ESTATUS_NORMALIZADO = {"$let": {
+    "vars": {"limpio": {"$ltrim": {
+        "input": {"$replaceAll": {
+            "input": {"$toString": {"$ifNull": ["$estatus", "None"]}}, "find": ".", "replacement": "_",
+        }},
+        "chars": {"$literal": "$"},
+    }}},
+    "in": {"$cond": [{"$eq": ["$$limpio", ""]}, "_", "$$limpio"]},
+}}
+
+
+# Los pedidos sin la referencia no entran en ningún resumen, igual que en _operaciones
+def pipeline_resumen(campo: str, destino: str) -> List[dict]:
+    return [
+        {"$match": {campo: {"$ne": None}}},
+        {"$group": {
+            "_id": {"llave": f"${campo}", "estatus": ESTATUS_NORMALIZADO},
+            "pedidos": {"$sum": 1},
+            "cantidad": {"$sum": "$cantidad"},
+            "ultimo_pedido": {"$max": "$fecha_pedido"},
+        }},
+        {"$group": {
+            "_id": "$_id.llave",
+            "pedidos": {"$sum": "$pedidos"},
+            "cantidad": {"$sum": "$cantidad"},
+            "ultimo_pedido": {"$max": "$ultimo_pedido"},
+            "por_estatus": {"$push": {
+                "k": "$_id.estatus",
+                "v": "$pedidos",
+            }},
+        }},
+        {"$addFields": {"por_estatus": {"$arrayToObject": "$por_estatus"}}},
+        {"$out": destino},
+    ]
+
+
+# Recalcula los resúmenes desde db.pedidos; $out reemplaza cada colección de forma atómica
+async def reconstruir_resumenes(db=None):
+    db = db if db is not None else conexion.db
+    for coleccion, campo in DIMENSIONES.values():
+        await db.pedidos.aggregate(pipeline_resumen(campo, coleccion), allowDiskUse=True).to_list(length=None)
+
+
+# Rutas de resúmenes
+@router.get("/{dimension}/{llave}")
+async def consultar_resumen(dimension: str, llave: str):
+    if dimension not in DIMENSIONES:
+        raise HTTPException(status_code=404, detail="Resumen no encontrado")
+    coleccion, campo = DIMENSIONES[dimension]
+    # Las referencias de los pedidos son ObjectId; otro texto se busca tal cual
+    resumen = await conexion.db[coleccion].find_one({"_id": ObjectId(llave) if ObjectId.is_valid(llave) else llave})
+    if not resumen:
+        raise HTTPException(status_code=404, detail="Resumen no encontrado")
+    resumen[campo] = resumen.pop("_id")
+    return RespuestaORJSON({"estatus": "success", "mensaje": "Resumen encontrado", "resumen": resumen})
+
+@router.post("/reconstruir")
+async def reconstruir():
+    await reconstruir_resumenes()
+    return {"estatus": "success", "mensaje": "Resúmenes reconstruidos"}
+
+
+if __name__ == "__main__":
+    asyncio.run(reconstruir_resumenes())
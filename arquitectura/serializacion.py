@@ -0,0 +1,40 @@
+import json
+import time
+from typing import Any
+
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+
+from metricas import registrar_serializacion
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+# Tipos de BSON que no son JSON; fechas y datetime los resuelve orjson de forma nativa
+def _por_defecto(valor: Any):
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, Decimal128):
+        return str(valor.to_decimal())
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    raise TypeError(f"{type(valor).__name__} no es serializable a JSON")
+
+
+def a_json(contenido: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(contenido, default=_por_defecto)
+    return json.dumps(contenido, default=_por_defecto, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Respuesta JSON sin pasar por jsonable_encoder: los documentos de Motor ya son dicts y
+# orjson los codifica directamente. Las rutas calientes la devuelven tal cual.
+class RespuestaORJSON(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        inicio = time.perf_counter()
+        cuerpo = a_json(content)
+        registrar_serializacion(time.perf_counter() - inicio)
+        return cuerpo
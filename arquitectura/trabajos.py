@@ -0,0 +1,485 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Type
+
+from bson import ObjectId, encode
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+
+import conexion
+import costos
+import materiales
+from admision import carril
+from carga_masiva import cargar_elementos, contar, leer_elementos
+from crud import object_id
+from fechas import TAMANO_LOTE
+from serializacion import RespuestaORJSON, a_json
+
+# Trabajos en segundo plano para operaciones largas: acumulados de costos de los proyectos e
+# importación de catálogos de materiales. Cada trabajo queda en la colección `trabajos` y sus
+# entradas y resultados van por lotes en `trabajos_lotes`. Los ejecutores son tareas de asyncio
+# del mismo proceso y los pasos de CPU van a un pool de procesos, así que no hace falta un broker
+# y ninguna petición espera a que un trabajo termine.
+EJECUTORES = int(os.getenv("ARQUITECTURA_TRABAJOS_EJECUTORES", "2"))
+# Con 0, los pasos de CPU corren en un hilo
+PROCESOS = int(os.getenv("ARQUITECTURA_TRABAJOS_PROCESOS", "2"))
+SONDEO_SEGUNDOS = float(os.getenv("ARQUITECTURA_TRABAJOS_SONDEO_SEGUNDOS", "5"))
+# Un trabajo en curso que no avanza en este tiempo se da por abandonado (su proceso murió) y
+# otro ejecutor lo retoma, hasta INTENTOS_MAX veces
+VENCIMIENTO_SEGUNDOS = float(os.getenv("ARQUITECTURA_TRABAJOS_VENCIMIENTO_SEGUNDOS", "120"))
+INTENTOS_MAX = int(os.getenv("ARQUITECTURA_TRABAJOS_INTENTOS_MAX", "3"))
+LATIDO_SEGUNDOS = VENCIMIENTO_SEGUNDOS / 4
+RETENCION_HORAS = float(os.getenv("ARQUITECTURA_TRABAJOS_RETENCION_HORAS", "24"))
+# Tope de bytes en BSON de un lote de entrada, lejos de los 16 MB de un documento
+BYTES_LOTE = 4 * 1024 * 1024
+COLECCION_TRABAJOS = "trabajos"
+COLECCION_LOTES = "trabajos_lotes"
+
+registro = logging.getLogger("arquitectura.trabajos")
+
+
+class SolicitudTrabajo(BaseModel):
+    tipo: str
+    parametros: Dict[str, Any] = {}
+
+
+class ParametrosCosto(BaseModel):
+    estado: Optional[str] = None
+
+
+class SinParametros(BaseModel):
+    pass
+
+
+class TrabajoPerdido(Exception):
+    pass
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _trabajos():
+    return conexion.db[COLECCION_TRABAJOS]
+
+
+def _lotes():
+    return conexion.db[COLECCION_LOTES]
+
+
+# Un trabajo reclamado por este ejecutor. Cada reclamo lleva un `intento` nuevo y todas las
+# escrituras lo exigen, así que si otro ejecutor retomó el trabajo, este se entera y se detiene.
+class Ejecucion:
+    def __init__(self, trabajo: dict):
+        self.trabajo = trabajo
+        self.filtro = {"_id": trabajo["_id"], "intento": trabajo["intento"]}
+
+    @property
+    def avance(self) -> dict:
+        return self.trabajo.get("avance") or {}
+
+    async def avanzar(self, **avance):
+        resultado = await _trabajos().update_one(self.filtro, {"$set": {"avance": avance, "latido": _ahora()}})
+        if not resultado.matched_count:
+            raise TrabajoPerdido()
+        self.trabajo["avance"] = avance
+
+    # Renueva el latido mientras el trabajo corre, aunque un lote tarde más que el vencimiento;
+    # termina si otro ejecutor ya lo retomó
+    async def latir(self):
+        while True:
+            await asyncio.sleep(LATIDO_SEGUNDOS)
+            try:
+                resultado = await _trabajos().update_one(self.filtro, {"$set": {"latido": _ahora()}})
+            except Exception:
+                registro.exception("No se pudo renovar el latido del trabajo %s", self.trabajo["_id"])
+                continue
+            if not resultado.matched_count:
+                return
+
+    # Cada lote de resultado se guarda con su número; repetirlo en un reintento lo reemplaza
+    async def emitir(self, numero: int, filas: List[dict]):
+        llave = {"trabajo_id": self.trabajo["_id"], "parte": "resultado", "numero": numero}
+        await _lotes().replace_one(llave, {**llave, "filas": filas}, upsert=True)
+
+    async def descartar_resultados(self, desde: int = 0):
+        await _lotes().delete_many({"trabajo_id": self.trabajo["_id"], "parte": "resultado", "numero": {"$gte": desde}})
+
+    async def entradas(self, desde: int = 0) -> AsyncIterator[dict]:
+        filtro = {"trabajo_id": self.trabajo["_id"], "parte": "entrada", "numero": {"$gte": desde}}
+        async for lote in _lotes().find(filtro).sort("numero", ASCENDING).batch_size(1):
+            yield lote
+
+    async def terminar(self, estado: str, **campos):
+        ahora = _ahora()
+        expira = ahora + timedelta(hours=RETENCION_HORAS)
+        resultado = await _trabajos().update_one(self.filtro, {"$set": {"estado": estado, "fin": ahora, "latido": ahora, "expira": expira, **campos}})
+        if resultado.matched_count:
+            await _lotes().update_many({"trabajo_id": self.trabajo["_id"]}, {"$set": {"expira": expira}})
+
+
+_procesos: Optional[ProcessPoolExecutor] = None
+
+
+async def en_proceso(funcion: Callable, *argumentos):
+    global _procesos
+    if PROCESOS <= 0:
+        return await asyncio.to_thread(funcion, *argumentos)
+    if _procesos is None:
+        # spawn: un fork copiaría los hilos de Motor a medio usar
+        _procesos = ProcessPoolExecutor(PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return await asyncio.get_running_loop().run_in_executor(_procesos, funcion, *argumentos)
+
+
+async def _agrupar(cursor, tamano: int) -> AsyncIterator[List[dict]]:
+    lote = []
+    async for documento in cursor:
+        documento["_id"] = str(documento["_id"])
+        lote.append(documento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+async def _iterar(elementos: List[Any]) -> AsyncIterator[Any]:
+    for elemento in elementos:
+        yield elemento
+
+
+PROYECCION_COSTOS = {
+    "nombre": 1,
+    "estado": 1,
+    "responsable": 1,
+    "materiales.cantidad": 1,
+    "materiales.precio_unitario": 1,
+    "materiales.categoria": 1,
+}
+
+
+# Una fila por proyecto en el resultado y los totales por categoría en el resumen. Solo lee,
+# así que un reintento empieza de cero.
+async def costo_proyectos(ejecucion: Ejecucion, parametros: ParametrosCosto) -> dict:
+    filtro = {"estado": parametros.estado} if parametros.estado else {}
+    coleccion = conexion.db.proyectos
+    total = await coleccion.count_documents(filtro)
+    await ejecucion.descartar_resultados()
+    categorias: costos.Categorias = {}
+    procesados, costo_total = 0, 0.0
+    cursor = coleccion.find(filtro, PROYECCION_COSTOS).sort("_id", ASCENDING).batch_size(TAMANO_LOTE)
+    numero = 0
+    async for lote in _agrupar(cursor, TAMANO_LOTE):
+        filas, parciales = await en_proceso(costos.acumular_costos, lote)
+        costos.sumar_categorias(categorias, parciales)
+        await ejecucion.emitir(numero, filas)
+        numero += 1
+        procesados += len(filas)
+        costo_total += sum(fila["costo_materiales"] for fila in filas)
+        await ejecucion.avanzar(procesados=procesados, total=total)
+    return {"proyectos": procesados, "costo_total": costo_total, "categorias": costos.resumen_categorias(categorias)}
+
+
+# Carga el catálogo lote por lote con las mismas reglas que POST /materiales/bulk. El avance
+# guarda el siguiente lote, así que un reintento sigue desde ahí; el lote que estaba en vuelo
+# se repite, pero como cada elemento ya trae su idMaterial (ver _con_id) se vuelve un upsert.
+async def importar_materiales(ejecucion: Ejecucion, parametros: SinParametros) -> dict:
+    repositorio = materiales.repositorio
+    al_escribir = repositorio.notificar if repositorio.observadores else None
+    desde = ejecucion.avance.get("lotes", 0)
+    procesados = ejecucion.avance.get("procesados", 0)
+    conteo = ejecucion.avance.get("conteo") or contar([])
+    await ejecucion.descartar_resultados(desde)
+    async for lote in ejecucion.entradas(desde):
+        resultados = await cargar_elementos(
+            _iterar(lote["elementos"]),
+            repositorio.coleccion,
+            materiales.Material,
+            repositorio.campo_id,
+            al_escribir=al_escribir,
+            inicio=lote["inicio"],
+        )
+        await ejecucion.emitir(lote["numero"], resultados)
+        for estatus, veces in contar(resultados).items():
+            conteo[estatus] += veces
+        procesados += len(lote["elementos"])
+        await ejecucion.avanzar(lotes=lote["numero"] + 1, procesados=procesados, total=ejecucion.trabajo.get("entradas", 0), conteo=conteo)
+    return {"insertados": conteo["insertado"], "actualizados": conteo["actualizado"], "errores": conteo["error"]}
+
+
+# Un tipo de trabajo; los que llevan entrada la reciben como cuerpo de POST /jobs/{tipo}, y
+# campo_id es el campo con el que se identifica cada elemento
+class Tipo:
+    def __init__(self, ejecutar: Callable, parametros: Type[BaseModel], entrada: bool = False, campo_id: Optional[str] = None):
+        self.ejecutar = ejecutar
+        self.parametros = parametros
+        self.entrada = entrada
+        self.campo_id = campo_id
+
+
+TIPOS: Dict[str, Tipo] = {
+    "costo-proyectos": Tipo(costo_proyectos, ParametrosCosto),
+    "importar-materiales": Tipo(importar_materiales, SinParametros, entrada=True, campo_id=materiales.repositorio.campo_id),
+}
+
+
+async def _ejecutar(trabajo: dict):
+    ejecucion = Ejecucion(trabajo)
+    tipo = TIPOS.get(trabajo["tipo"])
+    if tipo is None:
+        await ejecucion.terminar("fallido", error=f"Tipo de trabajo desconocido: {trabajo['tipo']}")
+        return
+    if trabajo["intentos"] > INTENTOS_MAX:
+        await ejecucion.terminar("fallido", error="El trabajo se interrumpió demasiadas veces")
+        return
+    latido = asyncio.create_task(ejecucion.latir())
+    try:
+        resumen = await tipo.ejecutar(ejecucion, tipo.parametros(**trabajo.get("parametros", {})))
+    except TrabajoPerdido:
+        registro.warning("El trabajo %s lo retomó otro ejecutor", trabajo["_id"])
+        return
+    except asyncio.CancelledError:
+        # Al apagar, el trabajo vuelve a la cola sin gastar un intento
+        await _trabajos().update_one(ejecucion.filtro, {"$set": {"estado": "pendiente"}, "$inc": {"intentos": -1}})
+        raise
+    except Exception as e:
+        registro.exception("Falló el trabajo %s (%s)", trabajo["_id"], trabajo["tipo"])
+        await ejecucion.terminar("fallido", error=str(e) or type(e).__name__)
+        return
+    finally:
+        latido.cancel()
+    await ejecucion.terminar("terminado", resumen=resumen)
+
+
+# El más antiguo de los pendientes, o uno en curso que dejó de dar señales
+async def _reclamar() -> Optional[dict]:
+    ahora = _ahora()
+    return await _trabajos().find_one_and_update(
+        {"$or": [
+            {"estado": "pendiente"},
+            {"estado": "en_curso", "latido": {"$lt": ahora - timedelta(seconds=VENCIMIENTO_SEGUNDOS)}},
+        ]},
+        {"$set": {"estado": "en_curso", "latido": ahora, "intento": ObjectId()}, "$min": {"inicio": ahora}, "$inc": {"intentos": 1}},
+        sort=[("creado", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+_tareas: List[asyncio.Task] = []
+_aviso: Optional[asyncio.Event] = None
+
+
+# Los trabajos encolados en este proceso despiertan a los ejecutores; los de otros procesos
+# se ven en el siguiente sondeo
+async def _ejecutor():
+    while True:
+        _aviso.clear()
+        try:
+            trabajo = await _reclamar()
+        except Exception:
+            registro.exception("No se pudo reclamar un trabajo")
+            trabajo = None
+        if trabajo is None:
+            try:
+                await asyncio.wait_for(_aviso.wait(), SONDEO_SEGUNDOS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _ejecutar(trabajo)
+
+
+# Los documentos caducan por TTL en `expira`, que se fija al terminar (o al recibir una entrada)
+async def iniciar():
+    global _aviso
+    await _trabajos().create_indexes([
+        IndexModel([("estado", ASCENDING), ("creado", ASCENDING)], name="estado_1_creado_1"),
+        IndexModel([("expira", ASCENDING)], name="expira_1", expireAfterSeconds=0),
+    ])
+    await _lotes().create_indexes([
+        IndexModel([("trabajo_id", ASCENDING), ("parte", ASCENDING), ("numero", ASCENDING)], name="trabajo_id_1_parte_1_numero_1", unique=True),
+        IndexModel([("expira", ASCENDING)], name="expira_1", expireAfterSeconds=0),
+    ])
+    _aviso = asyncio.Event()
+    for numero in range(EJECUTORES):
+        _tareas.append(asyncio.create_task(_ejecutor(), name=f"trabajos-{numero}"))
+
+
+async def detener():
+    global _procesos
+    for tarea in _tareas:
+        tarea.cancel()
+    await asyncio.gather(*_tareas, return_exceptions=True)
+    _tareas.clear()
+    if _procesos is not None:
+        _procesos.shutdown(wait=False, cancel_futures=True)
+        _procesos = None
+
+
+def _nuevo(tipo: str, parametros: BaseModel, estado: str) -> dict:
+    return {
+        "_id": ObjectId(),
+        "tipo": tipo,
+        "parametros": parametros.dict(),
+        "estado": estado,
+        "creado": _ahora(),
+        "intentos": 0,
+        "avance": {},
+    }
+
+
+# Cada elemento se guarda con su id, así que repetir su lote tras una interrupción es un upsert
+# y no una segunda alta. Lo que no es un objeto JSON se guarda tal cual y falla al procesarse.
+def _con_id(elemento: Any, campo_id: Optional[str]) -> Any:
+    if isinstance(elemento, bytes):
+        try:
+            elemento = json.loads(elemento)
+        except ValueError:
+            return elemento
+    if campo_id and isinstance(elemento, dict) and elemento.get(campo_id) is None:
+        elemento[campo_id] = str(ObjectId())
+    return elemento
+
+
+# La entrada se guarda por lotes mientras llega, sin tenerla completa en memoria. Mientras
+# tanto el trabajo está "recibiendo" y caduca si la subida no termina.
+async def _guardar_entrada(trabajo_id: ObjectId, elementos: AsyncIterator[Any], expira: datetime, campo_id: Optional[str]) -> int:
+    numero, total, tamano = 0, 0, 0
+    lote: List[Any] = []
+
+    async def guardar():
+        await _lotes().insert_one({
+            "trabajo_id": trabajo_id, "parte": "entrada", "numero": numero, "inicio": total, "elementos": lote, "expira": expira,
+        })
+
+    async for elemento in elementos:
+        elemento = _con_id(elemento, campo_id)
+        # Se mide ya codificado, igual si llegó como línea NDJSON o dentro de un arreglo
+        peso = len(encode({"e": elemento}))
+        if lote and (len(lote) >= TAMANO_LOTE or tamano + peso > BYTES_LOTE):
+            await guardar()
+            numero, total, tamano, lote = numero + 1, total + len(lote), 0, []
+        lote.append(elemento)
+        tamano += peso
+    if lote:
+        await guardar()
+        total += len(lote)
+    return total
+
+
+def _a_respuesta(trabajo: dict) -> dict:
+    idTrabajo = str(trabajo["_id"])
+    respuesta = {
+        "idTrabajo": idTrabajo,
+        "tipo": trabajo["tipo"],
+        "estado": trabajo["estado"],
+        "parametros": trabajo.get("parametros", {}),
+        "avance": trabajo.get("avance") or {},
+        "intentos": trabajo.get("intentos", 0),
+        "creado": trabajo.get("creado"),
+        "inicio": trabajo.get("inicio"),
+        "fin": trabajo.get("fin"),
+    }
+    for campo in ("resumen", "error"):
+        if campo in trabajo:
+            respuesta[campo] = trabajo[campo]
+    if trabajo["estado"] == "terminado":
+        respuesta["resultado"] = f"/jobs/{idTrabajo}/resultado"
+    return respuesta
+
+
+def _tipo(nombre: str) -> Tipo:
+    tipo = TIPOS.get(nombre)
+    if tipo is None:
+        raise HTTPException(status_code=400, detail=f"Tipo de trabajo inválido; use {', '.join(TIPOS)}")
+    return tipo
+
+
+def _parametros(tipo: Tipo, valores: Dict[str, Any]) -> BaseModel:
+    try:
+        return tipo.parametros(**valores)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=[{"campo": ".".join(str(parte) for parte in error["loc"]), "mensaje": error["msg"]} for error in e.errors()],
+        )
+
+
+def _encolado(trabajo: dict) -> RespuestaORJSON:
+    if _aviso is not None:
+        _aviso.set()
+    return RespuestaORJSON(
+        {"estatus": "success", "mensaje": "Trabajo encolado", "id": str(trabajo["_id"]), "trabajo": _a_respuesta(trabajo)},
+        status_code=202,
+        headers={"Location": f"/jobs/{trabajo['_id']}"},
+    )
+
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+# Rutas de trabajos
+@router.post("", status_code=202)
+async def crear_trabajo(solicitud: SolicitudTrabajo):
+    tipo = _tipo(solicitud.tipo)
+    if tipo.entrada:
+        raise HTTPException(status_code=400, detail=f"El trabajo {solicitud.tipo} lleva datos; envíelos a POST /jobs/{solicitud.tipo}")
+    trabajo = _nuevo(solicitud.tipo, _parametros(tipo, solicitud.parametros), "pendiente")
+    await _trabajos().insert_one(trabajo)
+    return _encolado(trabajo)
+
+# El cuerpo es un arreglo JSON o NDJSON, como en /bulk; los parámetros van en la consulta
+@router.post("/{tipo}", status_code=202)
+async def crear_trabajo_con_entrada(tipo: str, request: Request):
+    definicion = _tipo(tipo)
+    if not definicion.entrada:
+        raise HTTPException(status_code=400, detail=f"El trabajo {tipo} no lleva datos; use POST /jobs")
+    trabajo = _nuevo(tipo, _parametros(definicion, dict(request.query_params)), "recibiendo")
+    expira = trabajo["creado"] + timedelta(hours=RETENCION_HORAS)
+    await _trabajos().insert_one({**trabajo, "expira": expira})
+    try:
+        trabajo["entradas"] = await _guardar_entrada(trabajo["_id"], leer_elementos(request), expira, definicion.campo_id)
+    except Exception:
+        await _lotes().delete_many({"trabajo_id": trabajo["_id"]})
+        await _trabajos().delete_one({"_id": trabajo["_id"]})
+        raise
+    await _lotes().update_many({"trabajo_id": trabajo["_id"]}, {"$unset": {"expira": ""}})
+    trabajo["estado"] = "pendiente"
+    await _trabajos().update_one(
+        {"_id": trabajo["_id"]}, {"$set": {"estado": "pendiente", "entradas": trabajo["entradas"]}, "$unset": {"expira": ""}}
+    )
+    return _encolado(trabajo)
+
+@router.get("/{idTrabajo}", openapi_extra=carril("por_id"))
+async def consultar_trabajo(idTrabajo: str):
+    trabajo = await _trabajos().find_one({"_id": object_id(idTrabajo)})
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return {"estatus": "success", "trabajo": _a_respuesta(trabajo)}
+
+# El resultado sale en NDJSON, un lote guardado a la vez
+@router.get("/{idTrabajo}/resultado")
+async def descargar_resultado(idTrabajo: str):
+    trabajo_id = object_id(idTrabajo)
+    trabajo = await _trabajos().find_one({"_id": trabajo_id}, {"estado": 1, "tipo": 1})
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if trabajo["estado"] != "terminado":
+        raise HTTPException(status_code=409, detail=f"El trabajo está {trabajo['estado'].replace('_', ' ')}")
+
+    async def generar():
+        lotes = _lotes().find({"trabajo_id": trabajo_id, "parte": "resultado"}, {"filas": 1}).sort("numero", ASCENDING).batch_size(1)
+        async for lote in lotes:
+            yield b"".join(a_json(fila) + b"\n" for fila in lote["filas"])
+
+    return StreamingResponse(
+        generar(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{trabajo["tipo"]}-{idTrabajo}.ndjson"'},
+    )
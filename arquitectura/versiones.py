@@ -0,0 +1,54 @@
+import zlib
+from typing import List, Optional
+
+# Cada documento lleva un contador que sube en cada escritura; de él salen los ETag. Los
+# documentos anteriores al contador no tienen el campo y cuentan como versión 0.
+CAMPO_VERSION = "version"
+INCREMENTO = {"$inc": {CAMPO_VERSION: 1}}
+
+
+def version_de(documento: dict) -> int:
+    return documento.get(CAMPO_VERSION) or 0
+
+
+# ETag fuerte con la versión; una representación recortada (fields=, exclude=) lleva además
+# una huella de la proyección para no confundirse con el documento completo
+def etiqueta(documento: dict, variante: Optional[str] = None) -> str:
+    if variante:
+        return f'"{version_de(documento)}-{zlib.crc32(variante.encode()):08x}"'
+    return f'"{version_de(documento)}"'
+
+
+def _etiquetas(encabezado: str) -> List[str]:
+    return [parte.strip() for parte in encabezado.split(",") if parte.strip()]
+
+
+# If-None-Match usa comparación débil: W/"3" equivale a "3"
+def coincide(if_none_match: Optional[str], actual: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(parte == "*" or parte.removeprefix("W/") == actual for parte in _etiquetas(if_none_match))
+
+
+# Versiones aceptadas por If-Match; None si no hay condición (o es "*", que solo pide que exista).
+# Una etiqueta débil o ajena nunca coincide, así que la escritura termina en 412.
+def versiones_de(if_match: Optional[str]) -> Optional[List[int]]:
+    if not if_match:
+        return None
+    versiones = []
+    for parte in _etiquetas(if_match):
+        if parte == "*":
+            return None
+        numero = parte.strip('"').split("-")[0]
+        if parte.startswith('"') and numero.isdigit():
+            versiones.append(int(numero))
+    return versiones
+
+
+# Condición de compare-and-set para el filtro de la escritura; la versión 0 incluye a los
+# documentos sin contador
+def condicion_version(versiones: List[int]) -> dict:
+    aceptadas: list = list(versiones)
+    if 0 in aceptadas:
+        aceptadas.append(None)
+    return {CAMPO_VERSION: {"$in": aceptadas}}